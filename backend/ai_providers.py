@@ -0,0 +1,471 @@
+import os
+import json
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import List, Dict, Optional, Callable, Awaitable, AsyncIterator, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Legacy single-provider configuration (only used if AI_MODELS is not set)
+AI_PRIMARY_PROVIDER = os.environ.get('AI_PRIMARY_PROVIDER')
+AI_PRIMARY_MODEL = os.environ.get('AI_PRIMARY_MODEL')
+AI_SECONDARY_PROVIDER = os.environ.get('AI_SECONDARY_PROVIDER')
+AI_SECONDARY_MODEL = os.environ.get('AI_SECONDARY_MODEL')
+AI_TERTIARY_PROVIDER = os.environ.get('AI_TERTIARY_PROVIDER')
+AI_TERTIARY_MODEL = os.environ.get('AI_TERTIARY_MODEL')
+
+# Routing / health configuration
+AI_BREAKER_FAILURE_THRESHOLD = int(os.environ.get('AI_BREAKER_FAILURE_THRESHOLD', '3'))
+AI_BREAKER_COOLDOWN_SECONDS = float(os.environ.get('AI_BREAKER_COOLDOWN_SECONDS', '60'))
+AI_HEALTH_EWMA_ALPHA = float(os.environ.get('AI_HEALTH_EWMA_ALPHA', '0.2'))
+AI_HEDGE_ENABLED = os.environ.get('AI_HEDGE_ENABLED', 'false').lower() == 'true'
+AI_HEDGE_PERCENTILE = float(os.environ.get('AI_HEDGE_PERCENTILE', '0.95'))
+AI_HEDGE_MIN_SAMPLES = int(os.environ.get('AI_HEDGE_MIN_SAMPLES', '20'))
+
+DEFAULT_GROQ_MODEL = "llama-3.1-70b-versatile"
+
+# USD per 1M (input, output) tokens, matched by model name prefix; for cost estimates only.
+# Override or extend with AI_MODEL_PRICES='{"model-name": [input, output]}'.
+MODEL_PRICES = {
+    "llama-3.1-70b": (0.59, 0.79),
+    "llama-3.1-8b": (0.05, 0.08),
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "claude-3-5-sonnet": (3.00, 15.00),
+    "claude-3-haiku": (0.25, 1.25),
+    "gemini-1.5-pro": (1.25, 5.00),
+    "gemini-1.5-flash": (0.075, 0.30),
+}
+try:
+    MODEL_PRICES.update({k: tuple(v) for k, v in json.loads(os.environ.get("AI_MODEL_PRICES") or "{}").items()})
+except Exception as e:
+    print(f"AI_MODEL_PRICES parse failed: {e}")
+
+# API roots the provider calls are built on. A model config's "baseUrl" (or e.g.
+# OPENAI_BASE_URL) replaces one, to point a provider at a proxy or mock_llm_server.py.
+PROVIDER_BASE_URLS = {
+    "openai": "https://api.openai.com/v1",
+    "groq": "https://api.groq.com/openai/v1",
+    "anthropic": "https://api.anthropic.com/v1",
+    "gemini": "https://generativelanguage.googleapis.com/v1beta",
+}
+
+BREAKER_CLOSED = "closed"
+BREAKER_OPEN = "open"
+BREAKER_HALF_OPEN = "half_open"
+
+
+def load_model_configs() -> List[Dict]:
+    """Read the AI model list from AI_MODELS (JSON) or the legacy AI_*_PROVIDER variables"""
+    raw = os.environ.get("AI_MODELS") or os.environ.get("AI_MODELS_JSON")
+    if raw:
+        try:
+            parsed = json.loads(raw)
+            if isinstance(parsed, dict):
+                parsed = [parsed]
+            if isinstance(parsed, list):
+                return parsed
+        except Exception as e:
+            print(f"AI_MODELS parse failed: {e}")
+
+    configs: List[Dict] = []
+    if AI_PRIMARY_PROVIDER and AI_PRIMARY_MODEL:
+        configs.append({"provider": AI_PRIMARY_PROVIDER, "model": AI_PRIMARY_MODEL, "isUsed": True})
+    if AI_SECONDARY_PROVIDER and AI_SECONDARY_MODEL:
+        configs.append({"provider": AI_SECONDARY_PROVIDER, "model": AI_SECONDARY_MODEL, "isUsed": True})
+    if AI_TERTIARY_PROVIDER and AI_TERTIARY_MODEL:
+        configs.append({"provider": AI_TERTIARY_PROVIDER, "model": AI_TERTIARY_MODEL, "isUsed": True})
+    return configs
+
+
+def resolve_api_key(provider: str, config: Dict) -> Optional[str]:
+    api_key = config.get("apiKey") or config.get("api_key")
+    if isinstance(api_key, str) and api_key.startswith("env:"):
+        return os.environ.get(api_key[4:])
+
+    api_key_env = config.get("apiKeyEnv") or config.get("api_key_env")
+    if isinstance(api_key_env, str):
+        return os.environ.get(api_key_env)
+
+    if isinstance(api_key, str) and api_key.strip():
+        return api_key.strip()
+
+    provider_l = (provider or "").lower()
+    if provider_l == "openai":
+        return os.environ.get("OPENAI_API_KEY")
+    if provider_l == "groq":
+        return os.environ.get("GROQ_API_KEY")
+    if provider_l == "anthropic":
+        return os.environ.get("ANTHROPIC_API_KEY")
+    if provider_l == "gemini":
+        return os.environ.get("GEMINI_API_KEY") or os.environ.get("GOOGLE_API_KEY")
+    return None
+
+
+def resolve_base_url(provider: str, config: Dict) -> Optional[str]:
+    base_url = config.get("baseUrl") or config.get("base_url") or os.environ.get(f"{(provider or '').upper()}_BASE_URL")
+    return base_url.rstrip("/") if base_url else None
+
+
+def provider_url(provider: str, base_url: Optional[str], path: str) -> str:
+    return (base_url or PROVIDER_BASE_URLS[provider]) + path
+
+
+class LLMText(str):
+    """Provider reply text that also carries the token usage the provider reported"""
+
+    usage: Optional[Dict] = None
+
+    def __new__(cls, text: str, usage: Optional[Dict] = None):
+        obj = super().__new__(cls, text)
+        obj.usage = usage
+        return obj
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English text
+    return len(text or "") // 4 + 1
+
+
+def estimate_cost(model: str, input_tokens: int, output_tokens: int) -> Optional[float]:
+    """Estimated USD cost, or None if the model has no known price"""
+    prefix = max((p for p in MODEL_PRICES if model.startswith(p)), key=len, default=None)
+    if prefix is None:
+        return None
+    input_price, output_price = MODEL_PRICES[prefix]
+    return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+
+def parse_provider_limits(spec: str) -> Dict[str, Tuple[int, float]]:
+    """"groq=4:30,openai=8:500" -> {provider: (max concurrent, requests per minute)}"""
+    limits = {}
+    for part in (spec or "").split(","):
+        if "=" not in part:
+            continue
+        provider, values = part.split("=", 1)
+        concurrency, _, rpm = values.partition(":")
+        limits[provider.strip().lower()] = (int(concurrency), float(rpm or 0))
+    return limits
+
+
+class ProviderRateLimiter:
+    """Per-provider concurrency cap and request spacing, for batch jobs that fan out to the LLMs"""
+
+    def __init__(self, concurrency: int, rpm: float, overrides: Optional[Dict[str, Tuple[int, float]]] = None):
+        self.default = (concurrency, rpm)
+        self.overrides = overrides or {}
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._next_at: Dict[str, float] = {}
+
+    def _limits(self, provider: str) -> Tuple[int, float]:
+        return self.overrides.get(provider.lower(), self.default)
+
+    @asynccontextmanager
+    async def slot(self, provider: str):
+        concurrency, rpm = self._limits(provider)
+        semaphore = self._semaphores.setdefault(provider, asyncio.Semaphore(max(concurrency, 1)))
+        async with semaphore:
+            if rpm > 0:
+                # Reserve the next send time before sleeping so waiters queue up in order
+                now = time.monotonic()
+                send_at = max(now, self._next_at.get(provider, 0.0))
+                self._next_at[provider] = send_at + 60.0 / rpm
+                if send_at > now:
+                    await asyncio.sleep(send_at - now)
+            yield
+
+
+class ProviderHealth:
+    """Rolling health stats and circuit breaker for one provider/model pair"""
+
+    def __init__(self):
+        self.ewma_latency: Optional[float] = None
+        self.error_rate = 0.0
+        self.latencies = deque(maxlen=200)
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.state = BREAKER_CLOSED
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+
+    def available(self) -> bool:
+        if self.state == BREAKER_CLOSED:
+            return True
+        if self.state == BREAKER_OPEN:
+            return time.monotonic() - self.opened_at >= AI_BREAKER_COOLDOWN_SECONDS
+        return not self.probe_in_flight
+
+    def acquire(self) -> bool:
+        """Claim permission to send a request; half-open breakers let a single probe through"""
+        if self.state == BREAKER_CLOSED:
+            return True
+        if self.state == BREAKER_OPEN:
+            if time.monotonic() - self.opened_at < AI_BREAKER_COOLDOWN_SECONDS:
+                return False
+            self.state = BREAKER_HALF_OPEN
+        if self.probe_in_flight:
+            return False
+        self.probe_in_flight = True
+        return True
+
+    def release(self):
+        self.probe_in_flight = False
+
+    def record_success(self, latency: float):
+        self.requests += 1
+        self.latencies.append(latency)
+        if self.ewma_latency is None:
+            self.ewma_latency = latency
+        else:
+            self.ewma_latency = AI_HEALTH_EWMA_ALPHA * latency + (1 - AI_HEALTH_EWMA_ALPHA) * self.ewma_latency
+        self.error_rate = (1 - AI_HEALTH_EWMA_ALPHA) * self.error_rate
+        self.consecutive_failures = 0
+        self.state = BREAKER_CLOSED
+
+    def record_failure(self):
+        self.requests += 1
+        self.failures += 1
+        self.error_rate = AI_HEALTH_EWMA_ALPHA + (1 - AI_HEALTH_EWMA_ALPHA) * self.error_rate
+        self.consecutive_failures += 1
+        if self.state == BREAKER_HALF_OPEN or self.consecutive_failures >= AI_BREAKER_FAILURE_THRESHOLD:
+            self.state = BREAKER_OPEN
+            self.opened_at = time.monotonic()
+
+    def latency_percentile(self, percentile: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(percentile * (len(ordered) - 1)))]
+
+    def score(self) -> float:
+        """Lower is better. Untried providers score 0 so they keep their configured order."""
+        latency = self.ewma_latency or 0.0
+        # Errors cost a flat penalty too, so failing providers sink even before any latency is known
+        return latency * (1 + 4 * self.error_rate) + 10 * self.error_rate
+
+
+class ProviderEntry:
+    def __init__(self, provider: str, model: str, api_key: str, config: Dict):
+        self.provider = provider
+        self.model = model
+        self.api_key = api_key
+        self.config = config
+        self.base_url = resolve_base_url(provider, config)
+        self.health = ProviderHealth()
+
+    @property
+    def name(self) -> str:
+        return f"{self.provider}/{self.model}"
+
+
+# (provider, api_key, model, system_message, prompt, base_url=None)
+LLMCall = Callable[..., Awaitable[str]]
+LLMStreamCall = Callable[..., AsyncIterator[str]]
+
+
+class ProviderRegistry:
+    """Usable AI providers, built once, ordered by observed health and latency"""
+
+    def __init__(self, entries: List[ProviderEntry]):
+        self.entries = entries
+
+    @classmethod
+    def from_env(cls) -> "ProviderRegistry":
+        entries: List[ProviderEntry] = []
+        for config in load_model_configs():
+            is_used = config.get("isUsed")
+            if is_used is None:
+                is_used = config.get("is_used", True)
+            if str(is_used).lower() != "true":
+                continue
+
+            provider = config.get("provider") or ""
+            model = config.get("model") or ""
+            api_key = resolve_api_key(provider, config)
+            if not provider or not model or not api_key:
+                continue
+            entries.append(ProviderEntry(provider, model, api_key, config))
+
+        # If nothing is configured, try default Groq
+        if not entries and os.environ.get("GROQ_API_KEY"):
+            entries.append(ProviderEntry("groq", DEFAULT_GROQ_MODEL, os.environ["GROQ_API_KEY"], {}))
+
+        return cls(entries)
+
+    def candidates(self) -> List[ProviderEntry]:
+        """Providers whose breaker lets traffic through, best first"""
+        ranked = sorted(enumerate(self.entries), key=lambda item: (item[1].health.score(), item[0]))
+        return [entry for _, entry in ranked if entry.health.available()]
+
+    def _hedge_delay(self, entry: ProviderEntry) -> Optional[float]:
+        if not AI_HEDGE_ENABLED or len(entry.health.latencies) < AI_HEDGE_MIN_SAMPLES:
+            return None
+        return entry.health.latency_percentile(AI_HEDGE_PERCENTILE)
+
+    async def _attempt(self, call: LLMCall, entry: ProviderEntry, system_message: str, prompt: str, label: str,
+                       limiter: Optional[ProviderRateLimiter] = None) -> Optional[Tuple[str, float]]:
+        try:
+            if limiter:
+                async with limiter.slot(entry.provider):
+                    started = time.monotonic()
+                    response = await call(entry.provider, entry.api_key, entry.model, system_message, prompt, base_url=entry.base_url)
+            else:
+                started = time.monotonic()
+                response = await call(entry.provider, entry.api_key, entry.model, system_message, prompt, base_url=entry.base_url)
+            latency = time.monotonic() - started
+            entry.health.record_success(latency)
+            return response, latency
+        except asyncio.CancelledError:
+            # Lost a hedge race; say nothing about the provider's health
+            raise
+        except Exception as e:
+            entry.health.record_failure()
+            print(f"{label} provider {entry.name} failed: {e}")
+            return None
+        finally:
+            entry.health.release()
+
+    async def complete(
+        self,
+        call: LLMCall,
+        system_message: str,
+        prompt: str,
+        accept: Optional[Callable[[str], bool]] = None,
+        label: str = "AI",
+        limiter: Optional[ProviderRateLimiter] = None,
+        trace: Optional[Dict] = None,
+    ) -> Optional[str]:
+        """Run the prompt against the best provider, falling back (and optionally hedging) down the ranking.
+
+        Returns the first response that passes ``accept``, or None if every provider failed.
+        With a ``limiter`` calls wait for a provider slot and are never hedged. ``trace``, if
+        given, is filled with the provider, model, latency and number of attempts.
+        """
+        accept = accept or (lambda r: bool(r and r.strip()))
+        queue = self.candidates()
+        pending: Dict[asyncio.Task, ProviderEntry] = {}
+
+        def launch_next() -> bool:
+            while queue:
+                entry = queue.pop(0)
+                if entry.health.acquire():
+                    task = asyncio.ensure_future(self._attempt(call, entry, system_message, prompt, label, limiter))
+                    pending[task] = entry
+                    if trace is not None:
+                        trace["attempts"] = trace.get("attempts", 0) + 1
+                    return True
+            return False
+
+        if not launch_next():
+            return None
+
+        try:
+            while pending:
+                timeout = None
+                if len(pending) == 1 and queue and not limiter:
+                    timeout = self._hedge_delay(next(iter(pending.values())))
+
+                done, _ = await asyncio.wait(pending.keys(), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # Primary is slower than its usual tail latency: hedge to the next best provider
+                    launch_next()
+                    continue
+
+                for task in done:
+                    entry = pending.pop(task)
+                    result = task.result()
+                    if result and result[0] and accept(result[0]):
+                        if trace is not None:
+                            trace.update(provider=entry.provider, model=entry.model, latency=result[1],
+                                         usage=getattr(result[0], "usage", None))
+                        return result[0].strip()
+
+                if not pending:
+                    launch_next()
+            return None
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def stream(self, stream_call: LLMStreamCall, system_message: str, prompt: str, label: str = "AI",
+                     trace: Optional[Dict] = None) -> AsyncIterator[str]:
+        """Stream the reply from the best provider.
+
+        A provider that fails before its first chunk is skipped for the next one, same as
+        ``complete``. Once text has been yielded there is no fallback; a mid-stream failure
+        just ends the stream. Streams are never hedged. ``trace`` gets the provider and model
+        that streamed.
+        """
+        for entry in self.candidates():
+            if not entry.health.acquire():
+                continue
+            started = time.monotonic()
+            chunks = stream_call(entry.provider, entry.api_key, entry.model, system_message, prompt, base_url=entry.base_url)
+            try:
+                first = None
+                try:
+                    async for text in chunks:
+                        if text:
+                            first = text
+                            break
+                except Exception as e:
+                    entry.health.record_failure()
+                    print(f"{label} provider {entry.name} failed before first token: {e}")
+                    continue
+
+                if first is None:
+                    # Provider answered with nothing; try the next one
+                    entry.health.record_success(time.monotonic() - started)
+                    continue
+
+                if trace is not None:
+                    trace.update(provider=entry.provider, model=entry.model)
+                yield first
+                try:
+                    async for text in chunks:
+                        yield text
+                except Exception as e:
+                    entry.health.record_failure()
+                    print(f"{label} provider {entry.name} failed mid-stream: {e}")
+                    return
+                entry.health.record_success(time.monotonic() - started)
+                return
+            finally:
+                entry.health.release()
+                await chunks.aclose()
+
+    def snapshot(self) -> List[Dict]:
+        return [
+            {
+                "provider": entry.provider,
+                "model": entry.model,
+                "state": entry.health.state,
+                "requests": entry.health.requests,
+                "failures": entry.health.failures,
+                "error_rate": round(entry.health.error_rate, 3),
+                "ewma_latency_ms": round(entry.health.ewma_latency * 1000) if entry.health.ewma_latency is not None else None,
+                "p95_latency_ms": round(entry.health.latency_percentile(0.95) * 1000) if entry.health.latencies else None,
+            }
+            for entry in self.entries
+        ]
+
+
+_registry: Optional[ProviderRegistry] = None
+
+
+def init_provider_registry() -> ProviderRegistry:
+    global _registry
+    _registry = ProviderRegistry.from_env()
+    names = ", ".join(entry.name + (f" at {entry.base_url}" if entry.base_url else "") for entry in _registry.entries) or "none"
+    print(f"AI providers registered: {names}")
+    return _registry
+
+
+def get_provider_registry() -> ProviderRegistry:
+    if _registry is None:
+        return init_provider_registry()
+    return _registry
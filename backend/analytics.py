@@ -0,0 +1,85 @@
+from typing import List, Dict, Optional, Tuple
+import numpy as np
+
+
+def peak_hour(values: np.ndarray, counts: np.ndarray) -> Optional[Tuple[int, float]]:
+    """Hour with the highest value among hours that have sessions"""
+    if not counts.any():
+        return None
+    masked = np.where(counts > 0, values, -np.inf)
+    hour = int(np.argmax(masked))
+    return hour, float(values[hour])
+
+
+class RollupFrame:
+    """focus_rollups docs (see rollups.py) stacked into (days, 24) arrays, oldest day first"""
+
+    __slots__ = ("dates", "minutes", "sessions", "completed")
+
+    def __init__(self, dates: List[str], minutes: np.ndarray, sessions: np.ndarray, completed: np.ndarray):
+        self.dates = dates
+        self.minutes = minutes
+        self.sessions = sessions
+        self.completed = completed
+
+    @classmethod
+    def from_rollups(cls, rollups: List[Dict]) -> "RollupFrame":
+        rollups = sorted(rollups, key=lambda r: r["date"])
+
+        def stack(field: str) -> np.ndarray:
+            if not rollups:
+                return np.zeros((0, 24))
+            return np.array([r.get(field) or [0] * 24 for r in rollups], dtype=np.float64)
+
+        return cls([r["date"] for r in rollups], stack("minutes"), stack("hourSessions"), stack("hourCompleted"))
+
+    def __len__(self) -> int:
+        return len(self.dates)
+
+    @property
+    def session_count(self) -> int:
+        return int(self.sessions.sum())
+
+    @property
+    def completed_count(self) -> int:
+        return int(self.completed.sum())
+
+
+def rollup_hour_histogram(frame: RollupFrame, weights: str = "minutes") -> Tuple[np.ndarray, np.ndarray]:
+    """(per-hour value, per-hour session count) summed over the days.
+
+    weights: "minutes" (completed minutes), "count" (sessions started) or "completed".
+    """
+    counts = frame.sessions.sum(axis=0)
+    if weights == "minutes":
+        return frame.minutes.sum(axis=0), frame.completed.sum(axis=0)
+    if weights == "completed":
+        completed = frame.completed.sum(axis=0)
+        return completed, completed
+    return counts, counts
+
+
+def rollup_sessions_per_day(frame: RollupFrame) -> Tuple[float, int]:
+    per_day = frame.sessions.sum(axis=1)
+    active_days = int(np.count_nonzero(per_day))
+    if active_days == 0:
+        return 0.0, 0
+    return float(per_day.sum()) / active_days, active_days
+
+
+def rollup_late_night_count(frame: RollupFrame, start_hour: int = 22, end_hour: int = 5) -> int:
+    per_hour = frame.sessions.sum(axis=0)
+    return int(per_hour[start_hour:].sum() + per_hour[:end_hour + 1].sum())
+
+
+def rollup_half_duration_means(frame: RollupFrame) -> Tuple[float, float]:
+    """Mean completed-session length over the earlier and later half of the active days"""
+    minutes = frame.minutes.sum(axis=1)
+    completed = frame.completed.sum(axis=1)
+    active = completed > 0
+    minutes, completed = minutes[active], completed[active]
+    if len(completed) < 2:
+        return 0.0, 0.0
+    half = len(completed) // 2
+    return (float(minutes[:half].sum() / completed[:half].sum()),
+            float(minutes[half:].sum() / completed[half:].sum()))
@@ -1,4 +1,5 @@
 import os
+import hmac
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
@@ -6,10 +7,15 @@ from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from models import TokenData
+from dotenv import load_dotenv
+
+load_dotenv()
 
 SECRET_KEY = os.environ.get("JWT_SECRET_KEY", "your-secret-key-change-this-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7
+# Bearer token for /api/metrics; unset means the endpoint is off
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 # auto_error=False allows accessing the endpoint without a token (credentials will be None)
@@ -62,3 +68,25 @@ async def get_optional_current_user(credentials: Optional[HTTPAuthorizationCrede
         return TokenData(email=email)
     except JWTError:
         return None
+
+def decode_access_token(token: Optional[str]) -> Optional[TokenData]:
+    """TokenData for a valid token, else None (for places that can't use the Depends helpers, e.g. WebSockets)"""
+    if not token:
+        return None
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    email: str = payload.get("sub")
+    return TokenData(email=email) if email else None
+
+async def require_metrics_token(credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)):
+    """Guards operational endpoints: 404 unless METRICS_TOKEN is set, 401 on a wrong token"""
+    if not METRICS_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if not credentials or not hmac.compare_digest(credentials.credentials.encode(), METRICS_TOKEN.encode()):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid metrics token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
@@ -0,0 +1,206 @@
+import os
+import time
+import uuid
+import asyncio
+from collections import deque
+from typing import Callable, Awaitable, Dict, List, Optional
+from dotenv import load_dotenv
+import orjson
+from pymongo import CursorType, ReturnDocument
+from pymongo.errors import CollectionInvalid
+
+from leases import WORKER_ID
+
+load_dotenv()
+
+# Pub/sub between workers for WebSocket fan-out. A broadcast is published once; every
+# worker (including the publisher) hands it to its locally connected sockets.
+#
+# WS_BACKPLANE=memory  single process only (the default)
+# WS_BACKPLANE=mongo   a capped collection tailed by every worker. Works on a standalone
+#                      mongod too, unlike change streams. Messages older than the cap are
+#                      gone, so a worker that is down for a while just misses them.
+WS_BACKPLANE = os.environ.get('WS_BACKPLANE', 'memory').lower()
+WS_BACKPLANE_COLLECTION = os.environ.get('WS_BACKPLANE_COLLECTION', 'ws_events')
+WS_BACKPLANE_CAP_BYTES = int(os.environ.get('WS_BACKPLANE_CAP_BYTES', str(16 * 1024 * 1024)))
+WS_BACKPLANE_CAP_DOCS = int(os.environ.get('WS_BACKPLANE_CAP_DOCS', '50000'))
+# Per-channel sequence counters, so every worker numbers a channel's messages the same way
+WS_SEQUENCE_COLLECTION = os.environ.get('WS_SEQUENCE_COLLECTION', 'ws_sequences')
+# Tolerated clock difference between worker hosts (the tail filters on publish time)
+WS_BACKPLANE_CLOCK_SKEW_SECONDS = float(os.environ.get('WS_BACKPLANE_CLOCK_SKEW_SECONDS', '5'))
+
+# Channels are "kind:id" (e.g. "room:<room id>"); handlers are registered per kind.
+# Messages can be numbered per channel with next_seq() (publish_numbered() does both), which
+# is what lets clients resume and replay them; numbers are only comparable within
+# the same `stream` (the memory backplane starts a new one every process start).
+Handler = Callable[[str, Dict], Awaitable[None]]
+
+
+class Backplane:
+    """Delivers every published message to the handler for its channel kind, in this process"""
+
+    def __init__(self):
+        self.handlers: Dict[str, Handler] = {}
+        self.stream = uuid.uuid4().hex
+        self.sequences: Dict[str, int] = {}
+        self.metrics: Dict = {"backend": "memory", "published": 0, "delivered": 0, "handler_errors": 0}
+
+    def subscribe(self, kind: str, handler: Handler):
+        self.handlers[kind] = handler
+
+    async def start(self, db):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, channel: str, message: Dict):
+        self.metrics["published"] += 1
+        await self._dispatch(channel, message)
+
+    async def publish_numbered(self, channel: str, message: Dict):
+        """Publish with the channel's next sequence number in `seq`"""
+        await self.publish(channel, {**message, "seq": await self.next_seq(channel)})
+
+    async def next_seq(self, channel: str) -> int:
+        self.sequences[channel] = self.sequences.get(channel, 0) + 1
+        return self.sequences[channel]
+
+    async def current_seq(self, channel: str) -> int:
+        return self.sequences.get(channel, 0)
+
+    async def history(self, channel: str, after_seq: int) -> List[Dict]:
+        """Sequenced messages on the channel after `after_seq` that the backplane still has"""
+        return []  # nothing beyond what the subscribers kept themselves
+
+    async def deliver_local(self, channel: str, message: Dict):
+        """This worker's subscribers only, e.g. for something every worker sends on its own"""
+        await self._dispatch(channel, message)
+
+    async def _dispatch(self, channel: str, message: Dict):
+        handler = self.handlers.get(channel.split(":", 1)[0])
+        if not handler:
+            return
+        try:
+            await handler(channel, message)
+            self.metrics["delivered"] += 1
+        except Exception as e:
+            self.metrics["handler_errors"] += 1
+            print(f"Backplane handler failed for {channel}: {e}")
+
+
+class MongoBackplane(Backplane):
+    """Capped-collection pub/sub: publish inserts, each worker tails with a tailable cursor.
+
+    The publisher delivers its own messages straight away rather than waiting for them to
+    come back round through the tail.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.db = None
+        self.origin = WORKER_ID
+        self._tail_task: Optional[asyncio.Task] = None
+        self.metrics.update(backend="mongo", remote_delivered=0, publish_errors=0, tail_restarts=0, last_lag_ms=None)
+
+    async def start(self, db):
+        self.db = db
+        try:
+            await db.create_collection(WS_BACKPLANE_COLLECTION, capped=True,
+                                       size=WS_BACKPLANE_CAP_BYTES, max=WS_BACKPLANE_CAP_DOCS)
+        except CollectionInvalid:
+            pass  # another worker made it
+        await db[WS_BACKPLANE_COLLECTION].create_index([("channel", 1), ("seq", 1)])
+        # Shared by all workers, and survives restarts as long as the counters do
+        meta = await db[WS_SEQUENCE_COLLECTION].find_one_and_update(
+            {"_id": "_stream"}, {"$setOnInsert": {"stream": uuid.uuid4().hex}},
+            upsert=True, return_document=ReturnDocument.AFTER
+        )
+        self.stream = meta["stream"]
+        # A tailable cursor on an empty capped collection dies straight away, so make sure it isn't
+        started = time.time()
+        await db[WS_BACKPLANE_COLLECTION].insert_one({"channel": None, "origin": self.origin, "ts": started})
+        self._tail_task = asyncio.create_task(self._tail(started))
+
+    async def stop(self):
+        if self._tail_task:
+            self._tail_task.cancel()
+            try:
+                await self._tail_task
+            except asyncio.CancelledError:
+                pass
+            self._tail_task = None
+
+    async def publish(self, channel: str, message: Dict):
+        self.metrics["published"] += 1
+        try:
+            # Stored as JSON so client-sent keys never have to be valid BSON field names
+            await self.db[WS_BACKPLANE_COLLECTION].insert_one({
+                "channel": channel,
+                "payload": orjson.dumps(message, default=str).decode(),
+                "seq": message.get("seq"),
+                "origin": self.origin,
+                "ts": time.time(),
+            })
+        except Exception as e:
+            # Other workers miss this one; local sockets still get it
+            self.metrics["publish_errors"] += 1
+            print(f"Backplane publish failed for {channel}: {e}")
+        await self._dispatch(channel, message)
+
+    async def next_seq(self, channel: str) -> int:
+        doc = await self.db[WS_SEQUENCE_COLLECTION].find_one_and_update(
+            {"_id": channel}, {"$inc": {"seq": 1}}, upsert=True, return_document=ReturnDocument.AFTER
+        )
+        return doc["seq"]
+
+    async def current_seq(self, channel: str) -> int:
+        doc = await self.db[WS_SEQUENCE_COLLECTION].find_one({"_id": channel})
+        return doc["seq"] if doc else 0
+
+    async def history(self, channel: str, after_seq: int) -> List[Dict]:
+        # Whatever the capped collection hasn't rotated out yet
+        cursor = self.db[WS_BACKPLANE_COLLECTION].find({"channel": channel, "seq": {"$gt": after_seq}}).sort("seq", 1)
+        return [orjson.loads(doc["payload"]) async for doc in cursor]
+
+    async def _tail(self, since: float):
+        collection = self.db[WS_BACKPLANE_COLLECTION]
+        # The filter is on publish time minus the clock skew allowance (ObjectIds from different
+        # workers don't sort in insertion order), so a restarted tail re-reads a few seconds;
+        # recently seen ids weed those out
+        seen_ids = set()
+        seen_order = deque()
+        while True:
+            try:
+                cursor = collection.find({"ts": {"$gte": since - WS_BACKPLANE_CLOCK_SKEW_SECONDS}},
+                                         cursor_type=CursorType.TAILABLE_AWAIT)
+                while cursor.alive:
+                    async for doc in cursor:
+                        if doc["_id"] in seen_ids:
+                            continue
+                        seen_ids.add(doc["_id"])
+                        seen_order.append(doc["_id"])
+                        if len(seen_order) > WS_BACKPLANE_CAP_DOCS:
+                            seen_ids.discard(seen_order.popleft())
+                        since = max(since, doc["ts"])
+                        if doc["origin"] == self.origin or not doc.get("channel"):
+                            continue
+                        self.metrics["remote_delivered"] += 1
+                        self.metrics["last_lag_ms"] = round((time.time() - doc["ts"]) * 1000, 1)
+                        await self._dispatch(doc["channel"], orjson.loads(doc["payload"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Backplane tail failed, restarting: {e}")
+            self.metrics["tail_restarts"] += 1
+            await asyncio.sleep(1)
+
+
+_backplane: Optional[Backplane] = None
+
+
+def get_backplane() -> Backplane:
+    global _backplane
+    if _backplane is None:
+        _backplane = MongoBackplane() if WS_BACKPLANE == "mongo" else Backplane()
+    return _backplane
@@ -0,0 +1,94 @@
+import sys
+import time
+import asyncio
+
+import uvicorn
+
+import ai_providers
+import mock_llm_server
+from ai_providers import ProviderRegistry, ProviderEntry
+from insights_service import InsightsService
+
+# Load test for the AI provider path (routing, fallback, hedging, streaming) against
+# mock_llm_server.py, started in-process, so no keys or network are needed.
+# Usage: python bench_ai_providers.py [--requests 300] [--concurrency 30] [--hedge] [--stream]
+#
+# groq is set up slow-tailed and flaky, openai fast and reliable, so the run shows how
+# the registry shifts traffic and what the tail looks like with and without hedging.
+
+PORT = 8099
+BASE = f"http://127.0.0.1:{PORT}"
+SCENARIO = {
+    "groq": {"latency": "lognormal:400:0.9", "error_rate": 0.15, "timeout_rate": 0.0},
+    "openai": {"latency": "lognormal:300:0.3", "error_rate": 0.01},
+}
+
+
+def _arg(name: str, default: int) -> int:
+    return int(sys.argv[sys.argv.index(name) + 1]) if name in sys.argv else default
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p * (len(ordered) - 1)))] if ordered else 0
+
+
+async def one_request(service: InsightsService, registry: ProviderRegistry, stream: bool):
+    started = time.perf_counter()
+    if stream:
+        first, text = None, ""
+        async for chunk in registry.stream(service._stream_llm_provider, "You are a coach.", "Plan my day.", label="Bench"):
+            first = first or time.perf_counter() - started
+            text += chunk
+        return time.perf_counter() - started, first, bool(text)
+    reply = await registry.complete(service._call_llm_provider, "You are a coach.", "Plan my day.", label="Bench")
+    return time.perf_counter() - started, None, bool(reply)
+
+
+async def main():
+    total, concurrency = _arg("--requests", 300), _arg("--concurrency", 30)
+    stream = "--stream" in sys.argv
+    ai_providers.AI_HEDGE_ENABLED = "--hedge" in sys.argv
+    ai_providers.AI_HEDGE_MIN_SAMPLES = 10
+
+    server = uvicorn.Server(uvicorn.Config(mock_llm_server.app, host="127.0.0.1", port=PORT, log_level="warning"))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+    for provider, config in SCENARIO.items():
+        mock_llm_server.overrides[provider] = config
+
+    registry = ProviderRegistry([
+        ProviderEntry("groq", "llama-3.1-70b-versatile", "mock", {"baseUrl": f"{BASE}/openai/v1"}),
+        ProviderEntry("openai", "gpt-4o-mini", "mock", {"baseUrl": f"{BASE}/v1"}),
+    ])
+    service = InsightsService(db=None)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited():
+        async with semaphore:
+            return await one_request(service, registry, stream)
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(limited() for _ in range(total)))
+    elapsed = time.perf_counter() - started
+
+    latencies = [r[0] for r in results if r[2]]
+    print(f"{total} {'streamed ' if stream else ''}requests, concurrency {concurrency}, "
+          f"hedging {'on' if ai_providers.AI_HEDGE_ENABLED else 'off'}: {elapsed:.1f}s")
+    print(f"  succeeded {len(latencies)}/{total}, p50 {percentile(latencies, 0.5) * 1000:.0f}ms, "
+          f"p95 {percentile(latencies, 0.95) * 1000:.0f}ms, p99 {percentile(latencies, 0.99) * 1000:.0f}ms")
+    if stream:
+        first = [r[1] for r in results if r[1]]
+        print(f"  time to first chunk p50 {percentile(first, 0.5) * 1000:.0f}ms, p95 {percentile(first, 0.95) * 1000:.0f}ms")
+    for entry in registry.snapshot():
+        calls = mock_llm_server.stats[entry["provider"]]
+        print(f"  {entry['provider']}/{entry['model']}: {calls['requests']} calls ({calls['errors']} errors), "
+              f"breaker {entry['state']}, ewma {entry['ewma_latency_ms']}ms")
+
+    server.should_exit = True
+    await serving
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
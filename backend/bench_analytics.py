@@ -0,0 +1,133 @@
+import random
+import time
+from datetime import datetime, timedelta
+
+from analytics import (
+    RollupFrame, peak_hour, rollup_hour_histogram, rollup_sessions_per_day, rollup_late_night_count,
+    rollup_half_duration_means
+)
+
+# Compares the old dict-loop insight math over raw sessions with the rollup path the
+# insights service uses now (focus_rollups docs stacked into numpy arrays).
+#
+# Two stats changed meaning with the rollups, so they're reported rather than matched:
+# the best focus hour counts completed minutes only (the loops counted every session's
+# duration), and the session-length halves split active days instead of sessions.
+# "same" checks the rest.
+#
+# "build ms" is what turning the sessions into rollups costs here. It isn't part of the
+# rollup time: production keeps rollups up to date with $inc as sessions start and finish,
+# so an insights request only reads them.
+# Usage: python bench_analytics.py
+
+
+def make_sessions(n: int, days: int = 365):
+    random.seed(n)
+    now = datetime.utcnow()
+    return [{
+        "startTime": (now - timedelta(minutes=random.randint(0, 60 * 24 * days))).isoformat(),
+        "duration": random.choice([15, 25, 30, 45, 50, 60, 90]),
+        "completed": random.random() < 0.8,
+    } for _ in range(n)]
+
+
+def make_heatmap(n: int):
+    return [{"totalMinutes": random.randint(0, 300)} for _ in range(n)]
+
+
+def make_rollups(sessions):
+    """What rollups.py would have stored for these sessions, one doc per UTC day"""
+    by_date = {}
+    for session in sessions:
+        start = datetime.fromisoformat(session["startTime"])
+        doc = by_date.setdefault(start.date().isoformat(), {
+            "date": start.date().isoformat(),
+            "minutes": [0] * 24, "hourSessions": [0] * 24, "hourCompleted": [0] * 24,
+        })
+        doc["hourSessions"][start.hour] += 1
+        if session["completed"]:
+            doc["minutes"][start.hour] += session["duration"]
+            doc["hourCompleted"][start.hour] += 1
+    return list(by_date.values())
+
+
+def loops(sessions, heatmap):
+    """The previous InsightsService implementation"""
+    hour_distribution = {}
+    for session in sessions:
+        if session.get("startTime"):
+            hour = datetime.fromisoformat(session["startTime"]).hour
+            hour_distribution[hour] = hour_distribution.get(hour, 0) + session.get("duration", 0)
+    best_hour = max(hour_distribution.items(), key=lambda x: x[1])
+
+    sessions_by_day = {}
+    for session in sessions:
+        if session.get("startTime"):
+            date = datetime.fromisoformat(session["startTime"]).date().isoformat()
+            sessions_by_day[date] = sessions_by_day.get(date, 0) + 1
+    avg_sessions = sum(sessions_by_day.values()) / max(len(sessions_by_day), 1)
+
+    late_night_sessions = 0
+    for session in sessions:
+        if session.get("startTime"):
+            hour = datetime.fromisoformat(session["startTime"]).hour
+            if hour >= 22 or hour <= 5:
+                late_night_sessions += 1
+
+    first_half = sessions[:len(sessions)//2]
+    second_half = sessions[len(sessions)//2:]
+    avg_first = sum(s.get("duration", 0) for s in first_half) / len(first_half)
+    avg_second = sum(s.get("duration", 0) for s in second_half) / len(second_half)
+
+    hour_performance = {}
+    for session in sessions:
+        if session.get("startTime") and session.get("completed"):
+            hour = datetime.fromisoformat(session["startTime"]).hour
+            hour_performance[hour] = hour_performance.get(hour, 0) + 1
+    best_completed_hour = max(hour_performance.items(), key=lambda x: x[1])[0]
+
+    capacity = sum(day.get("totalMinutes", 0) for day in heatmap) / len(heatmap)
+    return (best_hour[0], best_hour[1], round(avg_sessions, 6), late_night_sessions,
+            round(avg_first, 6), round(avg_second, 6), best_completed_hour, round(capacity, 6))
+
+
+def vectorized(rollups, heatmap):
+    """The same stats the way insights_compute gets them"""
+    frame = RollupFrame.from_rollups(rollups)
+    best_hour = peak_hour(*rollup_hour_histogram(frame))
+    avg_sessions = rollup_sessions_per_day(frame)[0]
+    avg_first, avg_second = rollup_half_duration_means(frame)
+    best_completed_hour = peak_hour(*rollup_hour_histogram(frame, weights="completed"))[0]
+    day_minutes = [day.get("totalMinutes", 0) for day in heatmap]
+    capacity = sum(day_minutes) / len(day_minutes)
+    return (best_hour[0], int(best_hour[1]), round(avg_sessions, 6), rollup_late_night_count(frame),
+            round(avg_first, 6), round(avg_second, 6), best_completed_hour, round(capacity, 6))
+
+
+# Tuple positions that mean the same thing in both implementations
+UNCHANGED = (2, 3, 6, 7)
+
+
+def timed(fn, *args, repeat: int = 3):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+if __name__ == "__main__":
+    print(f"{'sessions':>10} {'loops ms':>10} {'rollup ms':>10} {'speedup':>8} {'build ms':>9}  same  "
+          f"best hour (all -> completed min)")
+    for n in (1_000, 10_000, 100_000):
+        sessions = make_sessions(n)
+        heatmap = make_heatmap(min(n, 365))
+        loop_time, expected = timed(loops, sessions, heatmap)
+        build_time, rollups = timed(make_rollups, sessions)
+        rollup_time, actual = timed(vectorized, rollups, heatmap)
+        same = all(expected[i] == actual[i] for i in UNCHANGED)
+        print(f"{n:>10} {loop_time * 1000:>10.1f} {rollup_time * 1000:>10.1f} "
+              f"{loop_time / rollup_time:>7.1f}x {build_time * 1000:>9.1f}  {str(same):>4}  "
+              f"{expected[0]}h {expected[1]} -> {actual[0]}h {actual[1]}")
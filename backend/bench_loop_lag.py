@@ -0,0 +1,69 @@
+import asyncio
+import time
+from datetime import date
+
+import compute_pool
+from planner import build_plan
+from bench_planner import TYPE_TOTALS, make_tasks
+
+# Measures event loop lag while the smart-plan optimizer runs inline vs in the compute pool,
+# at backlog sizes around COMPUTE_INLINE_THRESHOLD (the planner is the one caller big enough
+# to be offloaded; the rollup-based insight math reads a few dozen docs at most).
+# A ticker coroutine sleeps TICK seconds in a loop and records how late it wakes up,
+# which is roughly how long a WebSocket message would wait to be handled.
+# Usage: python bench_loop_lag.py
+
+TICK = 0.005
+CAPACITY_MINUTES = 240
+
+
+async def ticker(lags: list, stop: asyncio.Event):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        expected = loop.time() + TICK
+        await asyncio.sleep(TICK)
+        lags.append(max(loop.time() - expected, 0))
+
+
+async def workload(tasks, rounds: int, size: int):
+    today = date.today().isoformat()
+    for _ in range(rounds):
+        await compute_pool.run_compute(build_plan, tasks, CAPACITY_MINUTES, today, TYPE_TOTALS, size=size)
+        await asyncio.sleep(0)  # separate requests: let the loop run in between
+
+
+async def measure(tasks, rounds: int, size: int):
+    lags, stop = [], asyncio.Event()
+    tick_task = asyncio.create_task(ticker(lags, stop))
+    await asyncio.sleep(0.05)  # let the ticker settle
+    started = time.perf_counter()
+    await workload(tasks, rounds, size)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await tick_task
+    lags.sort()
+    p99 = lags[int(len(lags) * 0.99) - 1] if lags else 0
+    return elapsed / rounds, lags[-1] if lags else 0, p99
+
+
+async def main():
+    rounds = 10
+
+    # Warm the pool up so worker spawn time isn't counted
+    compute_pool.COMPUTE_POOL_SIZE = max(compute_pool.COMPUTE_POOL_SIZE, 1)
+    await workload(make_tasks(10), 1, size=compute_pool.COMPUTE_INLINE_THRESHOLD)
+
+    print(f"build_plan x {rounds} rounds, ticker every {TICK * 1000:.0f}ms "
+          f"(COMPUTE_INLINE_THRESHOLD={compute_pool.COMPUTE_INLINE_THRESHOLD})")
+    print(f"{'tasks':>6} {'mode':>7} {'ms/plan':>8} {'max lag ms':>11} {'p99 lag ms':>11}")
+    for n in (500, 2000, 5000):
+        tasks = make_tasks(n)
+        for mode, size in (("inline", 0), ("pool", n + compute_pool.COMPUTE_INLINE_THRESHOLD)):
+            per_plan, worst, p99 = await measure(tasks, rounds, size)
+            print(f"{n:>6} {mode:>7} {per_plan * 1000:>8.1f} {worst * 1000:>11.1f} {p99 * 1000:>11.1f}")
+
+    compute_pool.shutdown_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,97 @@
+import math
+import random
+import time
+from datetime import date, timedelta
+from itertools import combinations
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from planner import (
+    PLAN_CAPACITY_BUFFER, PLAN_MAX_TASKS, PLAN_SLOT_MINUTES, build_plan, estimate_ratios, score_tasks
+)
+
+# Times the smart-plan optimizer on synthetic backlogs and checks it against
+# exhaustive search on small ones.
+# Usage: python bench_planner.py
+
+TYPES = ["Study", "Coding", "Debugging", "Planning"]
+TYPE_TOTALS = [
+    {"_id": "Coding", "estimated": 1000, "actual": 1400},
+    {"_id": "Debugging", "estimated": 500, "actual": 900},
+    {"_id": "Study", "estimated": 800, "actual": 700},
+]
+
+
+def make_tasks(n: int, seed: int = 0):
+    rng = random.Random(seed)
+    today = date.today()
+    tasks = []
+    for i in range(n):
+        scheduled = None
+        if rng.random() < 0.4:
+            scheduled = (today + timedelta(days=rng.randint(-10, 10))).isoformat()
+        tasks.append({
+            "id": str(i),
+            "title": f"Task {i}",
+            "type": rng.choice(TYPES),
+            "estimatedTime": rng.choice([15, 25, 30, 45, 60, 90, 120, 180]),
+            "totalFocusedTime": rng.choice([0, 0, 0, 10, 25, 50]),
+            "techTags": [],
+            "status": rng.choice(["todo", "todo", "in_progress"]),
+            "createdAt": (today - timedelta(days=rng.randint(0, 120))).isoformat(),
+            "scheduledDate": scheduled,
+        })
+    return tasks
+
+
+def brute_force_plan(tasks: List[Dict], capacity_minutes: float, today_iso: str,
+                     type_totals: Optional[List[Dict]] = None, max_tasks: int = PLAN_MAX_TASKS) -> Tuple[float, List[str]]:
+    """Exhaustive reference for small inputs"""
+    scored = score_tasks(tasks, date.fromisoformat(today_iso), estimate_ratios(type_totals or []))
+    capacity_slots = int(capacity_minutes * PLAN_CAPACITY_BUFFER // PLAN_SLOT_MINUTES)
+    eligible = np.flatnonzero(scored["eligible"]).tolist()
+
+    best_value, best_ids = 0.0, []
+    for k in range(1, max_tasks + 1):
+        for combo in combinations(eligible, k):
+            cost = sum(math.ceil(scored["predicted"][i] / PLAN_SLOT_MINUTES) for i in combo)
+            value = sum(scored["score"][i] for i in combo)
+            if cost <= capacity_slots and value > best_value + 1e-9:
+                best_value, best_ids = value, [tasks[i]["id"] for i in combo]
+    return best_value, best_ids
+
+
+def timed(n: int, repeat: int = 20):
+    tasks = make_tasks(n)
+    today = date.today().isoformat()
+    build_plan(tasks, 240, today, TYPE_TOTALS)  # warm up
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        build_plan(tasks, 240, today, TYPE_TOTALS)
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+    return samples[len(samples) // 2], samples[-1]
+
+
+def check_optimal(trials: int = 200):
+    today = date.today().isoformat()
+    for seed in range(trials):
+        tasks = make_tasks(12, seed)
+        capacity = random.Random(seed).choice([60, 120, 180, 240])
+        plan = build_plan(tasks, capacity, today, TYPE_TOTALS)
+        expected, _ = brute_force_plan(tasks, capacity, today, TYPE_TOTALS)
+        actual = sum(t["score"] for t in plan["tasks"])
+        if abs(actual - expected) > 1e-6:
+            return False, seed
+    return True, None
+
+
+if __name__ == "__main__":
+    ok, seed = check_optimal()
+    print(f"matches brute force on 200 random 12-task backlogs: {ok}" + (f" (failed seed {seed})" if not ok else ""))
+    print(f"{'tasks':>8} {'median ms':>10} {'max ms':>8}")
+    for n in (100, 1_000, 5_000):
+        median, worst = timed(n)
+        print(f"{n:>8} {median * 1000:>10.2f} {worst * 1000:>8.2f}")
@@ -0,0 +1,82 @@
+import json
+import time
+import asyncio
+
+import rooms_router
+from rooms_router import ConnectionManager
+
+# Room broadcast throughput: the old path (send_json, i.e. json.dumps per recipient, awaited
+# one socket at a time) vs encoding once with orjson and queueing the text frame for each
+# socket's writer task. Sockets are no-op fakes, so this is pure server-side cost.
+# Usage: python bench_ws_broadcast.py
+
+MESSAGES = 2000
+MESSAGE = {
+    "type": "chat_message",
+    "id": "1760838000000",
+    "userId": "6700c0ffee0000000000abcd",
+    "userName": "Ada Lovelace",
+    "content": "Pushing the refactor now, then a 25 minute focus block on the parser tests. Who's in?",
+    "timestamp": "2026-10-19T01:50:05.533353",
+}
+
+
+class FakeSocket:
+    def __init__(self):
+        self.frames = 0
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        self.frames += 1
+
+    async def send_json(self, data):
+        # What starlette's WebSocket.send_json does
+        await self.send_text(json.dumps(data, separators=(",", ":"), ensure_ascii=False))
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+async def old_broadcast(sockets, message):
+    for socket in sockets:
+        await socket.send_json(message)
+
+
+async def bench_old(room_size: int) -> float:
+    sockets = [FakeSocket() for _ in range(room_size)]
+    started = time.perf_counter()
+    for _ in range(MESSAGES):
+        await old_broadcast(sockets, MESSAGE)
+    return MESSAGES / (time.perf_counter() - started)
+
+
+async def bench_new(room_size: int) -> float:
+    rooms_router.WS_SEND_QUEUE_SIZE = MESSAGES  # measure throughput, not drops
+    manager = ConnectionManager()
+    sockets = [FakeSocket() for _ in range(room_size)]
+    connections = [await manager.connect(socket, "room") for socket in sockets]
+    started = time.perf_counter()
+    for _ in range(MESSAGES):
+        await manager.deliver("room:room", MESSAGE)
+    # Until every writer has flushed its queue (each socket also got a session frame on connect)
+    while any(socket.frames < MESSAGES + 1 for socket in sockets):
+        await asyncio.sleep(0)
+    elapsed = time.perf_counter() - started
+    for connection in connections:
+        await manager.leave(connection, "room")
+    return MESSAGES / elapsed
+
+
+async def main():
+    print(f"{MESSAGES} chat messages per room size (messages/sec delivered to the whole room)")
+    print(f"{'members':>8} {'per-recipient':>14} {'encode once':>12} {'speedup':>8}")
+    for room_size in (5, 50, 200, 1000):
+        old = await bench_old(room_size)
+        new = await bench_new(room_size)
+        print(f"{room_size:>8} {old:>14.0f} {new:>12.0f} {new / old:>7.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,135 @@
+import os
+import asyncio
+from typing import Dict, List, Optional
+from dotenv import load_dotenv
+from bson import ObjectId
+from pymongo import UpdateOne
+
+load_dotenv()
+
+# Write-behind persistence for room chat. Messages are broadcast straight away and
+# buffered here; the buffer is written every CHAT_FLUSH_INTERVAL_MS, or sooner once
+# CHAT_FLUSH_MAX_MESSAGES are waiting, as one bulk write with a $push/$each per room.
+#
+# Loss window: if the process dies without a clean shutdown, messages from the last
+# flush interval (plus any batch whose write was in flight) are lost; they were still
+# delivered to everyone in the room. A clean shutdown flushes everything.
+# CHAT_FLUSH_INTERVAL_MS=0 turns buffering off (one write per message, no loss window).
+CHAT_FLUSH_INTERVAL_MS = float(os.environ.get('CHAT_FLUSH_INTERVAL_MS', '250'))
+CHAT_FLUSH_MAX_MESSAGES = int(os.environ.get('CHAT_FLUSH_MAX_MESSAGES', '100'))
+# While Mongo is unreachable failed batches are retried; past this many buffered
+# messages the oldest are dropped
+CHAT_BUFFER_LIMIT = int(os.environ.get('CHAT_BUFFER_LIMIT', '10000'))
+# Rooms keep their latest ROOM_CHAT_HISTORY_LIMIT messages (older ones are trimmed on
+# write, however many members the room has), handed out ROOM_CHAT_PAGE_SIZE at a time
+ROOM_CHAT_HISTORY_LIMIT = int(os.environ.get('ROOM_CHAT_HISTORY_LIMIT', '500'))
+ROOM_CHAT_PAGE_SIZE = int(os.environ.get('ROOM_CHAT_PAGE_SIZE', '50'))
+
+
+def chat_page(messages: List[Dict], before: Optional[str] = None, limit: int = ROOM_CHAT_PAGE_SIZE) -> List[Dict]:
+    """The `limit` messages just before the one with id `before` (the newest, without it), oldest first"""
+    if before:
+        ids = [m.get("id") for m in messages]
+        messages = messages[:ids.index(before)] if before in ids else []
+    return messages[-limit:] if limit > 0 else []
+
+
+class ChatWriter:
+    def __init__(self):
+        self.db = None
+        self.pending: Dict[str, List[Dict]] = {}
+        self.count = 0
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.metrics = {"buffered": 0, "written": 0, "flushes": 0, "write_errors": 0, "dropped": 0, "max_batch": 0}
+
+    def start(self, db):
+        self.db = db
+        if CHAT_FLUSH_INTERVAL_MS > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flush loop and write whatever is still buffered"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.db is not None:
+            await self.flush()
+
+    async def add(self, db, room_id: str, message: Dict):
+        if not ObjectId.is_valid(room_id):
+            return  # would fail the whole batch on every retry
+        if not self._task:
+            # Not started (or CHAT_FLUSH_INTERVAL_MS=0): write through
+            self.db = db
+            await self._write({room_id: [message]})
+            return
+        self.pending.setdefault(room_id, []).append(message)
+        self.count += 1
+        self.metrics["buffered"] += 1
+        if self.count >= CHAT_FLUSH_MAX_MESSAGES:
+            self._wake.set()
+
+    def pending_for(self, room_id: str) -> List[Dict]:
+        """Messages in this room not yet written, so reads on this worker can include them"""
+        return list(self.pending.get(room_id, []))
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=CHAT_FLUSH_INTERVAL_MS / 1000)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def flush(self):
+        if not self.pending:
+            return
+        batch, self.pending, self.count = self.pending, {}, 0
+        if not await self._write(batch):
+            self._requeue(batch)
+
+    async def _write(self, batch: Dict[str, List[Dict]]) -> bool:
+        size = sum(len(messages) for messages in batch.values())
+        try:
+            await self.db.focus_rooms.bulk_write([
+                UpdateOne({"_id": ObjectId(room_id)},
+                          {"$push": {"chatHistory": {"$each": messages, "$slice": -ROOM_CHAT_HISTORY_LIMIT}}})
+                for room_id, messages in batch.items()
+            ], ordered=False)
+        except Exception as e:
+            self.metrics["write_errors"] += 1
+            print(f"Chat flush of {size} messages failed: {e}")
+            return False
+        self.metrics["written"] += size
+        self.metrics["flushes"] += 1
+        self.metrics["max_batch"] = max(self.metrics["max_batch"], size)
+        return True
+
+    def _requeue(self, batch: Dict[str, List[Dict]]):
+        # Failed messages go back in front of anything that arrived during the write
+        for room_id, messages in batch.items():
+            self.pending[room_id] = messages + self.pending.get(room_id, [])
+        self.count = sum(len(messages) for messages in self.pending.values())
+        while self.count > CHAT_BUFFER_LIMIT:
+            room_id = max(self.pending, key=lambda r: len(self.pending[r]))
+            self.pending[room_id].pop(0)
+            if not self.pending[room_id]:
+                del self.pending[room_id]
+            self.count -= 1
+            self.metrics["dropped"] += 1
+
+
+_writer: Optional[ChatWriter] = None
+
+
+def get_chat_writer() -> ChatWriter:
+    global _writer
+    if _writer is None:
+        _writer = ChatWriter()
+    return _writer
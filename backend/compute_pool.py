@@ -0,0 +1,69 @@
+import os
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict, Optional
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Process pool for the smart-plan optimizer (planner.build_plan over up to
+# PLAN_MAX_OPEN_TASKS tasks), so big backlogs don't stall the event loop that also serves
+# focus-room WebSockets. The rollup-based insight math is too small to be worth it.
+# COMPUTE_POOL_SIZE=0 runs everything inline.
+COMPUTE_POOL_SIZE = int(os.environ.get('COMPUTE_POOL_SIZE', str(min(2, os.cpu_count() or 1))))
+# Inputs with fewer rows than this run inline; pickling them costs more than computing them
+# (see bench_loop_lag.py)
+COMPUTE_INLINE_THRESHOLD = int(os.environ.get('COMPUTE_INLINE_THRESHOLD', '2000'))
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+metrics: Dict = {
+    "pool_size": COMPUTE_POOL_SIZE,
+    "inline_threshold": COMPUTE_INLINE_THRESHOLD,
+    "inline": 0,
+    "offloaded": 0,
+    "pool_failures": 0,
+}
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # spawn, not fork: forking a process with a running loop and motor's threads is unsafe
+        _pool = ProcessPoolExecutor(
+            max_workers=COMPUTE_POOL_SIZE,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _pool
+
+
+async def run_compute(fn: Callable, *args, size: int = 0):
+    """Run a pure, picklable function, in the pool when the input is big enough.
+
+    `size` is the number of input rows. Falls back to inline if the pool is off or broken.
+    """
+    global _pool
+    if COMPUTE_POOL_SIZE <= 0 or size < COMPUTE_INLINE_THRESHOLD:
+        metrics["inline"] += 1
+        return fn(*args)
+
+    try:
+        result = await asyncio.get_running_loop().run_in_executor(_get_pool(), fn, *args)
+        metrics["offloaded"] += 1
+        return result
+    except BrokenProcessPool as e:
+        # A worker died (OOM kill etc.); start a fresh pool next time
+        print(f"Compute pool broken, running inline: {e}")
+        metrics["pool_failures"] += 1
+        _pool = None
+        metrics["inline"] += 1
+        return fn(*args)
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
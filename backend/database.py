@@ -53,6 +53,20 @@ async def connect_to_mongo():
         await database.tasks.create_index([("userId", 1), ("createdAt", -1)])
         await database.focus_sessions.create_index([("userId", 1), ("startTime", -1)])
         await database.heatmap_entries.create_index([("userId", 1), ("date", -1)], unique=True)
+        await database.focus_rollups.create_index([("userId", 1), ("date", -1)])
+        await database.daily_recommendations.create_index([("userId", 1), ("date", -1)])
+        await database.daily_recommendations.create_index("expiresAt", expireAfterSeconds=0)
+        await database.llm_usage.create_index([("userId", 1), ("date", -1)])
+        await database.llm_usage.create_index("expiresAt", expireAfterSeconds=0)
+        await database.focus_rooms.create_index("timerStatus")
+        await database.room_presence.create_index("roomId")
+        await database.room_members.create_index([("roomId", 1), ("userId", 1)], unique=True)
+        await database.room_members.create_index([("roomId", 1), ("status", 1), ("_id", 1)])
+        await database.room_members.create_index("expiresAt", expireAfterSeconds=0)
+        await database.room_presence.create_index("expiresAt", expireAfterSeconds=0)
+        await database.insights_cache.create_index("userId")
+        await database.insights_jobs.create_index("expiresAt", expireAfterSeconds=0)
+        await database.leases.create_index("expiresAt", expireAfterSeconds=3600)
         print("✅ Database indexes created successfully")
     except Exception as e:
         print(f"⚠️  Warning: Index creation error (may already exist): {str(e)}")
@@ -0,0 +1,175 @@
+from typing import List, Dict, Optional
+
+from analytics import (
+    RollupFrame, peak_hour, rollup_hour_histogram, rollup_sessions_per_day,
+    rollup_late_night_count, rollup_half_duration_means
+)
+
+# Pure, post-fetch parts of InsightsService. Everything here takes and returns plain
+# picklable data (focus_rollups docs, heatmap minutes, projected task fields) and touches
+# neither the database nor the LLM providers. The inputs are a few dozen rollup docs and
+# capped task/heatmap lists, so it runs inline; only the planner is big enough for the
+# compute pool (see compute_pool.py).
+
+# Task fields the calculators read
+TASK_FIELDS = {
+    "_id": 0, "type": 1, "estimatedTime": 1, "totalFocusedTime": 1, "techTags": 1, "status": 1
+}
+
+
+def weekly_stats(rollups: List[Dict], tasks: List[Dict]) -> Dict[str, Optional[Dict]]:
+    """Insight data for the weekly section, keyed by insight type (None when not applicable)"""
+    frame = RollupFrame.from_rollups(rollups)
+    stats: Dict[str, Optional[Dict]] = {
+        "best_focus_time": None,
+        "task_efficiency": None,
+        "session_fatigue": None,
+        "tech_productivity": None,
+    }
+
+    # Best focus time window (completed minutes)
+    best_hour = peak_hour(*rollup_hour_histogram(frame))
+    if best_hour:
+        stats["best_focus_time"] = {
+            "hour": best_hour[0],
+            "total_minutes": int(best_hour[1])
+        }
+
+    # Task completion efficiency: first task type with both estimates and focused time
+    task_types_efficiency = {}
+    for task in tasks:
+        task_type = task.get("type", "Coding")
+        estimated = task.get("estimatedTime", 0)
+        actual = task.get("totalFocusedTime", 0)
+
+        if estimated > 0 and actual > 0:
+            if task_type not in task_types_efficiency:
+                task_types_efficiency[task_type] = {"estimated": 0, "actual": 0}
+            task_types_efficiency[task_type]["estimated"] += estimated
+            task_types_efficiency[task_type]["actual"] += actual
+
+    for task_type, data in task_types_efficiency.items():
+        stats["task_efficiency"] = {
+            "task_type": task_type,
+            "efficiency_ratio": data["actual"] / data["estimated"],
+            "estimated_time": data["estimated"],
+            "actual_time": data["actual"]
+        }
+        break  # Only show one efficiency insight
+
+    # Session fatigue analysis
+    if frame.session_count >= 3:
+        avg_sessions, active_days = rollup_sessions_per_day(frame)
+        stats["session_fatigue"] = {
+            "sessions_per_day": avg_sessions,
+            "total_days": active_days
+        }
+
+    # Tech stack productivity
+    tech_stats = {}
+    for task in tasks:
+        for tech in task.get("techTags", []):
+            if tech not in tech_stats:
+                tech_stats[tech] = {"total": 0, "completed": 0}
+            tech_stats[tech]["total"] += 1
+            if task.get("status") == "completed":
+                tech_stats[tech]["completed"] += 1
+
+    if tech_stats:
+        best_tech = max(tech_stats.items(), key=lambda x: x[1]["completed"])
+        stats["tech_productivity"] = {
+            "tech": best_tech[0],
+            "completion_rate": (best_tech[1]["completed"] / best_tech[1]["total"]) * 100,
+            "completed_tasks": best_tech[1]["completed"],
+            "total_tasks": best_tech[1]["total"]
+        }
+
+    return stats
+
+
+def monthly_stats(day_minutes: List[float], category_breakdowns: List[Dict], task_statuses: List[str]) -> Dict:
+    active_days = len(day_minutes)
+    total_minutes = sum(day_minutes)
+
+    category_totals = {}
+    for breakdown in category_breakdowns:
+        for category, minutes in breakdown.items():
+            category_totals[category] = category_totals.get(category, 0) + minutes
+
+    completed_tasks = sum(1 for status in task_statuses if status == "completed")
+    return {
+        "active_days": active_days,
+        "total_minutes": total_minutes,
+        "dominant_category": max(category_totals.items(), key=lambda x: x[1]) if category_totals else None,
+        "total_tasks": len(task_statuses),
+        "completed_tasks": completed_tasks,
+    }
+
+
+def burnout_stats(rollups: List[Dict], day_minutes: List[float], task_statuses: List[str]) -> Dict:
+    """Burnout signals and severity over the fetched window"""
+    frame = RollupFrame.from_rollups(rollups)
+    burnout_signals = []
+    severity = 0
+
+    # Signal 1: Consecutive high-intensity days (5+ days with 2+ hours)
+    high_intensity_days = sum(1 for minutes in day_minutes if minutes >= 120)
+    if high_intensity_days >= 5:
+        burnout_signals.append("consecutive_high_intensity")
+        severity += 2
+
+    # Signal 2: Late-night sessions (10 PM to 5 AM)
+    late_night_sessions = rollup_late_night_count(frame)
+    if late_night_sessions >= 3:
+        burnout_signals.append("late_night_work")
+        severity += 2
+
+    # Signal 3: Increasing session durations (earlier vs later active days)
+    if frame.completed_count >= 6:
+        avg_first, avg_second = rollup_half_duration_means(frame)
+        if avg_second > avg_first * 1.3:  # 30% increase
+            burnout_signals.append("increasing_session_length")
+            severity += 1
+
+    # Signal 4: Decreasing completion rate
+    if len(task_statuses) >= 5:
+        completion_rate = sum(1 for status in task_statuses if status == "completed") / len(task_statuses)
+        if completion_rate < 0.3:  # Less than 30% completion
+            burnout_signals.append("low_completion_rate")
+            severity += 2
+
+    # Signal 5: Very high daily focus time (4+ hours per day for 3+ days)
+    if sum(1 for minutes in day_minutes if minutes >= 240) >= 3:
+        burnout_signals.append("excessive_daily_hours")
+        severity += 1
+
+    return {
+        "signals": burnout_signals,
+        "severity": severity,
+        "high_intensity_days": high_intensity_days,
+        "late_night_sessions": late_night_sessions
+    }
+
+
+def plan_stats(rollups: List[Dict], day_minutes: List[float]) -> Dict:
+    """Best hour (most completed sessions, default 10 AM) and average daily capacity (default 2h)"""
+    frame = RollupFrame.from_rollups(rollups)
+    peak = peak_hour(*rollup_hour_histogram(frame, weights="completed"))
+    return {
+        "best_hour": peak[0] if peak else 10,
+        "capacity": sum(day_minutes) / len(day_minutes) if day_minutes else 120,
+    }
+
+
+def history_stats(rollups: List[Dict]) -> Dict:
+    frame = RollupFrame.from_rollups(rollups)
+    peak = peak_hour(*rollup_hour_histogram(frame, weights="count"))
+    total_focus_minutes = int(frame.minutes.sum())
+    completed = frame.completed_count
+    return {
+        "sessions": frame.session_count,
+        "total_focus_minutes": total_focus_minutes,
+        "avg_session_duration": (total_focus_minutes / completed) if completed else 0,
+        "best_hour": peak[0] if peak else 10,
+        "active_days": rollup_sessions_per_day(frame)[1],
+    }
@@ -0,0 +1,192 @@
+import os
+import time
+import asyncio
+from datetime import datetime
+from typing import List, Dict, Optional
+from dotenv import load_dotenv
+
+from insights_service import InsightsService, find_active_users
+from recommendations_batch import get_recommendations_batch, RECOMMENDATIONS_BATCH_ENABLED
+from leases import acquire_lease, release_lease
+from compute_pool import shutdown_pool
+
+load_dotenv()
+
+# Background precompute configuration
+INSIGHTS_PRECOMPUTE_ENABLED = os.environ.get('INSIGHTS_PRECOMPUTE_ENABLED', 'false').lower() == 'true'
+INSIGHTS_PRECOMPUTE_INTERVAL_MINUTES = float(os.environ.get('INSIGHTS_PRECOMPUTE_INTERVAL_MINUTES', '60'))
+# Off-peak window in UTC hours, e.g. "1-6" or "22-4"; empty means any time
+INSIGHTS_PRECOMPUTE_WINDOW = os.environ.get('INSIGHTS_PRECOMPUTE_WINDOW', '1-6')
+INSIGHTS_PRECOMPUTE_CONCURRENCY = int(os.environ.get('INSIGHTS_PRECOMPUTE_CONCURRENCY', '4'))
+INSIGHTS_PRECOMPUTE_MAX_USERS = int(os.environ.get('INSIGHTS_PRECOMPUTE_MAX_USERS', '500'))
+INSIGHTS_PRECOMPUTE_MAX_SECONDS = float(os.environ.get('INSIGHTS_PRECOMPUTE_MAX_SECONDS', '900'))
+INSIGHTS_PRECOMPUTE_ACTIVE_DAYS = int(os.environ.get('INSIGHTS_PRECOMPUTE_ACTIVE_DAYS', '7'))
+
+RUN_LEASE_KEY = "insights-precompute"
+
+
+def in_window(hour: int, window: str = INSIGHTS_PRECOMPUTE_WINDOW) -> bool:
+    if not window.strip():
+        return True
+    start, end = (int(part) for part in window.split("-"))
+    if start <= end:
+        return start <= hour < end
+    return hour >= start or hour < end  # wraps past midnight
+
+
+class InsightsPrecomputeScheduler:
+    """Refreshes insights for recently active users off-peak, then runs the recommendations batch.
+
+    Safe to run in every API worker and in standalone workers at the same time: a run-level
+    lease lets only one run proceed, and per-user refresh leases dedupe against refreshes
+    triggered by API requests.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._task: Optional[asyncio.Task] = None
+        self.metrics: Dict = {
+            "runs": 0,
+            "runs_skipped": 0,
+            "users_refreshed_total": 0,
+            "running": False,
+            "current_run": None,
+            "last_run": None,
+        }
+
+    async def find_active_users(self) -> List[str]:
+        return await find_active_users(self.db, INSIGHTS_PRECOMPUTE_ACTIVE_DAYS)
+
+    async def _process_user(self, service: InsightsService, user_id: str, run: Dict):
+        try:
+            if await service.needs_refresh(user_id):
+                job = await service.refresh_and_wait(user_id)
+                if job.get("status") == "done":
+                    run["refreshed"] += 1
+                elif job.get("status") == "failed":
+                    run["failed"] += 1
+                else:
+                    run["deduplicated"] += 1  # another worker holds this user's refresh
+            else:
+                run["skipped"] += 1
+        except Exception as e:
+            run["failed"] += 1
+            print(f"Insights precompute failed for {user_id}: {e}")
+        finally:
+            run["processed"] += 1
+
+    async def run_once(self) -> Optional[Dict]:
+        """Do one budgeted pass over active users. Returns None if another worker is running one."""
+        if not await acquire_lease(self.db, RUN_LEASE_KEY, INSIGHTS_PRECOMPUTE_MAX_SECONDS + 60):
+            self.metrics["runs_skipped"] += 1
+            return None
+
+        started = time.monotonic()
+        run = {
+            "started_at": datetime.utcnow().isoformat(),
+            "finished_at": None,
+            "active_users": 0,
+            "budget_users": INSIGHTS_PRECOMPUTE_MAX_USERS,
+            "processed": 0,
+            "refreshed": 0,
+            "skipped": 0,
+            "deduplicated": 0,
+            "failed": 0,
+            "budget_exhausted": False,
+            "users_per_second": 0.0,
+        }
+        self.metrics["running"] = True
+        self.metrics["current_run"] = run
+        try:
+            users = await self.find_active_users()
+            run["active_users"] = len(users)
+            service = InsightsService(self.db)
+            semaphore = asyncio.Semaphore(INSIGHTS_PRECOMPUTE_CONCURRENCY)
+
+            async def worker(user_id: str):
+                async with semaphore:
+                    if time.monotonic() - started > INSIGHTS_PRECOMPUTE_MAX_SECONDS:
+                        run["budget_exhausted"] = True
+                        return
+                    await self._process_user(service, user_id, run)
+                    run["users_per_second"] = round(run["processed"] / max(time.monotonic() - started, 1e-6), 2)
+
+            if len(users) > INSIGHTS_PRECOMPUTE_MAX_USERS:
+                run["budget_exhausted"] = True
+            await asyncio.gather(*(worker(uid) for uid in users[:INSIGHTS_PRECOMPUTE_MAX_USERS]))
+        finally:
+            run["finished_at"] = datetime.utcnow().isoformat()
+            run["duration_seconds"] = round(time.monotonic() - started, 2)
+            self.metrics["runs"] += 1
+            self.metrics["users_refreshed_total"] += run["refreshed"]
+            self.metrics["running"] = False
+            self.metrics["current_run"] = None
+            self.metrics["last_run"] = run
+            await release_lease(self.db, RUN_LEASE_KEY)
+
+        print(f"Insights precompute: {run['processed']}/{run['active_users']} users, "
+              f"{run['refreshed']} refreshed, {run['failed']} failed in {run['duration_seconds']}s")
+        return run
+
+    async def run_forever(self, respect_window: bool = True):
+        while True:
+            try:
+                if not respect_window or in_window(datetime.utcnow().hour):
+                    await self.run_once()
+                    if RECOMMENDATIONS_BATCH_ENABLED:
+                        await get_recommendations_batch(self.db).run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Insights precompute run failed: {e}")
+            await asyncio.sleep(INSIGHTS_PRECOMPUTE_INTERVAL_MINUTES * 60)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run_forever())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+_scheduler: Optional[InsightsPrecomputeScheduler] = None
+
+
+def get_scheduler(db) -> InsightsPrecomputeScheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = InsightsPrecomputeScheduler(db)
+    return _scheduler
+
+
+async def main(once: bool):
+    # Standalone worker: python insights_scheduler.py [--once]
+    from database import connect_to_mongo, close_mongo_connection, get_database
+    from ai_providers import init_provider_registry
+    from backplane import get_backplane
+
+    await connect_to_mongo()
+    init_provider_registry()
+    # So insights_ready notifications reach users connected to the API workers
+    await get_backplane().start(get_database())
+    scheduler = get_scheduler(get_database())
+    try:
+        if once:
+            await scheduler.run_once()
+        else:
+            await scheduler.run_forever()
+    finally:
+        await get_backplane().stop()
+        shutdown_pool()
+        await close_mongo_connection()
+
+
+if __name__ == "__main__":
+    import sys
+    asyncio.run(main("--once" in sys.argv))
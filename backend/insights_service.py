@@ -1,73 +1,92 @@
 import os
 from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, AsyncIterator
 from dotenv import load_dotenv
 import json
+import time
+import uuid
+import asyncio
 import httpx
 
+from ai_providers import get_provider_registry, provider_url, ProviderRateLimiter, LLMText, estimate_tokens
+from llm_usage import record_usage, within_budget
+from rollups import get_rollups
+from insights_compute import TASK_FIELDS, weekly_stats, monthly_stats, burnout_stats, plan_stats, history_stats
+from compute_pool import run_compute
+from planner import PLAN_TASK_FIELDS, build_plan
+from leases import WORKER_ID, acquire_lease, release_lease, get_lease
+from notifications import notify_user
+
 load_dotenv()
 
 # AI Configuration
 USE_AI_INSIGHTS = os.environ.get('USE_AI_INSIGHTS', 'false').lower() == 'true'
-AI_PRIMARY_PROVIDER = os.environ.get('AI_PRIMARY_PROVIDER')
-AI_PRIMARY_MODEL = os.environ.get('AI_PRIMARY_MODEL')
-AI_SECONDARY_PROVIDER = os.environ.get('AI_SECONDARY_PROVIDER')
-AI_SECONDARY_MODEL = os.environ.get('AI_SECONDARY_MODEL')
-AI_TERTIARY_PROVIDER = os.environ.get('AI_TERTIARY_PROVIDER')
-AI_TERTIARY_MODEL = os.environ.get('AI_TERTIARY_MODEL')
 
+CHAT_DISABLED_MESSAGE = "AI insights are currently disabled. Enable them in your environment configuration to chat with the AI coach."
+CHAT_UNAVAILABLE_MESSAGE = "I'm having trouble connecting to the AI service. Please try again later."
+CHAT_BUDGET_MESSAGE = "You've reached today's AI coach limit. Your insights will keep updating with standard tips, and the coach will be back tomorrow."
 
-class InsightsService:
-    """Service for generating insights from user data"""
-    
-    def __init__(self, db):
-        self.db = db
+# Insights cache
+# Activity marks sections dirty; the TTL only re-windows the 7/30 day ranges for idle users
+INSIGHTS_CACHE_TTL_HOURS = float(os.environ.get('INSIGHTS_CACHE_TTL_HOURS', '24'))
+INSIGHTS_REFRESH_LEASE_SECONDS = int(os.environ.get('INSIGHTS_REFRESH_LEASE_SECONDS', '300'))
+# How often a queued full refresh checks whether the lease has been released
+INSIGHTS_REFRESH_WAIT_SECONDS = 2
 
-    def _get_ai_model_configs(self) -> List[Dict]:
-        raw = os.environ.get("AI_MODELS") or os.environ.get("AI_MODELS_JSON")
-        if raw:
-            try:
-                parsed = json.loads(raw)
-                if isinstance(parsed, dict):
-                    parsed = [parsed]
-                if isinstance(parsed, list):
-                    return parsed
-            except Exception as e:
-                print(f"AI_MODELS parse failed: {e}")
+# Background refreshes in this process (latest per user): {user_id: (job_id, task, full)}
+_refresh_jobs: Dict[str, tuple] = {}
 
-        configs: List[Dict] = []
-        if AI_PRIMARY_PROVIDER and AI_PRIMARY_MODEL:
-            configs.append({"provider": AI_PRIMARY_PROVIDER, "model": AI_PRIMARY_MODEL, "isUsed": True})
-        if AI_SECONDARY_PROVIDER and AI_SECONDARY_MODEL:
-            configs.append({"provider": AI_SECONDARY_PROVIDER, "model": AI_SECONDARY_MODEL, "isUsed": True})
-        if AI_TERTIARY_PROVIDER and AI_TERTIARY_MODEL:
-            configs.append({"provider": AI_TERTIARY_PROVIDER, "model": AI_TERTIARY_MODEL, "isUsed": True})
-        return configs
+# Per-process memo of _get_user_history_summary: {user_id: (expires_at_monotonic, summary)}.
+# Invalidated on the user's own activity; the TTL covers the sliding 7-day window and
+# activity handled by other workers.
+HISTORY_SUMMARY_TTL_SECONDS = float(os.environ.get('HISTORY_SUMMARY_TTL_SECONDS', '900'))
+HISTORY_SUMMARY_MAX_ENTRIES = 10000
+HISTORY_SUMMARY_SOURCES = {"sessions", "tasks", "task_status"}
+_history_summaries: Dict[str, tuple] = {}
 
-    def _resolve_api_key(self, provider: str, config: Dict) -> Optional[str]:
-        api_key = config.get("apiKey") or config.get("api_key")
-        if isinstance(api_key, str) and api_key.startswith("env:"):
-            return os.environ.get(api_key[4:])
+# How long daily recommendations are kept after their day ends
+RECOMMENDATIONS_RETENTION_DAYS = int(os.environ.get('RECOMMENDATIONS_RETENTION_DAYS', '1'))
 
-        api_key_env = config.get("apiKeyEnv") or config.get("api_key_env")
-        if isinstance(api_key_env, str):
-            return os.environ.get(api_key_env)
+# Upper bound on open tasks fed to the smart-plan optimizer
+PLAN_MAX_OPEN_TASKS = int(os.environ.get('PLAN_MAX_OPEN_TASKS', '5000'))
 
-        if isinstance(api_key, str) and api_key.strip():
-            return api_key.strip()
+# Cached section -> field in insights_cache
+INSIGHT_SECTIONS = {
+    "weekly": "weekly_insights",
+    "monthly": "monthly_insights",
+    "burnout": "burnout_detection",
+    "smart_plan": "smart_plan",
+}
 
-        provider_l = (provider or "").lower()
-        if provider_l == "openai":
-            return os.environ.get("OPENAI_API_KEY")
-        if provider_l == "groq":
-            return os.environ.get("GROQ_API_KEY")
-        if provider_l == "anthropic":
-            return os.environ.get("ANTHROPIC_API_KEY")
-        if provider_l == "gemini":
-            return os.environ.get("GEMINI_API_KEY") or os.environ.get("GOOGLE_API_KEY")
-        return None
+# Which kinds of user activity each section reads ("sessions" means focus_rollups).
+# "tasks" is any task edit (weekly reads type/estimate/tags, burnout windows on updatedAt,
+# the smart plan lists titles); "task_status" is a task being added, removed or completed.
+SECTION_SOURCES = {
+    "weekly": {"sessions", "tasks", "task_status"},
+    "monthly": {"heatmap", "task_status"},
+    "burnout": {"heatmap", "sessions", "tasks", "task_status"},
+    "smart_plan": {"heatmap", "sessions", "tasks", "task_status"},
+}
+
+
+async def find_active_users(db, days: int) -> List[str]:
+    """Users with sessions, task edits or room time in the last `days` days"""
+    since = datetime.utcnow() - timedelta(days=days)
+    users = set(await db.focus_sessions.distinct("userId", {"startTime": {"$gte": since.isoformat()}}))
+    users.update(await db.tasks.distinct("userId", {"updatedAt": {"$gte": since.isoformat()}}))
+    # Room sessions only leave heatmap entries
+    users.update(await db.heatmap_entries.distinct("userId", {"date": {"$gte": since.date().isoformat()}}))
+    return sorted(uid for uid in users if uid)
 
-    async def _call_openai(self, api_key: str, model: str, system_message: str, prompt: str) -> str:
+
+class InsightsService:
+    """Service for generating insights from user data"""
+    
+    def __init__(self, db):
+        self.db = db
+        self._budget_ok: Dict[str, bool] = {}
+
+    async def _call_openai(self, api_key: str, model: str, system_message: str, prompt: str, base_url: Optional[str] = None) -> str:
         headers = {
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json",
@@ -83,17 +102,23 @@ class InsightsService:
         }
 
         async with httpx.AsyncClient(timeout=30) as client:
-            r = await client.post("https://api.openai.com/v1/chat/completions", headers=headers, json=payload)
+            r = await client.post(provider_url("openai", base_url, "/chat/completions"), headers=headers, json=payload)
             r.raise_for_status()
             data = r.json()
 
+        return self._parse_chat_completion(data)
+
+    def _parse_chat_completion(self, data: Dict) -> LLMText:
+        # OpenAI-compatible response body (OpenAI, Groq)
+        usage = data.get("usage") or {}
         choices = data.get("choices") or []
-        if not choices:
-            return ""
-        message = (choices[0] or {}).get("message") or {}
-        return (message.get("content") or "").strip()
+        message = ((choices[0] or {}).get("message") or {}) if choices else {}
+        return LLMText((message.get("content") or "").strip(), {
+            "input_tokens": usage.get("prompt_tokens"),
+            "output_tokens": usage.get("completion_tokens"),
+        } if usage else None)
 
-    async def _call_groq(self, api_key: str, model: str, system_message: str, prompt: str) -> str:
+    async def _call_groq(self, api_key: str, model: str, system_message: str, prompt: str, base_url: Optional[str] = None) -> str:
         headers = {
             "Authorization": f"Bearer {api_key}",
             "Content-Type": "application/json",
@@ -109,17 +134,13 @@ class InsightsService:
         }
 
         async with httpx.AsyncClient(timeout=30) as client:
-            r = await client.post("https://api.groq.com/openai/v1/chat/completions", headers=headers, json=payload)
+            r = await client.post(provider_url("groq", base_url, "/chat/completions"), headers=headers, json=payload)
             r.raise_for_status()
             data = r.json()
 
-        choices = data.get("choices") or []
-        if not choices:
-            return ""
-        message = (choices[0] or {}).get("message") or {}
-        return (message.get("content") or "").strip()
+        return self._parse_chat_completion(data)
 
-    async def _call_anthropic(self, api_key: str, model: str, system_message: str, prompt: str) -> str:
+    async def _call_anthropic(self, api_key: str, model: str, system_message: str, prompt: str, base_url: Optional[str] = None) -> str:
         headers = {
             "x-api-key": api_key,
             "anthropic-version": "2023-06-01",
@@ -133,18 +154,20 @@ class InsightsService:
         }
 
         async with httpx.AsyncClient(timeout=30) as client:
-            r = await client.post("https://api.anthropic.com/v1/messages", headers=headers, json=payload)
+            r = await client.post(provider_url("anthropic", base_url, "/messages"), headers=headers, json=payload)
             r.raise_for_status()
             data = r.json()
 
+        usage = data.get("usage") or {}
         content = data.get("content") or []
-        if not content:
-            return ""
-        first = content[0] or {}
-        return (first.get("text") or "").strip()
+        first = (content[0] or {}) if content else {}
+        return LLMText((first.get("text") or "").strip(), {
+            "input_tokens": usage.get("input_tokens"),
+            "output_tokens": usage.get("output_tokens"),
+        } if usage else None)
 
-    async def _call_gemini(self, api_key: str, model: str, system_message: str, prompt: str) -> str:
-        url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={api_key}"
+    async def _call_gemini(self, api_key: str, model: str, system_message: str, prompt: str, base_url: Optional[str] = None) -> str:
+        url = provider_url("gemini", base_url, f"/models/{model}:generateContent?key={api_key}")
         payload = {
             "system_instruction": {"parts": [{"text": system_message}]},
             "contents": [{"role": "user", "parts": [{"text": prompt}]}],
@@ -156,6 +179,9 @@ class InsightsService:
             r.raise_for_status()
             data = r.json()
 
+        return LLMText(self._gemini_text(data), self._gemini_usage(data))
+
+    def _gemini_text(self, data: Dict) -> str:
         candidates = data.get("candidates") or []
         if not candidates:
             return ""
@@ -165,18 +191,193 @@ class InsightsService:
             return ""
         return (parts[0].get("text") or "").strip()
 
-    async def _call_llm_provider(self, provider: str, api_key: str, model: str, system_message: str, prompt: str) -> str:
+    def _gemini_usage(self, data: Dict) -> Optional[Dict]:
+        usage = data.get("usageMetadata")
+        if not usage:
+            return None
+        return {"input_tokens": usage.get("promptTokenCount"), "output_tokens": usage.get("candidatesTokenCount")}
+
+    async def _call_llm_provider(self, provider: str, api_key: str, model: str, system_message: str, prompt: str,
+                                 base_url: Optional[str] = None) -> str:
         provider_l = (provider or "").lower()
         if provider_l == "openai":
-            return await self._call_openai(api_key, model, system_message, prompt)
+            return await self._call_openai(api_key, model, system_message, prompt, base_url)
         if provider_l == "groq":
-            return await self._call_groq(api_key, model, system_message, prompt)
+            return await self._call_groq(api_key, model, system_message, prompt, base_url)
         if provider_l == "anthropic":
-            return await self._call_anthropic(api_key, model, system_message, prompt)
+            return await self._call_anthropic(api_key, model, system_message, prompt, base_url)
         if provider_l == "gemini":
-            return await self._call_gemini(api_key, model, system_message, prompt)
+            return await self._call_gemini(api_key, model, system_message, prompt, base_url)
         raise ValueError(f"Unsupported AI provider: {provider}")
     
+    async def _iter_sse_data(self, response: httpx.Response) -> AsyncIterator[Dict]:
+        """Yield the JSON payload of each `data:` line of a server-sent event stream"""
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            data = line[5:].strip()
+            if not data or data == "[DONE]":
+                continue
+            yield json.loads(data)
+
+    async def _stream_chat_completions(self, url: str, api_key: str, model: str, system_message: str, prompt: str,
+                                       usage: Optional[Dict] = None) -> AsyncIterator[str]:
+        headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+        }
+        payload = {
+            "model": model,
+            "messages": [
+                {"role": "system", "content": system_message},
+                {"role": "user", "content": prompt},
+            ],
+            "temperature": 0.7,
+            "max_tokens": 220,
+            "stream": True,
+            # Final chunk carries the token usage
+            "stream_options": {"include_usage": True},
+        }
+
+        async with httpx.AsyncClient(timeout=30) as client:
+            async with client.stream("POST", url, headers=headers, json=payload) as r:
+                r.raise_for_status()
+                async for event in self._iter_sse_data(r):
+                    # Groq also reports it under x_groq
+                    reported = event.get("usage") or (event.get("x_groq") or {}).get("usage")
+                    if reported and usage is not None:
+                        usage.update(input_tokens=reported.get("prompt_tokens"), output_tokens=reported.get("completion_tokens"))
+                    choices = event.get("choices") or []
+                    if choices:
+                        text = ((choices[0] or {}).get("delta") or {}).get("content")
+                        if text:
+                            yield text
+
+    async def _stream_openai(self, api_key: str, model: str, system_message: str, prompt: str,
+                             base_url: Optional[str] = None, usage: Optional[Dict] = None) -> AsyncIterator[str]:
+        url = provider_url("openai", base_url, "/chat/completions")
+        async for text in self._stream_chat_completions(url, api_key, model, system_message, prompt, usage):
+            yield text
+
+    async def _stream_groq(self, api_key: str, model: str, system_message: str, prompt: str,
+                           base_url: Optional[str] = None, usage: Optional[Dict] = None) -> AsyncIterator[str]:
+        url = provider_url("groq", base_url, "/chat/completions")
+        async for text in self._stream_chat_completions(url, api_key, model, system_message, prompt, usage):
+            yield text
+
+    async def _stream_anthropic(self, api_key: str, model: str, system_message: str, prompt: str,
+                                base_url: Optional[str] = None, usage: Optional[Dict] = None) -> AsyncIterator[str]:
+        headers = {
+            "x-api-key": api_key,
+            "anthropic-version": "2023-06-01",
+            "Content-Type": "application/json",
+        }
+        payload = {
+            "model": model,
+            "max_tokens": 240,
+            "system": system_message,
+            "messages": [{"role": "user", "content": prompt}],
+            "stream": True,
+        }
+
+        async with httpx.AsyncClient(timeout=30) as client:
+            async with client.stream("POST", provider_url("anthropic", base_url, "/messages"), headers=headers, json=payload) as r:
+                r.raise_for_status()
+                async for event in self._iter_sse_data(r):
+                    if event.get("type") == "content_block_delta":
+                        text = (event.get("delta") or {}).get("text")
+                        if text:
+                            yield text
+                    elif event.get("type") == "message_start" and usage is not None:
+                        usage["input_tokens"] = ((event.get("message") or {}).get("usage") or {}).get("input_tokens")
+                    elif event.get("type") == "message_delta" and usage is not None:
+                        usage["output_tokens"] = (event.get("usage") or {}).get("output_tokens")
+                    elif event.get("type") == "error":
+                        raise RuntimeError((event.get("error") or {}).get("message") or "Anthropic stream error")
+
+    async def _stream_gemini(self, api_key: str, model: str, system_message: str, prompt: str,
+                             base_url: Optional[str] = None, usage: Optional[Dict] = None) -> AsyncIterator[str]:
+        url = provider_url("gemini", base_url, f"/models/{model}:streamGenerateContent?alt=sse&key={api_key}")
+        payload = {
+            "system_instruction": {"parts": [{"text": system_message}]},
+            "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+            "generationConfig": {"temperature": 0.7, "maxOutputTokens": 240},
+        }
+
+        async with httpx.AsyncClient(timeout=30) as client:
+            async with client.stream("POST", url, json=payload) as r:
+                r.raise_for_status()
+                async for event in self._iter_sse_data(r):
+                    # Every chunk repeats the running totals; keep the last
+                    reported = self._gemini_usage(event)
+                    if reported and usage is not None:
+                        usage.update(reported)
+                    candidates = event.get("candidates") or []
+                    if not candidates:
+                        continue
+                    parts = ((candidates[0] or {}).get("content") or {}).get("parts") or []
+                    for part in parts:
+                        if part.get("text"):
+                            yield part["text"]
+
+    def _stream_llm_provider(self, provider: str, api_key: str, model: str, system_message: str, prompt: str,
+                             base_url: Optional[str] = None, usage: Optional[Dict] = None) -> AsyncIterator[str]:
+        """Stream from one provider; token usage, when reported, is written into `usage`"""
+        provider_l = (provider or "").lower()
+        if provider_l == "openai":
+            return self._stream_openai(api_key, model, system_message, prompt, base_url, usage)
+        if provider_l == "groq":
+            return self._stream_groq(api_key, model, system_message, prompt, base_url, usage)
+        if provider_l == "anthropic":
+            return self._stream_anthropic(api_key, model, system_message, prompt, base_url, usage)
+        if provider_l == "gemini":
+            return self._stream_gemini(api_key, model, system_message, prompt, base_url, usage)
+        raise ValueError(f"Unsupported AI provider: {provider}")
+    
+    async def _within_budget(self, user_id: Optional[str]) -> bool:
+        if not user_id:
+            return True
+        if user_id not in self._budget_ok:
+            # Checked once per service instance (i.e. per request or batch user), so a refresh
+            # that makes several calls may run slightly past the budget
+            self._budget_ok[user_id] = await within_budget(self.db, user_id)
+        return self._budget_ok[user_id]
+    
+    async def _record_usage(self, user_id: Optional[str], endpoint: str, trace: Dict, prompt_text: str, response: str):
+        if not user_id or "provider" not in trace:
+            return
+        usage = trace.get("usage") or {}
+        input_tokens, output_tokens = usage.get("input_tokens"), usage.get("output_tokens")
+        estimated = input_tokens is None or output_tokens is None
+        if input_tokens is None:
+            input_tokens = estimate_tokens(prompt_text)
+        if output_tokens is None:
+            output_tokens = estimate_tokens(response)
+        trace.update(input_tokens=input_tokens, output_tokens=output_tokens)
+        try:
+            await record_usage(self.db, user_id, endpoint, trace["provider"], trace["model"], input_tokens, output_tokens, estimated)
+        except Exception as e:
+            print(f"LLM usage recording failed: {e}")
+    
+    async def _complete(self, user_id: Optional[str], endpoint: str, system_message: str, prompt: str,
+                        accept=None, label: str = "AI", limiter: Optional[ProviderRateLimiter] = None,
+                        trace: Optional[Dict] = None) -> Optional[str]:
+        """registry.complete plus the user's budget check and usage accounting.
+
+        Returns None when over budget or when every provider failed; callers fall back to
+        rule-based text either way.
+        """
+        if not await self._within_budget(user_id):
+            return None
+        trace = trace if trace is not None else {}
+        response = await get_provider_registry().complete(
+            self._call_llm_provider, system_message, prompt,
+            accept=accept, label=label, limiter=limiter, trace=trace
+        )
+        if response:
+            await self._record_usage(user_id, endpoint, trace, system_message + prompt, response)
+        return response
+    
     def _should_use_ai(self, context: str) -> bool:
         """Determine if AI should be used for this insight type"""
         # Only use AI for personalized recommendations, not calculations
@@ -248,7 +449,7 @@ class InsightsService:
         
         return "User productivity data"
     
-    async def generate_ai_description(self, insight_data: Dict, context: str) -> str:
+    async def generate_ai_description(self, insight_data: Dict, context: str, user_id: Optional[str] = None) -> str:
         """Generate personalized insight description using AI with privacy-focused summaries"""
 
         # Check if AI should be used for this context
@@ -266,56 +467,17 @@ class InsightsService:
 
 Provide encouraging, actionable advice that helps the user improve their productivity."""
 
-        # Try Groq first (primary provider), then fallback to other providers
-        model_configs = self._get_ai_model_configs()
-        
-        # Ensure Groq is first if available
-        groq_config = None
-        other_configs = []
-        for config in model_configs:
-            if config.get("provider", "").lower() == "groq":
-                groq_config = config
-            else:
-                other_configs.append(config)
-        
-        # Prioritize Groq
-        ordered_configs = []
-        if groq_config:
-            ordered_configs.append(groq_config)
-        ordered_configs.extend(other_configs)
-        
-        # If no configs, try default Groq
-        if not ordered_configs:
-            groq_key = os.environ.get("GROQ_API_KEY")
-            if groq_key:
-                ordered_configs.append({
-                    "provider": "groq",
-                    "model": "llama-3.1-70b-versatile",
-                    "isUsed": True
-                })
-        
-        if not ordered_configs:
-            return self._generate_rule_based_description(insight_data, context)
-        
-        for idx, config in enumerate(ordered_configs, start=1):
-            is_used = config.get("isUsed")
-            if is_used is None:
-                is_used = config.get("is_used", True)
-            if str(is_used).lower() != "true":
-                continue
-
-            provider = config.get("provider") or ""
-            model = config.get("model") or ""
-            api_key = self._resolve_api_key(provider, config)
-            if not provider or not model or not api_key:
-                continue
-
-            try:
-                response = await self._call_llm_provider(provider, api_key, model, system_message, prompt)
-                if response and len(response.strip()) > 20:
-                    return response.strip()
-            except Exception as e:
-                print(f"AI provider attempt {idx} failed ({provider}/{model}): {e}")
+        # Best healthy provider first, falling back down the registry's ranking
+        response = await self._complete(
+            user_id,
+            "insights",
+            system_message,
+            prompt,
+            accept=lambda r: len(r.strip()) > 20,
+            label="AI",
+        )
+        if response:
+            return response
         
         # Fallback to rule-based
         return self._generate_rule_based_description(insight_data, context)
@@ -362,99 +524,49 @@ Provide encouraging, actionable advice that helps the user improve their product
         end_date = datetime.utcnow()
         start_date = end_date - timedelta(days=7)
         
-        # Get heatmap data for the week
-        heatmap_data = await self.db.heatmap_entries.find({
-            "userId": user_id,
-            "date": {"$gte": start_date.date().isoformat(), "$lte": end_date.date().isoformat()}
-        }).to_list(100)
-        
-        # Get focus sessions for the week
-        sessions = await self.db.focus_sessions.find({
-            "userId": user_id,
-            "startTime": {"$gte": start_date.isoformat()}
-        }).to_list(500)
+        # Daily focus rollups for the week
+        rollups = await get_rollups(self.db, user_id, start_date, end_date)
         
         # Get tasks for the week
         tasks = await self.db.tasks.find({
             "userId": user_id,
             "createdAt": {"$gte": start_date.isoformat()}
-        }).to_list(100)
+        }, TASK_FIELDS).to_list(100)
+        
+        stats = weekly_stats(rollups, tasks)
         
         insights = []
         
         # Insight 1: Best focus time window
-        if sessions:
-            hour_distribution = {}
-            for session in sessions:
-                if session.get("startTime"):
-                    hour = datetime.fromisoformat(session["startTime"]).hour
-                    hour_distribution[hour] = hour_distribution.get(hour, 0) + session.get("duration", 0)
+        if stats["best_focus_time"]:
+            insight_data = stats["best_focus_time"]
+            description = await self.generate_ai_description(insight_data, "best_focus_time", user_id)
             
-            if hour_distribution:
-                best_hour = max(hour_distribution.items(), key=lambda x: x[1])
-                insight_data = {
-                    "hour": best_hour[0],
-                    "total_minutes": best_hour[1]
-                }
-                description = await self.generate_ai_description(insight_data, "best_focus_time")
-                
-                insights.append({
-                    "type": "best_focus_time",
-                    "title": "Peak Productivity Window",
-                    "description": description,
-                    "data": insight_data,
-                    "icon": "clock"
-                })
+            insights.append({
+                "type": "best_focus_time",
+                "title": "Peak Productivity Window",
+                "description": description,
+                "data": insight_data,
+                "icon": "clock"
+            })
         
         # Insight 2: Task completion efficiency
-        if tasks:
-            task_types_efficiency = {}
-            for task in tasks:
-                task_type = task.get("type", "Coding")
-                estimated = task.get("estimatedTime", 0)
-                actual = task.get("totalFocusedTime", 0)
-                
-                if estimated > 0 and actual > 0:
-                    if task_type not in task_types_efficiency:
-                        task_types_efficiency[task_type] = {"estimated": 0, "actual": 0}
-                    task_types_efficiency[task_type]["estimated"] += estimated
-                    task_types_efficiency[task_type]["actual"] += actual
+        if stats["task_efficiency"]:
+            insight_data = stats["task_efficiency"]
+            description = await self.generate_ai_description(insight_data, "task_completion_efficiency", user_id)
             
-            for task_type, data in task_types_efficiency.items():
-                if data["estimated"] > 0:
-                    ratio = data["actual"] / data["estimated"]
-                    insight_data = {
-                        "task_type": task_type,
-                        "efficiency_ratio": ratio,
-                        "estimated_time": data["estimated"],
-                        "actual_time": data["actual"]
-                    }
-                    description = await self.generate_ai_description(insight_data, "task_completion_efficiency")
-                    
-                    insights.append({
-                        "type": "task_efficiency",
-                        "title": f"{task_type} Task Efficiency",
-                        "description": description,
-                        "data": insight_data,
-                        "icon": "target"
-                    })
-                    break  # Only show one efficiency insight
+            insights.append({
+                "type": "task_efficiency",
+                "title": f"{insight_data['task_type']} Task Efficiency",
+                "description": description,
+                "data": insight_data,
+                "icon": "target"
+            })
         
         # Insight 3: Session fatigue analysis
-        if len(sessions) >= 3:
-            sessions_by_day = {}
-            for session in sessions:
-                if session.get("startTime"):
-                    date = datetime.fromisoformat(session["startTime"]).date().isoformat()
-                    sessions_by_day[date] = sessions_by_day.get(date, 0) + 1
-            
-            avg_sessions = sum(sessions_by_day.values()) / max(len(sessions_by_day), 1)
-            
-            insight_data = {
-                "sessions_per_day": avg_sessions,
-                "total_days": len(sessions_by_day)
-            }
-            description = await self.generate_ai_description(insight_data, "session_fatigue")
+        if stats["session_fatigue"]:
+            insight_data = stats["session_fatigue"]
+            description = await self.generate_ai_description(insight_data, "session_fatigue", user_id)
             
             insights.append({
                 "type": "session_fatigue",
@@ -465,35 +577,17 @@ Provide encouraging, actionable advice that helps the user improve their product
             })
         
         # Insight 4: Tech stack productivity
-        if tasks:
-            tech_stats = {}
-            for task in tasks:
-                for tech in task.get("techTags", []):
-                    if tech not in tech_stats:
-                        tech_stats[tech] = {"total": 0, "completed": 0}
-                    tech_stats[tech]["total"] += 1
-                    if task.get("status") == "completed":
-                        tech_stats[tech]["completed"] += 1
+        if stats["tech_productivity"]:
+            insight_data = stats["tech_productivity"]
+            description = await self.generate_ai_description(insight_data, "tech_productivity", user_id)
             
-            if tech_stats:
-                best_tech = max(tech_stats.items(), key=lambda x: x[1]["completed"])
-                if best_tech[1]["total"] > 0:
-                    completion_rate = (best_tech[1]["completed"] / best_tech[1]["total"]) * 100
-                    insight_data = {
-                        "tech": best_tech[0],
-                        "completion_rate": completion_rate,
-                        "completed_tasks": best_tech[1]["completed"],
-                        "total_tasks": best_tech[1]["total"]
-                    }
-                    description = await self.generate_ai_description(insight_data, "tech_productivity")
-                    
-                    insights.append({
-                        "type": "tech_productivity",
-                        "title": "Tech Stack Strength",
-                        "description": description,
-                        "data": insight_data,
-                        "icon": "code"
-                    })
+            insights.append({
+                "type": "tech_productivity",
+                "title": "Tech Stack Strength",
+                "description": description,
+                "data": insight_data,
+                "icon": "code"
+            })
         
         return insights[:4]  # Return top 4 insights
     
@@ -507,16 +601,22 @@ Provide encouraging, actionable advice that helps the user improve their product
         heatmap_data = await self.db.heatmap_entries.find({
             "userId": user_id,
             "date": {"$gte": start_date.date().isoformat(), "$lte": end_date.date().isoformat()}
-        }).to_list(100)
+        }, {"_id": 0, "totalMinutes": 1, "categoryBreakdown": 1}).to_list(100)
         
         # Get all tasks for analysis
-        tasks = await self.db.tasks.find({"userId": user_id}).to_list(200)
+        tasks = await self.db.tasks.find({"userId": user_id}, {"_id": 0, "status": 1}).to_list(200)
+        
+        stats = monthly_stats(
+            [day.get("totalMinutes", 0) for day in heatmap_data],
+            [day.get("categoryBreakdown") or {} for day in heatmap_data],
+            [t.get("status") for t in tasks]
+        )
         
         insights = []
         
         # Insight 1: Monthly consistency
-        active_days = len(heatmap_data)
-        total_minutes = sum(day.get("totalMinutes", 0) for day in heatmap_data)
+        active_days = stats["active_days"]
+        total_minutes = stats["total_minutes"]
         
         if active_days > 0:
             avg_daily_minutes = total_minutes / 30  # Average over 30 days
@@ -528,7 +628,7 @@ Provide encouraging, actionable advice that helps the user improve their product
                 "consistency_score": (active_days / 30) * 100
             }
             
-            description = await self.generate_ai_description(insight_data, "monthly_consistency")
+            description = await self.generate_ai_description(insight_data, "monthly_consistency", user_id)
             if description == self._generate_rule_based_description(insight_data, "monthly_consistency"):
                 # Custom rule-based for monthly
                 if active_days >= 20:
@@ -547,20 +647,21 @@ Provide encouraging, actionable advice that helps the user improve their product
             })
         
         # Insight 2: Task completion trends
-        completed_tasks = [t for t in tasks if t.get("status") == "completed"]
-        completion_rate = (len(completed_tasks) / len(tasks) * 100) if tasks else 0
+        total_tasks = stats["total_tasks"]
+        completed_tasks = stats["completed_tasks"]
+        completion_rate = (completed_tasks / total_tasks * 100) if total_tasks else 0
         
-        if tasks:
+        if total_tasks:
             insight_data = {
-                "total_tasks": len(tasks),
-                "completed_tasks": len(completed_tasks),
+                "total_tasks": total_tasks,
+                "completed_tasks": completed_tasks,
                 "completion_rate": completion_rate
             }
             
-            description = await self.generate_ai_description(insight_data, "completion_trend")
+            description = await self.generate_ai_description(insight_data, "completion_trend", user_id)
             if description == self._generate_rule_based_description(insight_data, "completion_trend"):
                 if completion_rate >= 70:
-                    description = f"Excellent! You've completed {len(completed_tasks)} of {len(tasks)} tasks ({completion_rate:.0f}%). Your follow-through is strong."
+                    description = f"Excellent! You've completed {completed_tasks} of {total_tasks} tasks ({completion_rate:.0f}%). Your follow-through is strong."
                 elif completion_rate >= 40:
                     description = f"You're completing {completion_rate:.0f}% of tasks. Focus on finishing what you start to build momentum and confidence."
                 else:
@@ -575,33 +676,25 @@ Provide encouraging, actionable advice that helps the user improve their product
             })
         
         # Insight 3: Category focus distribution
-        if heatmap_data:
-            category_totals = {}
-            for day in heatmap_data:
-                breakdown = day.get("categoryBreakdown", {})
-                for category, minutes in breakdown.items():
-                    category_totals[category] = category_totals.get(category, 0) + minutes
+        dominant_category = stats["dominant_category"]
+        if dominant_category:
+            insight_data = {
+                "dominant_category": dominant_category[0],
+                "minutes": dominant_category[1],
+                "percentage": (dominant_category[1] / total_minutes * 100) if total_minutes > 0 else 0
+            }
             
-            if category_totals:
-                dominant_category = max(category_totals.items(), key=lambda x: x[1])
-                
-                insight_data = {
-                    "dominant_category": dominant_category[0],
-                    "minutes": dominant_category[1],
-                    "percentage": (dominant_category[1] / total_minutes * 100) if total_minutes > 0 else 0
-                }
-                
-                description = await self.generate_ai_description(insight_data, "category_focus")
-                if description == self._generate_rule_based_description(insight_data, "category_focus"):
-                    description = f"You've spent {dominant_category[1]} minutes on {dominant_category[0]} ({insight_data['percentage']:.0f}% of your time). This is your primary focus area this month."
-                
-                insights.append({
-                    "type": "category_focus",
-                    "title": "Primary Focus Area",
-                    "description": description,
-                    "data": insight_data,
-                    "icon": "pie-chart"
-                })
+            description = await self.generate_ai_description(insight_data, "category_focus", user_id)
+            if description == self._generate_rule_based_description(insight_data, "category_focus"):
+                description = f"You've spent {dominant_category[1]} minutes on {dominant_category[0]} ({insight_data['percentage']:.0f}% of your time). This is your primary focus area this month."
+            
+            insights.append({
+                "type": "category_focus",
+                "title": "Primary Focus Area",
+                "description": description,
+                "data": insight_data,
+                "icon": "pie-chart"
+            })
         
         return insights[:3]  # Return top 3 monthly insights
     
@@ -615,79 +708,31 @@ Provide encouraging, actionable advice that helps the user improve their product
         heatmap_data = await self.db.heatmap_entries.find({
             "userId": user_id,
             "date": {"$gte": start_date.date().isoformat(), "$lte": end_date.date().isoformat()}
-        }).sort("date", 1).to_list(100)
+        }, {"_id": 0, "totalMinutes": 1}).sort("date", 1).to_list(100)
         
-        sessions = await self.db.focus_sessions.find({
-            "userId": user_id,
-            "startTime": {"$gte": start_date.isoformat()}
-        }).to_list(500)
+        rollups = await get_rollups(self.db, user_id, start_date, end_date)
         
         tasks = await self.db.tasks.find({
             "userId": user_id,
             "updatedAt": {"$gte": start_date.isoformat()}
-        }).to_list(100)
-        
-        burnout_signals = []
-        severity = 0
-        
-        # Signal 1: Consecutive high-intensity days (5+ days with 2+ hours)
-        high_intensity_days = sum(1 for day in heatmap_data if day.get("totalMinutes", 0) >= 120)
-        if high_intensity_days >= 5:
-            burnout_signals.append("consecutive_high_intensity")
-            severity += 2
-        
-        # Signal 2: Late-night sessions (after 10 PM)
-        late_night_sessions = 0
-        for session in sessions:
-            if session.get("startTime"):
-                hour = datetime.fromisoformat(session["startTime"]).hour
-                if hour >= 22 or hour <= 5:  # 10 PM to 5 AM
-                    late_night_sessions += 1
-        
-        if late_night_sessions >= 3:
-            burnout_signals.append("late_night_work")
-            severity += 2
-        
-        # Signal 3: Increasing session durations
-        if len(sessions) >= 6:
-            first_half = sessions[:len(sessions)//2]
-            second_half = sessions[len(sessions)//2:]
-            
-            avg_first = sum(s.get("duration", 0) for s in first_half) / len(first_half) if first_half else 0
-            avg_second = sum(s.get("duration", 0) for s in second_half) / len(second_half) if second_half else 0
-            
-            if avg_second > avg_first * 1.3:  # 30% increase
-                burnout_signals.append("increasing_session_length")
-                severity += 1
-        
-        # Signal 4: Decreasing completion rate
-        recent_tasks = [t for t in tasks if t.get("status") == "completed"]
-        total_recent = len(tasks)
-        
-        if total_recent >= 5:
-            completion_rate = len(recent_tasks) / total_recent
-            if completion_rate < 0.3:  # Less than 30% completion
-                burnout_signals.append("low_completion_rate")
-                severity += 2
-        
-        # Signal 5: Very high daily focus time (4+ hours per day for 3+ days)
-        very_high_days = sum(1 for day in heatmap_data if day.get("totalMinutes", 0) >= 240)
-        if very_high_days >= 3:
-            burnout_signals.append("excessive_daily_hours")
-            severity += 1
+        }, {"_id": 0, "status": 1}).to_list(100)
+        
+        insight_data = burnout_stats(
+            rollups,
+            [day.get("totalMinutes", 0) for day in heatmap_data],
+            [t.get("status") for t in tasks]
+        )
+        
+        burnout_signals = insight_data["signals"]
+        severity = insight_data["severity"]
+        high_intensity_days = insight_data["high_intensity_days"]
+        late_night_sessions = insight_data["late_night_sessions"]
         
         if not burnout_signals:
             return None
         
         # Generate AI-powered burnout message
-        insight_data = {
-            "signals": burnout_signals,
-            "severity": severity,
-            "high_intensity_days": high_intensity_days,
-            "late_night_sessions": late_night_sessions
-        }
-        
-        description = await self.generate_ai_description(insight_data, "burnout_detection")
+        description = await self.generate_ai_description(insight_data, "burnout_detection", user_id)
         if description == self._generate_rule_based_description(insight_data, "burnout_detection"):
             # Custom rule-based burnout message
             if severity >= 5:
@@ -709,11 +754,19 @@ Provide encouraging, actionable advice that helps the user improve their product
     async def generate_smart_plan(self, user_id: str) -> Dict:
         """Generate smart daily plan based on historical data"""
         
-        # Get user's tasks
+        # Every open task; the planner scores them all
         tasks = await self.db.tasks.find({
             "userId": user_id,
             "status": {"$ne": "completed"}
-        }).sort("createdAt", 1).to_list(50)
+        }, PLAN_TASK_FIELDS).sort("createdAt", 1).to_list(PLAN_MAX_OPEN_TASKS)
+        for task in tasks:
+            task["id"] = str(task.pop("_id"))
+        
+        # How far off this user's estimates usually are, per task type
+        type_totals = await self.db.tasks.aggregate([
+            {"$match": {"userId": user_id, "status": "completed", "estimatedTime": {"$gt": 0}, "totalFocusedTime": {"$gt": 0}}},
+            {"$group": {"_id": "$type", "estimated": {"$sum": "$estimatedTime"}, "actual": {"$sum": "$totalFocusedTime"}}}
+        ]).to_list(None)
         
         # Get historical performance data
         end_date = datetime.utcnow()
@@ -722,50 +775,22 @@ Provide encouraging, actionable advice that helps the user improve their product
         heatmap_data = await self.db.heatmap_entries.find({
             "userId": user_id,
             "date": {"$gte": start_date.date().isoformat()}
-        }).to_list(100)
+        }, {"_id": 0, "totalMinutes": 1}).to_list(100)
         
-        sessions = await self.db.focus_sessions.find({
-            "userId": user_id,
-            "startTime": {"$gte": start_date.isoformat()}
-        }).to_list(500)
-        
-        # Find best performance time
-        best_hour = 10  # Default to 10 AM
-        if sessions:
-            hour_performance = {}
-            for session in sessions:
-                if session.get("startTime") and session.get("completed"):
-                    hour = datetime.fromisoformat(session["startTime"]).hour
-                    hour_performance[hour] = hour_performance.get(hour, 0) + 1
-            
-            if hour_performance:
-                best_hour = max(hour_performance.items(), key=lambda x: x[1])[0]
+        rollups = await get_rollups(self.db, user_id, start_date, end_date)
         
-        # Calculate average daily capacity
-        if heatmap_data:
-            total_minutes = sum(day.get("totalMinutes", 0) for day in heatmap_data)
-            avg_daily_capacity = total_minutes / len(heatmap_data)
-        else:
-            avg_daily_capacity = 120  # Default 2 hours
-        
-        # Select 2-3 tasks for today based on priority and estimated time
-        suggested_tasks = []
-        total_estimated_time = 0
-        
-        for task in tasks[:5]:  # Consider top 5 incomplete tasks
-            estimated_time = task.get("estimatedTime", 60)
-            if total_estimated_time + estimated_time <= avg_daily_capacity * 1.2:  # Allow 20% buffer
-                suggested_tasks.append({
-                    "id": task.get("id", str(task.get("_id", ""))),
-                    "title": task["title"],
-                    "type": task["type"],
-                    "estimatedTime": estimated_time,
-                    "techTags": task.get("techTags", [])
-                })
-                total_estimated_time += estimated_time
-            
-            if len(suggested_tasks) >= 3:
-                break
+        # Best performance time (most completed sessions) and average daily capacity
+        stats = plan_stats(rollups, [day.get("totalMinutes", 0) for day in heatmap_data])
+        best_hour = stats["best_hour"]
+        avg_daily_capacity = stats["capacity"]
+        
+        # Best-scoring set of up to 3 tasks that fits today's capacity (+20% buffer)
+        plan = await run_compute(
+            build_plan, tasks, avg_daily_capacity, end_date.date().isoformat(), type_totals,
+            size=len(tasks)
+        )
+        suggested_tasks = plan["tasks"]
+        total_estimated_time = plan["total_predicted_time"]
         
         # Generate suggestion for new task if list is short
         new_task_suggestion = None
@@ -786,12 +811,14 @@ Provide encouraging, actionable advice that helps the user improve their product
             "capacity": avg_daily_capacity
         }
         
-        description = await self.generate_ai_description(plan_data, "smart_daily_plan")
+        description = await self.generate_ai_description(plan_data, "smart_daily_plan", user_id)
         if description == self._generate_rule_based_description(plan_data, "smart_daily_plan"):
             description = f"Based on your patterns, tackle these tasks between {best_hour:02d}:00-{(best_hour+2):02d}:00 when you're most productive. Total estimated time: {total_estimated_time} minutes."
         
         return {
             "suggested_tasks": suggested_tasks,
+            "alternatives": plan["alternatives"],
+            "tasks_considered": plan["considered"],
             "new_task_suggestion": new_task_suggestion,
             "best_time_window": {
                 "start_hour": best_hour,
@@ -803,24 +830,53 @@ Provide encouraging, actionable advice that helps the user improve their product
             "description": description
         }
     
-    async def cache_insights(self, user_id: str):
-        """Calculate and cache all insights"""
+    async def invalidate(self, user_id: str, *sources: str):
+        """Mark the insight sections that read any of `sources` as dirty for this user"""
+        if HISTORY_SUMMARY_SOURCES.intersection(sources):
+            _history_summaries.pop(user_id, None)
+        
+        sections = [name for name, deps in SECTION_SOURCES.items() if deps.intersection(sources)]
+        if not sections:
+            return
+        # Counters rather than flags, so a refresh only clears what it actually saw
+        await self.db.insights_cache.update_one(
+            {"userId": user_id},
+            {"$inc": {f"dirty.{name}": 1 for name in sections}}
+        )
+    
+    def _dirty_sections(self, cached: Dict) -> List[str]:
+        dirty = cached.get("dirty") or {}
+        return [name for name in INSIGHT_SECTIONS if dirty.get(name)]
+    
+    def _is_expired(self, cached: Dict) -> bool:
+        expires_at = cached.get("expires_at")
+        return not expires_at or datetime.fromisoformat(expires_at) <= datetime.utcnow()
+    
+    async def _compute_section(self, user_id: str, section: str):
+        if section == "weekly":
+            return await self.calculate_weekly_insights(user_id)
+        if section == "monthly":
+            return await self.calculate_monthly_insights(user_id)
+        if section == "burnout":
+            return await self.detect_burnout(user_id)
+        return await self.generate_smart_plan(user_id)
+    
+    async def cache_insights(self, user_id: str, sections: Optional[List[str]] = None):
+        """Calculate and cache insights; only the given sections when `sections` is set"""
         
-        weekly_insights = await self.calculate_weekly_insights(user_id)
-        monthly_insights = await self.calculate_monthly_insights(user_id)
-        burnout_data = await self.detect_burnout(user_id)
-        smart_plan = await self.generate_smart_plan(user_id)
+        cached = await self.db.insights_cache.find_one({"userId": user_id}) or {}
+        dirty_seen = cached.get("dirty") or {}
+        if sections is None:
+            sections = list(INSIGHT_SECTIONS)
         
-        # Store in cache collection
-        cache_data = {
-            "userId": user_id,
-            "weekly_insights": weekly_insights,
-            "monthly_insights": monthly_insights,
-            "burnout_detection": burnout_data,
-            "smart_plan": smart_plan,
-            "generated_at": datetime.utcnow().isoformat(),
-            "expires_at": (datetime.utcnow() + timedelta(hours=6)).isoformat()  # Cache for 6 hours
-        }
+        cache_data = {"userId": user_id}
+        for section in sections:
+            cache_data[INSIGHT_SECTIONS[section]] = await self._compute_section(user_id, section)
+        
+        # Only a full recompute restarts the age clock
+        if len(sections) == len(INSIGHT_SECTIONS) or not cached.get("expires_at"):
+            cache_data["expires_at"] = (datetime.utcnow() + timedelta(hours=INSIGHTS_CACHE_TTL_HOURS)).isoformat()
+        cache_data["generated_at"] = datetime.utcnow().isoformat()
         
         # Upsert cache
         await self.db.insights_cache.update_one(
@@ -829,51 +885,176 @@ Provide encouraging, actionable advice that helps the user improve their product
             upsert=True
         )
         
-        return cache_data
+        # Clear dirty marks we consumed, unless new activity arrived while computing
+        for section in sections:
+            if dirty_seen.get(section):
+                await self.db.insights_cache.update_one(
+                    {"userId": user_id, f"dirty.{section}": dirty_seen[section]},
+                    {"$unset": {f"dirty.{section}": ""}}
+                )
+        
+        cached.pop("dirty", None)
+        cached.update(cache_data)
+        return cached
     
     async def get_cached_insights(self, user_id: str, force_refresh: bool = False):
-        """Get cached insights or regenerate if expired"""
+        """Get cached insights, serving stale entries while dirty sections refresh in the background"""
         
         if not force_refresh:
             cached = await self.db.insights_cache.find_one({"userId": user_id})
             
-            if cached and cached.get("expires_at"):
-                expires_at = datetime.fromisoformat(cached["expires_at"])
-                if expires_at > datetime.utcnow():
-                    return cached
+            if cached and cached.get("generated_at"):
+                if self._dirty_sections(cached) or self._is_expired(cached):
+                    # Stale-while-revalidate: answer now, recompute once in the background
+                    cached["refresh_job"] = await self.start_refresh(user_id)
+                return cached
         
-        # Cache expired or force refresh
+        # Nothing cached yet (or force refresh): compute inline
         return await self.cache_insights(user_id)
     
+    async def start_refresh(self, user_id: str, full: bool = False) -> Dict:
+        """Start a background insights refresh for the user, or join the one already running.
+
+        Refreshes are single-flight per user: within this process via _refresh_jobs, and across
+        workers via a lease document in the `leases` collection. Unless `full` is set, only
+        dirty sections are recomputed. A running partial refresh can't stand in for a full one,
+        so a full request behind it gets its own job that starts once the partial one is done.
+        """
+        running = _refresh_jobs.get(user_id)
+        if running and (running[2] or not full):
+            return {"jobId": running[0], "status": "running"}
+        
+        job_id = uuid.uuid4().hex
+        lease_key = f"insights:{user_id}"
+        owner = f"{WORKER_ID}:{job_id}"
+        leased = False
+        if not running:
+            leased = await acquire_lease(self.db, lease_key, INSIGHTS_REFRESH_LEASE_SECONDS,
+                                         owner=owner, jobId=job_id, full=full)
+            if not leased:
+                lease = await get_lease(self.db, lease_key)
+                if lease and (lease.get("full") or not full):
+                    return {"jobId": lease.get("jobId"), "status": "running"}
+        
+        now = datetime.utcnow()
+        try:
+            await self.db.insights_jobs.insert_one({
+                "_id": job_id,
+                "userId": user_id,
+                "status": "running",
+                "full": full,
+                "createdAt": now.isoformat(),
+                "expiresAt": now + timedelta(days=1)
+            })
+        except Exception:
+            if leased:
+                await release_lease(self.db, lease_key, owner)
+            raise
+        
+        # Without the lease, the job waits for whatever holds it (the local job, if any, first)
+        previous = None if leased else _refresh_jobs.get(user_id)
+        task = asyncio.create_task(self._run_refresh(
+            user_id, job_id, lease_key, owner, full, leased, previous[1] if previous else None
+        ))
+        _refresh_jobs[user_id] = (job_id, task, full)
+        return {"jobId": job_id, "status": "running"}
+    
+    async def refresh_and_wait(self, user_id: str, full: bool = False) -> Dict:
+        """Start (or join) a refresh and wait for it if it runs in this process"""
+        job = await self.start_refresh(user_id, full)
+        running = _refresh_jobs.get(user_id)
+        if running and running[0] == job["jobId"]:
+            # Shielded so a cancelled caller doesn't abort a refresh other requests may be waiting on
+            await asyncio.shield(running[1])
+            return await self.get_refresh_job(user_id, job["jobId"]) or job
+        return job
+    
+    async def needs_refresh(self, user_id: str) -> bool:
+        cached = await self.db.insights_cache.find_one({"userId": user_id}, {"dirty": 1, "expires_at": 1})
+        return not cached or self._is_expired(cached) or bool(self._dirty_sections(cached))
+    
+    async def _run_refresh(self, user_id: str, job_id: str, lease_key: str, owner: str, full: bool = False,
+                           leased: bool = True, previous: Optional[asyncio.Task] = None):
+        status, error = "done", None
+        try:
+            if previous:
+                await asyncio.wait([previous])
+            while not leased:
+                leased = await acquire_lease(self.db, lease_key, INSIGHTS_REFRESH_LEASE_SECONDS,
+                                             owner=owner, jobId=job_id, full=full)
+                if not leased:
+                    await asyncio.sleep(INSIGHTS_REFRESH_WAIT_SECONDS)
+            cached = await self.db.insights_cache.find_one({"userId": user_id})
+            if full or not cached or self._is_expired(cached):
+                await self.cache_insights(user_id)
+            else:
+                sections = self._dirty_sections(cached)
+                if sections:
+                    await self.cache_insights(user_id, sections)
+        except Exception as e:
+            print(f"Insights refresh failed for {user_id}: {e}")
+            status, error = "failed", str(e)
+        finally:
+            if _refresh_jobs.get(user_id, (None,))[0] == job_id:
+                _refresh_jobs.pop(user_id)
+            try:
+                await self.db.insights_jobs.update_one(
+                    {"_id": job_id},
+                    {"$set": {"status": status, "error": error, "finishedAt": datetime.utcnow().isoformat()}}
+                )
+                await release_lease(self.db, lease_key, owner)
+            except Exception as e:
+                print(f"Insights refresh cleanup failed for {user_id}: {e}")
+            # Lets an open Insights page reload without polling the job
+            await notify_user(user_id, "insights_ready", jobId=job_id, status=status)
+    
+    async def get_refresh_job(self, user_id: str, job_id: str) -> Optional[Dict]:
+        job = await self.db.insights_jobs.find_one({"_id": job_id, "userId": user_id})
+        if not job:
+            return None
+        return {
+            "jobId": job["_id"],
+            "status": job.get("status"),
+            "error": job.get("error"),
+            "createdAt": job.get("createdAt"),
+            "finishedAt": job.get("finishedAt")
+        }
+    
     async def _get_user_history_summary(self, user_id: str) -> str:
+        """Privacy-focused summary of the user's history, memoized until their next activity"""
+        
+        cached = _history_summaries.get(user_id)
+        if cached and cached[0] > time.monotonic():
+            return cached[1]
+        
+        summary = await self._build_user_history_summary(user_id)
+        
+        if len(_history_summaries) >= HISTORY_SUMMARY_MAX_ENTRIES:
+            # Dicts keep insertion order, so this drops the oldest entry
+            _history_summaries.pop(next(iter(_history_summaries)))
+        _history_summaries[user_id] = (time.monotonic() + HISTORY_SUMMARY_TTL_SECONDS, summary)
+        return summary
+    
+    async def _build_user_history_summary(self, user_id: str) -> str:
         """Create privacy-focused summary of user's history for AI context"""
         
         end_date = datetime.utcnow()
         start_date = end_date - timedelta(days=7)
         
         # Get aggregated data (no sensitive details)
-        tasks = await self.db.tasks.find({"userId": user_id}).to_list(100)
-        sessions = await self.db.focus_sessions.find({
-            "userId": user_id,
-            "startTime": {"$gte": start_date.isoformat()}
-        }).to_list(500)
+        tasks = await self.db.tasks.find({"userId": user_id}, {"_id": 0, "type": 1, "status": 1}).to_list(100)
+        rollups = await get_rollups(self.db, user_id, start_date, end_date)
+        stats = history_stats(rollups)
         
         # Calculate summary stats
         total_tasks = len(tasks)
         completed_tasks = len([t for t in tasks if t.get("status") == "completed"])
         completion_rate = (completed_tasks / total_tasks * 100) if total_tasks > 0 else 0
         
-        total_focus_minutes = sum(s.get("duration", 0) for s in sessions)
-        avg_session_duration = (total_focus_minutes / len(sessions)) if sessions else 0
-        
-        # Find most productive time
-        hour_dist = {}
-        for session in sessions:
-            if session.get("startTime"):
-                hour = datetime.fromisoformat(session["startTime"]).hour
-                hour_dist[hour] = hour_dist.get(hour, 0) + 1
-        
-        best_hour = max(hour_dist.items(), key=lambda x: x[1])[0] if hour_dist else 10
+        total_focus_minutes = stats["total_focus_minutes"]
+        avg_session_duration = stats["avg_session_duration"]
+        best_hour = stats["best_hour"]
+        active_days = stats["active_days"]
         
         # Task type distribution
         task_types = {}
@@ -886,20 +1067,15 @@ Provide encouraging, actionable advice that helps the user improve their product
         # Create summary
         summary = f"""User Productivity Summary (Last 7 Days):
 - Total tasks: {total_tasks}, Completed: {completed_tasks} ({completion_rate:.0f}% completion rate)
-- Total focus time: {total_focus_minutes} minutes across {len(sessions)} sessions
+- Total focus time: {total_focus_minutes} minutes across {stats['sessions']} sessions
 - Average session duration: {avg_session_duration:.0f} minutes
 - Most productive hour: {best_hour}:00
 - Dominant task type: {dominant_type}
-- Active days this week: {len(set(datetime.fromisoformat(s['startTime']).date() for s in sessions if s.get('startTime')))}"""
+- Active days this week: {active_days}"""
         
         return summary
     
-    async def chat_with_context(self, user_id: str, message: str) -> str:
-        """Chat with AI using user's history as context"""
-        
-        if not USE_AI_INSIGHTS:
-            return "AI insights are currently disabled. Enable them in your environment configuration to chat with the AI coach."
-        
+    async def _chat_prompt(self, user_id: str, message: str) -> tuple:
         # Get user history summary (privacy-focused)
         history_summary = await self._get_user_history_summary(user_id)
         
@@ -913,50 +1089,61 @@ User Question: {message}
 
 Provide a helpful, encouraging response based on their productivity patterns."""
         
-        # Use the general AI description method which handles model selection
-        model_configs = self._get_ai_model_configs()
+        return system_message, prompt
+    
+    async def chat_with_context(self, user_id: str, message: str) -> str:
+        """Chat with AI using user's history as context"""
         
-        # Prioritize Groq
-        groq_config = None
-        other_configs = []
-        for config in model_configs:
-            if config.get("provider", "").lower() == "groq":
-                groq_config = config
-            else:
-                other_configs.append(config)
-        
-        ordered_configs = []
-        if groq_config:
-            ordered_configs.append(groq_config)
-        ordered_configs.extend(other_configs)
-        
-        # Try each configured model
-        for idx, config in enumerate(ordered_configs, start=1):
-            is_used = config.get("isUsed")
-            if is_used is None:
-                is_used = config.get("is_used", True)
-            if str(is_used).lower() != "true":
-                continue
-
-            provider = config.get("provider") or ""
-            model = config.get("model") or ""
-            api_key = self._resolve_api_key(provider, config)
-            if not provider or not model or not api_key:
-                continue
-
-            try:
-                response = await self._call_llm_provider(provider, api_key, model, system_message, prompt)
-                if response and len(response.strip()) > 20:
-                    return response.strip()
-            except Exception as e:
-                print(f"Chat AI provider attempt {idx} failed ({provider}/{model}): {e}")
+        if not USE_AI_INSIGHTS:
+            return CHAT_DISABLED_MESSAGE
+        
+        if not await self._within_budget(user_id):
+            return CHAT_BUDGET_MESSAGE
+        
+        system_message, prompt = await self._chat_prompt(user_id, message)
+        
+        response = await self._complete(
+            user_id,
+            "chat",
+            system_message,
+            prompt,
+            accept=lambda r: len(r.strip()) > 20,
+            label="Chat AI",
+        )
+        if response:
+            return response
         
-        return "I'm having trouble connecting to the AI service. Please try again later."
+        return CHAT_UNAVAILABLE_MESSAGE
+    
+    async def stream_chat_with_context(self, user_id: str, message: str) -> AsyncIterator[str]:
+        """Like chat_with_context, but yields the reply as the provider produces it"""
+        
+        if not USE_AI_INSIGHTS:
+            yield CHAT_DISABLED_MESSAGE
+            return
+        
+        if not await self._within_budget(user_id):
+            yield CHAT_BUDGET_MESSAGE
+            return
+        
+        system_message, prompt = await self._chat_prompt(user_id, message)
+        
+        trace: Dict = {"usage": {}}
+        stream_call = lambda *args, **kwargs: self._stream_llm_provider(*args, usage=trace["usage"], **kwargs)
+        reply = []
+        async for text in get_provider_registry().stream(stream_call, system_message, prompt, label="Chat AI", trace=trace):
+            reply.append(text)
+            yield text
+        
+        if not reply:
+            yield CHAT_UNAVAILABLE_MESSAGE
+            return
+        await self._record_usage(user_id, "chat", trace, system_message + prompt, "".join(reply))
     
     async def generate_daily_recommendations(self, user_id: str) -> List[Dict]:
         """Generate 5 daily recommendations: todos, tips, and motivation"""
         
-        # Check cache first (24 hour TTL)
+        # Usually precomputed overnight by recommendations_batch.py
         today = datetime.utcnow().date().isoformat()
         cached = await self.db.daily_recommendations.find_one({
             "userId": user_id,
@@ -971,6 +1158,13 @@ Provide a helpful, encouraging response based on their productivity patterns."""
             # Fallback rule-based recommendations
             return self._get_fallback_recommendations()
         
+        recommendations = await self.generate_recommendations_for(user_id, today)
+        return recommendations or self._get_fallback_recommendations()
+    
+    async def generate_recommendations_for(self, user_id: str, date: str, limiter: Optional[ProviderRateLimiter] = None,
+                                           trace: Optional[Dict] = None) -> Optional[List[Dict]]:
+        """Ask the LLM for the user's recommendations for `date` and store them. None if every provider failed."""
+        
         history_summary = await self._get_user_history_summary(user_id)
         
         system_message = """You are a productivity coach. Generate exactly 5 UNIQUE, DIFFERENT recommendations for today.
@@ -988,93 +1182,83 @@ Generate 5 DIFFERENT, UNIQUE recommendations for today:
 
 Format each as a single clear sentence. Ensure all 5 are unique and different."""
         
-        # Use configured AI models
-        model_configs = self._get_ai_model_configs()
-        if not model_configs:
-            return self._get_fallback_recommendations()
+        response = await self._complete(
+            user_id,
+            "recommendations",
+            system_message,
+            prompt,
+            label="Daily recommendations AI",
+            limiter=limiter,
+            trace=trace,
+        )
+        if not response:
+            return None
         
-        # Try each configured model
-        for idx, config in enumerate(model_configs, start=1):
-            is_used = config.get("isUsed")
-            if is_used is None:
-                is_used = config.get("is_used", True)
-            if str(is_used).lower() != "true":
-                continue
-
-            provider = config.get("provider") or ""
-            model = config.get("model") or ""
-            api_key = self._resolve_api_key(provider, config)
-            if not provider or not model or not api_key:
-                continue
+        recommendations = self._parse_recommendations(response)
+        
+        # Kept for the day plus RECOMMENDATIONS_RETENTION_DAYS, then removed by the TTL index
+        expires_at = datetime.fromisoformat(date) + timedelta(days=1 + RECOMMENDATIONS_RETENTION_DAYS)
+        await self.db.daily_recommendations.update_one(
+            {"userId": user_id, "date": date},
+            {"$set": {
+                "userId": user_id,
+                "date": date,
+                "recommendations": recommendations,
+                "generated_at": datetime.utcnow().isoformat(),
+                "expiresAt": expires_at
+            }},
+            upsert=True
+        )
         
-            try:
-                response = await self._call_llm_provider(provider, api_key, model, system_message, prompt)
-                
-                # Parse response into structured recommendations
-                recommendations = []
-                lines = [line.strip() for line in response.split('\n') if line.strip()]
-                
-                # Deduplicate recommendations
-                seen_texts = set()
-                for idx_rec, line in enumerate(lines, 1):
-                    # Remove numbering if present
-                    clean_line = line.lstrip('0123456789.-) ')
-                    
-                    # Skip if duplicate
-                    if clean_line.lower() in seen_texts:
-                        continue
-                    
-                    seen_texts.add(clean_line.lower())
-                    
-                    # Assign type based on position
-                    if len(recommendations) < 2:
-                        rec_type = "todo"
-                        icon = "target"
-                    elif len(recommendations) < 4:
-                        rec_type = "tip"
-                        icon = "lightbulb"
-                    else:
-                        rec_type = "motivation"
-                        icon = "zap"
-                    
-                    recommendations.append({
-                        "type": rec_type,
-                        "text": clean_line,
-                        "icon": icon
-                    })
-                    
-                    # Stop once we have 5 unique recommendations
-                    if len(recommendations) >= 5:
-                        break
-                
-                # Ensure we have exactly 5
-                while len(recommendations) < 5:
-                    recommendations.append({
-                        "type": "tip",
-                        "text": "Stay focused and take regular breaks!",
-                        "icon": "lightbulb"
-                    })
-                
-                # Cache for 24 hours
-                await self.db.daily_recommendations.update_one(
-                    {"userId": user_id, "date": today},
-                    {"$set": {
-                        "userId": user_id,
-                        "date": today,
-                        "recommendations": recommendations,
-                        "generated_at": datetime.utcnow().isoformat()
-                    }},
-                    upsert=True
-                )
-                
-                return recommendations[:5]
-                
-            except Exception as e:
-                print(f"Daily recommendations AI provider attempt {idx} failed ({provider}/{model}): {e}")
+        return recommendations
+    
+    def _parse_recommendations(self, response: str) -> List[Dict]:
+        """Parse an LLM response into exactly 5 structured recommendations"""
+        recommendations = []
+        lines = [line.strip() for line in response.split('\n') if line.strip()]
+        
+        # Deduplicate recommendations
+        seen_texts = set()
+        for line in lines:
+            # Remove numbering if present
+            clean_line = line.lstrip('0123456789.-) ')
+            
+            # Skip if duplicate
+            if clean_line.lower() in seen_texts:
                 continue
+            
+            seen_texts.add(clean_line.lower())
+            
+            # Assign type based on position
+            if len(recommendations) < 2:
+                rec_type = "todo"
+                icon = "target"
+            elif len(recommendations) < 4:
+                rec_type = "tip"
+                icon = "lightbulb"
+            else:
+                rec_type = "motivation"
+                icon = "zap"
+            
+            recommendations.append({
+                "type": rec_type,
+                "text": clean_line,
+                "icon": icon
+            })
+            
+            # Stop once we have 5 unique recommendations
+            if len(recommendations) >= 5:
+                break
+        
+        # Ensure we have exactly 5
+        while len(recommendations) < 5:
+            recommendations.append({
+                "type": "tip",
+                "text": "Stay focused and take regular breaks!",
+                "icon": "lightbulb"
+            })
         
-        # All providers failed, return fallback
-        return self._get_fallback_recommendations()
+        return recommendations[:5]
     
     def _get_fallback_recommendations(self) -> List[Dict]:
         """Fallback recommendations when AI is unavailable"""
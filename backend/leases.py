@@ -0,0 +1,42 @@
+import os
+import socket
+from datetime import datetime, timedelta
+from typing import Optional
+from pymongo.errors import DuplicateKeyError
+
+# Identifies this process when several gunicorn/uvicorn workers share the database
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+
+async def acquire_lease(db, key: str, ttl_seconds: float, owner: str = WORKER_ID, **fields) -> bool:
+    """Try to take the named lease. Returns False if another owner holds an unexpired lease.
+
+    The lease document is upserted only when it is missing, expired, or already ours; when
+    someone else holds it the upsert collides on _id and we back off.
+    """
+    now = datetime.utcnow()
+    try:
+        await db.leases.update_one(
+            {"_id": key, "$or": [{"expiresAt": {"$lte": now}}, {"owner": owner}]},
+            {"$set": {
+                "owner": owner,
+                "acquiredAt": now,
+                "expiresAt": now + timedelta(seconds=ttl_seconds),
+                **fields
+            }},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+
+async def release_lease(db, key: str, owner: str = WORKER_ID):
+    await db.leases.delete_one({"_id": key, "owner": owner})
+
+
+async def get_lease(db, key: str) -> Optional[dict]:
+    lease = await db.leases.find_one({"_id": key})
+    if lease and lease.get("expiresAt") and lease["expiresAt"] > datetime.utcnow():
+        return lease
+    return None
@@ -0,0 +1,82 @@
+import os
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+from dotenv import load_dotenv
+
+from ai_providers import estimate_cost
+
+load_dotenv()
+
+# LLM usage accounting. llm_usage holds one document per user, day, provider/model and
+# endpoint, updated with a single $inc per call:
+# { _id, userId, date, provider, model, endpoint, requests, inputTokens, outputTokens,
+#   estimatedTokens, costUsd, expiresAt }
+# estimatedTokens counts tokens that were guessed from text length because the provider
+# didn't report usage.
+
+# Per-user daily budgets; 0 disables the check. Over budget, AI text falls back to rule-based.
+LLM_USER_DAILY_TOKEN_BUDGET = int(os.environ.get('LLM_USER_DAILY_TOKEN_BUDGET', '60000'))
+LLM_USER_DAILY_REQUEST_BUDGET = int(os.environ.get('LLM_USER_DAILY_REQUEST_BUDGET', '150'))
+LLM_USAGE_RETENTION_DAYS = int(os.environ.get('LLM_USAGE_RETENTION_DAYS', '90'))
+
+metrics: Dict = {"recorded": 0, "estimated": 0, "over_budget": 0}
+
+
+async def record_usage(db, user_id: str, endpoint: str, provider: str, model: str,
+                       input_tokens: int, output_tokens: int, estimated: bool = False):
+    today = datetime.utcnow().date()
+    cost = estimate_cost(model, input_tokens, output_tokens) or 0.0
+    await db.llm_usage.update_one(
+        {"_id": f"{user_id}:{today.isoformat()}:{provider}/{model}:{endpoint}"},
+        {
+            "$inc": {
+                "requests": 1,
+                "inputTokens": input_tokens,
+                "outputTokens": output_tokens,
+                "estimatedTokens": input_tokens + output_tokens if estimated else 0,
+                "costUsd": cost,
+            },
+            "$setOnInsert": {
+                "userId": user_id,
+                "date": today.isoformat(),
+                "provider": provider,
+                "model": model,
+                "endpoint": endpoint,
+                "expiresAt": datetime.combine(today, datetime.min.time()) + timedelta(days=LLM_USAGE_RETENTION_DAYS),
+            }
+        },
+        upsert=True
+    )
+    metrics["recorded"] += 1
+    if estimated:
+        metrics["estimated"] += 1
+
+
+async def get_user_usage(db, user_id: str, date: Optional[str] = None) -> Dict:
+    """A user's totals for one day (today by default), overall and per endpoint"""
+    date = date or datetime.utcnow().date().isoformat()
+    totals = {"requests": 0, "tokens": 0, "costUsd": 0.0, "endpoints": {}}
+    async for doc in db.llm_usage.find({"userId": user_id, "date": date}):
+        tokens = doc.get("inputTokens", 0) + doc.get("outputTokens", 0)
+        totals["requests"] += doc.get("requests", 0)
+        totals["tokens"] += tokens
+        totals["costUsd"] += doc.get("costUsd", 0.0)
+        endpoint = totals["endpoints"].setdefault(doc["endpoint"], {"requests": 0, "tokens": 0})
+        endpoint["requests"] += doc.get("requests", 0)
+        endpoint["tokens"] += tokens
+    totals["costUsd"] = round(totals["costUsd"], 6)
+    totals["budget"] = {"requests": LLM_USER_DAILY_REQUEST_BUDGET, "tokens": LLM_USER_DAILY_TOKEN_BUDGET}
+    return totals
+
+
+async def within_budget(db, user_id: str) -> bool:
+    if not LLM_USER_DAILY_TOKEN_BUDGET and not LLM_USER_DAILY_REQUEST_BUDGET:
+        return True
+    usage = await get_user_usage(db, user_id)
+    over = (
+        (LLM_USER_DAILY_TOKEN_BUDGET and usage["tokens"] >= LLM_USER_DAILY_TOKEN_BUDGET)
+        or (LLM_USER_DAILY_REQUEST_BUDGET and usage["requests"] >= LLM_USER_DAILY_REQUEST_BUDGET)
+    )
+    if over:
+        metrics["over_budget"] += 1
+    return not over
@@ -0,0 +1,299 @@
+import os
+import json
+import time
+import uuid
+import math
+import random
+import asyncio
+from typing import Dict, Optional
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from dotenv import load_dotenv
+
+from ai_providers import estimate_tokens
+
+load_dotenv()
+
+# Mock LLM provider for offline load and latency testing. Speaks the OpenAI, Groq,
+# Anthropic and Gemini wire formats InsightsService uses, streaming included, with
+# configurable latency, errors and timeouts.
+#
+# Run: python mock_llm_server.py [--port 8099]
+# Then give each model config in AI_MODELS a "baseUrl" (any apiKey works):
+#   openai     http://localhost:8099/v1
+#   groq       http://localhost:8099/openai/v1
+#   anthropic  http://localhost:8099/v1
+#   gemini     http://localhost:8099/v1beta
+#
+# Behaviour can be changed while running: POST /mock/config {"provider": "groq", "error_rate": 1}
+# (no provider = defaults for all). GET /mock/stats for counters; POST /mock/reset clears them
+# and the per-provider overrides.
+
+# Latency before the response (or first streamed chunk):
+# "fixed:MS", "uniform:MIN_MS:MAX_MS" or "lognormal:MEDIAN_MS:SIGMA"
+MOCK_LLM_LATENCY = os.environ.get('MOCK_LLM_LATENCY', 'lognormal:600:0.5')
+MOCK_LLM_ERROR_RATE = float(os.environ.get('MOCK_LLM_ERROR_RATE', '0'))
+MOCK_LLM_ERROR_STATUS = int(os.environ.get('MOCK_LLM_ERROR_STATUS', '500'))
+# Requests that hang for MOCK_LLM_TIMEOUT_SECONDS (past the service's 30s client timeout)
+MOCK_LLM_TIMEOUT_RATE = float(os.environ.get('MOCK_LLM_TIMEOUT_RATE', '0'))
+MOCK_LLM_TIMEOUT_SECONDS = float(os.environ.get('MOCK_LLM_TIMEOUT_SECONDS', '45'))
+MOCK_LLM_STREAM_CHUNK_MS = float(os.environ.get('MOCK_LLM_STREAM_CHUNK_MS', '30'))
+# Streams that drop the connection after the first chunk
+MOCK_LLM_STREAM_ERROR_RATE = float(os.environ.get('MOCK_LLM_STREAM_ERROR_RATE', '0'))
+# Per-provider overrides, e.g. '{"groq": {"latency": "fixed:2000", "error_rate": 0.2}}'
+MOCK_LLM_PROVIDERS = os.environ.get('MOCK_LLM_PROVIDERS', '')
+
+PROVIDERS = ("openai", "groq", "anthropic", "gemini")
+
+REPLY = (
+    "1. Start with your highest-priority coding task in the morning block\n"
+    "2. Break the debugging task into two shorter focus sessions\n"
+    "3. Take a 5 minute break after every session to stay fresh\n"
+    "4. Batch small planning tasks together before lunch\n"
+    "5. You've been consistent this week, keep the streak going!"
+)
+
+defaults: Dict = {
+    "latency": MOCK_LLM_LATENCY,
+    "error_rate": MOCK_LLM_ERROR_RATE,
+    "error_status": MOCK_LLM_ERROR_STATUS,
+    "timeout_rate": MOCK_LLM_TIMEOUT_RATE,
+    "timeout_seconds": MOCK_LLM_TIMEOUT_SECONDS,
+    "stream_chunk_ms": MOCK_LLM_STREAM_CHUNK_MS,
+    "stream_error_rate": MOCK_LLM_STREAM_ERROR_RATE,
+}
+overrides: Dict[str, Dict] = {}
+try:
+    overrides.update(json.loads(MOCK_LLM_PROVIDERS or "{}"))
+except Exception as e:
+    print(f"MOCK_LLM_PROVIDERS parse failed: {e}")
+
+
+def _new_stats() -> Dict:
+    return {"requests": 0, "streams": 0, "errors": 0, "timeouts": 0, "in_flight": 0, "max_in_flight": 0}
+
+
+stats: Dict[str, Dict] = {provider: _new_stats() for provider in PROVIDERS}
+
+
+def settings(provider: str) -> Dict:
+    return {**defaults, **overrides.get(provider, {})}
+
+
+def sample_latency(spec: str) -> float:
+    """Seconds to wait for one request, drawn from a latency spec"""
+    kind, *args = spec.split(":")
+    values = [float(a) / 1000 for a in args]
+    if kind == "fixed":
+        return values[0]
+    if kind == "uniform":
+        return random.uniform(values[0], values[1])
+    if kind == "lognormal":
+        # args are the median (ms) and sigma, which is unitless
+        return random.lognormvariate(math.log(values[0]), float(args[1]))
+    raise ValueError(f"Unknown latency spec: {spec}")
+
+
+def _error_body(provider: str, status: int) -> Dict:
+    message = "Rate limit exceeded" if status == 429 else "Mock provider error"
+    if provider == "anthropic":
+        return {"type": "error", "error": {"type": "rate_limit_error" if status == 429 else "api_error", "message": message}}
+    if provider == "gemini":
+        return {"error": {"code": status, "message": message, "status": "RESOURCE_EXHAUSTED" if status == 429 else "INTERNAL"}}
+    return {"error": {"message": message, "type": "rate_limit_exceeded" if status == 429 else "server_error"}}
+
+
+def _prompt_text(provider: str, body: Dict) -> str:
+    if provider == "gemini":
+        parts = [p for item in body.get("contents", []) for p in item.get("parts", [])]
+        parts += (body.get("system_instruction") or {}).get("parts", [])
+        return "".join(p.get("text", "") for p in parts)
+    text = body.get("system", "") if provider == "anthropic" else ""
+    return text + "".join(m.get("content", "") for m in body.get("messages", []) if isinstance(m.get("content"), str))
+
+
+def _chunks(text: str, words: int = 3):
+    tokens = text.split(" ")
+    for i in range(0, len(tokens), words):
+        yield " ".join(tokens[i:i + words]) + (" " if i + words < len(tokens) else "")
+
+
+def _sse(data: Dict, event: Optional[str] = None) -> str:
+    return (f"event: {event}\n" if event else "") + f"data: {json.dumps(data)}\n\n"
+
+
+def _completion(provider: str, model: str, input_tokens: int, output_tokens: int) -> Dict:
+    if provider == "anthropic":
+        return {
+            "id": f"msg_{uuid.uuid4().hex[:24]}",
+            "type": "message",
+            "role": "assistant",
+            "model": model,
+            "content": [{"type": "text", "text": REPLY}],
+            "stop_reason": "end_turn",
+            "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens},
+        }
+    if provider == "gemini":
+        return {
+            "candidates": [{"content": {"role": "model", "parts": [{"text": REPLY}]}, "finishReason": "STOP"}],
+            "usageMetadata": {"promptTokenCount": input_tokens, "candidatesTokenCount": output_tokens,
+                              "totalTokenCount": input_tokens + output_tokens},
+        }
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": REPLY}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": input_tokens, "completion_tokens": output_tokens,
+                  "total_tokens": input_tokens + output_tokens},
+    }
+
+
+async def _stream_events(provider: str, model: str, body: Dict, input_tokens: int, output_tokens: int, config: Dict):
+    chunk_delay = config["stream_chunk_ms"] / 1000
+    fail_after_first = random.random() < config["stream_error_rate"]
+    usage = {"prompt_tokens": input_tokens, "completion_tokens": output_tokens, "total_tokens": input_tokens + output_tokens}
+    message_id = uuid.uuid4().hex[:24]
+
+    if provider == "anthropic":
+        yield _sse({"type": "message_start", "message": {"id": f"msg_{message_id}", "type": "message", "role": "assistant",
+                    "model": model, "content": [], "usage": {"input_tokens": input_tokens, "output_tokens": 1}}}, "message_start")
+        yield _sse({"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}}, "content_block_start")
+
+    for i, text in enumerate(_chunks(REPLY)):
+        if i:
+            await asyncio.sleep(chunk_delay)
+            if fail_after_first:
+                raise RuntimeError("Mock stream dropped")
+        if provider == "anthropic":
+            yield _sse({"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": text}}, "content_block_delta")
+        elif provider == "gemini":
+            yield _sse({"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}}],
+                        "usageMetadata": {"promptTokenCount": input_tokens, "candidatesTokenCount": estimate_tokens(text)}})
+        else:
+            yield _sse({"id": f"chatcmpl-{message_id}", "object": "chat.completion.chunk", "model": model,
+                        "choices": [{"index": 0, "delta": {"content": text}, "finish_reason": None}]})
+
+    if provider == "anthropic":
+        yield _sse({"type": "content_block_stop", "index": 0}, "content_block_stop")
+        yield _sse({"type": "message_delta", "delta": {"stop_reason": "end_turn"}, "usage": {"output_tokens": output_tokens}}, "message_delta")
+        yield _sse({"type": "message_stop"}, "message_stop")
+    elif provider == "gemini":
+        yield _sse({"candidates": [{"content": {"role": "model", "parts": [{"text": ""}]}, "finishReason": "STOP"}],
+                    "usageMetadata": {"promptTokenCount": input_tokens, "candidatesTokenCount": output_tokens,
+                                      "totalTokenCount": input_tokens + output_tokens}})
+    else:
+        last = {"id": f"chatcmpl-{message_id}", "object": "chat.completion.chunk", "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+        if provider == "groq":
+            last["x_groq"] = {"id": message_id, "usage": usage}
+        yield _sse(last)
+        if (body.get("stream_options") or {}).get("include_usage"):
+            yield _sse({"id": f"chatcmpl-{message_id}", "object": "chat.completion.chunk", "model": model, "choices": [], "usage": usage})
+        yield "data: [DONE]\n\n"
+
+
+async def respond(provider: str, model: str, body: Dict, stream: bool):
+    config = settings(provider)
+    counters = stats[provider]
+    counters["requests"] += 1
+    counters["streams"] += int(stream)
+    counters["in_flight"] += 1
+    counters["max_in_flight"] = max(counters["max_in_flight"], counters["in_flight"])
+    try:
+        roll = random.random()
+        if roll < config["timeout_rate"]:
+            counters["timeouts"] += 1
+            await asyncio.sleep(config["timeout_seconds"])
+            return JSONResponse(_error_body(provider, 504), status_code=504)
+
+        await asyncio.sleep(sample_latency(config["latency"]))
+        if roll < config["timeout_rate"] + config["error_rate"]:
+            counters["errors"] += 1
+            status = config["error_status"]
+            headers = {"retry-after": "1"} if status == 429 else None
+            return JSONResponse(_error_body(provider, status), status_code=status, headers=headers)
+
+        input_tokens = estimate_tokens(_prompt_text(provider, body))
+        output_tokens = estimate_tokens(REPLY)
+        if not stream:
+            return JSONResponse(_completion(provider, model, input_tokens, output_tokens))
+        return StreamingResponse(_stream_events(provider, model, body, input_tokens, output_tokens, config),
+                                 media_type="text/event-stream")
+    finally:
+        counters["in_flight"] -= 1
+
+
+app = FastAPI(title="Mock LLM provider")
+
+
+@app.post("/v1/chat/completions")
+async def openai_chat(request: Request):
+    body = await request.json()
+    return await respond("openai", body.get("model", ""), body, bool(body.get("stream")))
+
+
+@app.post("/openai/v1/chat/completions")
+async def groq_chat(request: Request):
+    body = await request.json()
+    return await respond("groq", body.get("model", ""), body, bool(body.get("stream")))
+
+
+@app.post("/v1/messages")
+async def anthropic_messages(request: Request):
+    body = await request.json()
+    return await respond("anthropic", body.get("model", ""), body, bool(body.get("stream")))
+
+
+@app.post("/v1beta/models/{target}")
+async def gemini_generate(target: str, request: Request):
+    # target is "{model}:generateContent" or "{model}:streamGenerateContent"
+    model, _, method = target.partition(":")
+    if method not in ("generateContent", "streamGenerateContent"):
+        return JSONResponse(_error_body("gemini", 404), status_code=404)
+    return await respond("gemini", model, await request.json(), method == "streamGenerateContent")
+
+
+@app.get("/mock/config")
+async def get_config():
+    return {"defaults": defaults, "providers": {provider: settings(provider) for provider in PROVIDERS}}
+
+
+@app.post("/mock/config")
+async def update_config(request: Request):
+    changes = await request.json()
+    provider = changes.pop("provider", None)
+    unknown = set(changes) - set(defaults)
+    if unknown:
+        return JSONResponse({"detail": f"Unknown settings: {', '.join(sorted(unknown))}"}, status_code=400)
+    if "latency" in changes:
+        try:
+            sample_latency(changes["latency"])
+        except (ValueError, IndexError) as e:
+            return JSONResponse({"detail": f"Bad latency spec: {e}"}, status_code=400)
+    if provider:
+        overrides.setdefault(provider, {}).update(changes)
+    else:
+        defaults.update(changes)
+    return await get_config()
+
+
+@app.get("/mock/stats")
+async def get_stats():
+    return stats
+
+
+@app.post("/mock/reset")
+async def reset():
+    overrides.clear()
+    for provider in PROVIDERS:
+        stats[provider] = _new_stats()
+    return stats
+
+
+if __name__ == "__main__":
+    import sys
+    import uvicorn
+    port = int(sys.argv[sys.argv.index("--port") + 1]) if "--port" in sys.argv else 8099
+    uvicorn.run(app, host="127.0.0.1", port=port, log_level="warning")
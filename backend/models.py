@@ -1,4 +1,4 @@
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, EmailStr, Field, ConfigDict
 from typing import Optional, List, Dict
 from datetime import datetime
 from enum import Enum
@@ -143,6 +143,10 @@ class RoomMemberStatus(str, Enum):
     MEMBER = "member"
     ADMIN = "admin"
 
+class RoomMode(str, Enum):
+    STANDARD = "standard"
+    LARGE = "large" # study hall: members in their own collection, paged
+
 class RoomMember(BaseModel):
     userId: str
     name: str
@@ -168,6 +172,7 @@ class FocusRoomCreate(BaseModel):
     name: str
     password: str # New: Required for all rooms now for simplicity, or optional
     description: Optional[str] = None
+    mode: RoomMode = RoomMode.STANDARD
 
 class SharedTaskCreate(BaseModel):
     title: str
@@ -194,6 +199,46 @@ class FocusRoomResponse(BaseModel):
     timerStartTime: Optional[str] = None
     timerDuration: Optional[int] = None
     timerStatus: Optional[str] = "stopped" # running, paused, stopped
+    version: int = 0 # bumped by every change, see room_delta
+    # Large rooms send a page of members/requests plus counts instead of everything
+    mode: RoomMode = RoomMode.STANDARD
+    memberCount: int = 0
+    memberLimit: int = 5
+    pendingCount: int = 0
+    activeCount: Optional[int] = None
+    membersCursor: Optional[str] = None
+    myStatus: Optional[str] = None
+
+class RoomMembersPage(BaseModel):
+    members: List[RoomMember]
+    next: Optional[str] = None # pass back as ?after= for the next page
+    total: int
 
 class RoomSessionLog(BaseModel):
     duration: int
+
+# --- Room WebSocket frames (client -> server) ---
+
+class WSFrame(BaseModel):
+    # Frames we don't model are passed through to the room as-is
+    model_config = ConfigDict(extra="allow")
+    type: str = Field(min_length=1, max_length=64)
+
+class WSChatMessage(WSFrame):
+    id: str = Field(max_length=64)
+    # Filled in by the server from the socket's authenticated user
+    userId: Optional[str] = Field(default=None, max_length=64)
+    userName: Optional[str] = Field(default=None, max_length=100)
+    content: str = Field(min_length=1, max_length=2000)
+
+class WSTimerStart(WSFrame):
+    duration: int = Field(default=25, ge=1, le=240)
+
+WS_FRAME_MODELS = {
+    "chat_message": WSChatMessage,
+    "timer_start": WSTimerStart,
+}
+
+# Everything a client may send. The rest (room_delta, session, timer_update, presence, ...)
+# only ever comes from the server, so clients can't forge them for each other.
+WS_CLIENT_FRAME_TYPES = {"chat_message", "timer_start", "typing", "status", "pong"}
@@ -0,0 +1,24 @@
+import datetime
+from backplane import get_backplane
+
+# Per-user notifications: published on "user:<user id>" and handed to that user's
+# /api/ws/user sockets on whichever worker they're connected to (see rooms_router).
+# Numbered like room channels, so a reconnecting client can resume; a user with no socket
+# open just doesn't get them and picks up the state over REST next time.
+#
+# Types: join_request (to a room owner), member_approved, removed_from_room, new_follower,
+# insights_ready
+
+
+async def notify_user(user_id: str, kind: str, **fields):
+    """Send `kind` to the user's notification sockets; never raises, it's best effort"""
+    if not user_id:
+        return
+    try:
+        await get_backplane().publish_numbered(f"user:{user_id}", {
+            "type": kind,
+            **fields,
+            "timestamp": datetime.datetime.utcnow().isoformat(),
+        })
+    except Exception as e:
+        print(f"Notification {kind} for {user_id} failed: {e}")
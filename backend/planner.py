@@ -0,0 +1,204 @@
+from datetime import date
+from typing import List, Dict, Optional
+import numpy as np
+
+# Smart-plan optimizer. Scores every open task and picks the set that maximizes total
+# score within the day's capacity: a 0/1 knapsack with at most PLAN_MAX_TASKS items,
+# solved exactly by DP over (items picked, minutes used).
+#
+# Pure and picklable like insights_compute, so it can go through run_compute.
+
+PLAN_MAX_TASKS = 3
+PLAN_CAPACITY_BUFFER = 1.2  # Allow 20% over the average day
+PLAN_SLOT_MINUTES = 5  # DP resolution
+PLAN_MIN_TASK_MINUTES = 10
+PLAN_ALTERNATIVES = 5
+
+# Score weights
+DUE_WEIGHT = 3.0
+AGE_WEIGHT = 1.0
+PROGRESS_WEIGHT = 0.5
+AGE_HORIZON_DAYS = 30
+ESTIMATE_RATIO_BOUNDS = (0.5, 3.0)
+
+# Fields the planner reads from tasks
+PLAN_TASK_FIELDS = {
+    "title": 1, "type": 1, "estimatedTime": 1, "totalFocusedTime": 1, "techTags": 1,
+    "status": 1, "createdAt": 1, "scheduledDate": 1
+}
+
+
+REASONS = np.array(["backlog", "in_progress", "overdue", "scheduled_today", "scheduled_later"])
+
+
+def _to_days(values: List[Optional[str]]) -> np.ndarray:
+    """Day numbers for "2026-01-15" or full ISO timestamps, NaN where missing or invalid"""
+    try:
+        parsed = np.array([value[:10] if value else "NaT" for value in values], dtype="datetime64[D]")
+        days = parsed.astype(np.int64).astype(np.float64) + date(1970, 1, 1).toordinal()
+        days[np.isnat(parsed)] = np.nan
+        return days
+    except ValueError:
+        pass
+
+    # Something unparsable in there: go one value at a time
+    days = np.full(len(values), np.nan)
+    for i, value in enumerate(values):
+        if value:
+            try:
+                days[i] = date.fromisoformat(value[:10]).toordinal()
+            except ValueError:
+                pass
+    return days
+
+
+def estimate_ratios(type_totals: List[Dict]) -> Dict[str, float]:
+    """actual/estimated minutes per task type from completed tasks, clamped to sane bounds.
+
+    type_totals: [{"_id": type, "estimated": minutes, "actual": minutes}]
+    """
+    low, high = ESTIMATE_RATIO_BOUNDS
+    ratios = {}
+    for row in type_totals:
+        if row.get("estimated") and row.get("actual"):
+            ratios[row["_id"]] = min(max(row["actual"] / row["estimated"], low), high)
+    return ratios
+
+
+def score_tasks(tasks: List[Dict], today: date, ratios: Dict[str, float]) -> Dict[str, np.ndarray]:
+    """Priority score, predicted remaining minutes and main reason for every open task"""
+    n = len(tasks)
+    estimated = np.fromiter((t.get("estimatedTime") or 60 for t in tasks), dtype=np.float64, count=n)
+    focused = np.fromiter((t.get("totalFocusedTime") or 0 for t in tasks), dtype=np.float64, count=n)
+    ratio = np.fromiter((ratios.get(t.get("type"), 1.0) for t in tasks), dtype=np.float64, count=n)
+    in_progress = np.fromiter((t.get("status") == "in_progress" for t in tasks), dtype=bool, count=n)
+    scheduled = _to_days([t.get("scheduledDate") for t in tasks])
+    created = _to_days([t.get("createdAt") for t in tasks])
+    today_day = today.toordinal()
+
+    predicted = np.maximum(estimated * ratio - focused, PLAN_MIN_TASK_MINUTES)
+
+    # Unscheduled backlog 0.2, due today 1.0, overdue 1.0 plus a little per day late (up to 2.0),
+    # scheduled for later 0 and not eligible today
+    days_late = today_day - scheduled
+    with np.errstate(invalid="ignore"):
+        due = np.select(
+            [np.isnan(scheduled), days_late > 0, days_late == 0],
+            [0.2, 1.0 + np.minimum(days_late, 14) / 14, 1.0],
+            default=0.0
+        )
+        age_days = np.nan_to_num(np.maximum(today_day - created, 0))
+    age = np.minimum(np.log1p(age_days) / np.log1p(AGE_HORIZON_DAYS), 1.0)
+    progress = ((focused > 0) | in_progress).astype(np.float64)
+
+    with np.errstate(invalid="ignore"):
+        reason = np.select(
+            [np.isnan(scheduled) & (progress > 0), np.isnan(scheduled), days_late > 0, days_late == 0],
+            [1, 0, 2, 3],
+            default=4
+        )
+
+    return {
+        "score": np.round(DUE_WEIGHT * due + AGE_WEIGHT * age + PROGRESS_WEIGHT * progress, 4),
+        "predicted": np.round(predicted).astype(np.int64),
+        "reason": reason,
+        "eligible": reason != 4,
+    }
+
+
+def _knapsack(values: np.ndarray, costs: np.ndarray, capacity: int, max_items: int) -> List[int]:
+    """Indices maximizing sum(values) with sum(costs) <= capacity and at most max_items items"""
+    # best[k, c]: best value using exactly k items and at most c slots (-inf if impossible)
+    best = np.full((max_items + 1, capacity + 1), -np.inf)
+    best[0, :] = 0.0
+    taken = np.zeros((len(values), max_items + 1, capacity + 1), dtype=bool)
+
+    for i in range(len(values)):
+        cost, value = int(costs[i]), values[i]
+        if cost > capacity:
+            continue
+        candidate = best[:-1, :capacity + 1 - cost] + value
+        improved = candidate > best[1:, cost:]
+        best[1:, cost:] = np.where(improved, candidate, best[1:, cost:])
+        taken[i, 1:, cost:] = improved
+
+    k, c = np.unravel_index(np.argmax(best), best.shape)
+    chosen = []
+    for i in range(len(values) - 1, -1, -1):
+        if k == 0:
+            break
+        if taken[i, k, c]:
+            chosen.append(i)
+            c -= int(costs[i])
+            k -= 1
+    return chosen[::-1]
+
+
+def _prune(eligible: List[int], costs: np.ndarray, values: np.ndarray, max_items: int) -> List[int]:
+    # Among tasks with the same slot cost only the max_items best can be in an optimal
+    # plan, so the DP sees at most (capacity + 1) * max_items tasks however big the backlog
+    by_cost: Dict[int, List[int]] = {}
+    for i in sorted(eligible, key=lambda i: -values[i]):
+        bucket = by_cost.setdefault(int(costs[i]), [])
+        if len(bucket) < max_items:
+            bucket.append(i)
+    return sorted(i for bucket in by_cost.values() for i in bucket)
+
+
+def build_plan(tasks: List[Dict], capacity_minutes: float, today_iso: str,
+               type_totals: Optional[List[Dict]] = None, max_tasks: int = PLAN_MAX_TASKS) -> Dict:
+    """Ranked plan for today plus the best tasks left out and why.
+
+    tasks: open tasks with PLAN_TASK_FIELDS and a string "id".
+    """
+    today = date.fromisoformat(today_iso)
+    scored = score_tasks(tasks, today, estimate_ratios(type_totals or []))
+    values = scored["score"]
+    costs = -(-scored["predicted"] // PLAN_SLOT_MINUTES)  # ceil to whole slots
+    capacity_slots = int(capacity_minutes * PLAN_CAPACITY_BUFFER // PLAN_SLOT_MINUTES)
+
+    eligible = np.flatnonzero(scored["eligible"]).tolist()
+    candidates = _prune(eligible, costs, values, max_tasks)
+    chosen = [candidates[i] for i in _knapsack(values[candidates], costs[candidates], capacity_slots, max_tasks)]
+    chosen_set = set(chosen)
+
+    def summary(i: int) -> Dict:
+        t = tasks[i]
+        return {
+            "id": t["id"],
+            "title": t["title"],
+            "type": t.get("type", "Coding"),
+            "estimatedTime": t.get("estimatedTime") or 60,
+            "predictedTime": int(scored["predicted"][i]),
+            "techTags": t.get("techTags", []),
+            "scheduledDate": t.get("scheduledDate"),
+            "score": float(values[i]),
+            "reason": str(REASONS[scored["reason"][i]]),
+        }
+
+    plan = sorted((summary(i) for i in chosen), key=lambda t: -t["score"])
+
+    # Best-scoring tasks that didn't make it, with why
+    alternatives = []
+    for i in np.argsort(-values, kind="stable"):
+        if len(alternatives) >= PLAN_ALTERNATIVES:
+            break
+        if i in chosen_set:
+            continue
+        t = summary(int(i))
+        if not scored["eligible"][i]:
+            t["excluded"] = "scheduled_later"
+        elif costs[i] > capacity_slots:
+            t["excluded"] = "over_capacity"
+        else:
+            t["excluded"] = "lower_total_score"
+        alternatives.append(t)
+
+    return {
+        "tasks": plan,
+        "alternatives": alternatives,
+        "considered": len(tasks),
+        "eligible": len(eligible),
+        "total_predicted_time": sum(t["predictedTime"] for t in plan),
+        "capacity": capacity_minutes,
+    }
@@ -0,0 +1,127 @@
+import os
+import asyncio
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set
+from dotenv import load_dotenv
+
+from leases import WORKER_ID
+
+load_dotenv()
+
+# Who is connected to which room. Each worker tracks its own sockets in memory and
+# periodically writes one room_presence document per room it has people in:
+# { _id: "<room id>:<worker>", roomId, worker, users: [{userId, name}], expiresAt }
+# The room's presence is the union over workers; documents of a worker that died just
+# expire (TTL index, and reads skip expired ones).
+PRESENCE_FLUSH_SECONDS = float(os.environ.get('PRESENCE_FLUSH_SECONDS', '10'))
+PRESENCE_TTL_SECONDS = float(os.environ.get('PRESENCE_TTL_SECONDS', '45'))
+
+
+class PresenceRegistry:
+    def __init__(self):
+        # {room_id: {user_id: {"userId", "name", "connections"}}}
+        self.rooms: Dict[str, Dict[str, Dict]] = {}
+        self.dirty: Set[str] = set()
+        self.db = None
+        self._task: Optional[asyncio.Task] = None
+        self.metrics = {"flushes": 0, "flush_errors": 0}
+
+    def join(self, room_id: str, user_id: str, name: Optional[str]) -> bool:
+        """Count a new socket for the user; True if it's their first in the room on this worker"""
+        users = self.rooms.setdefault(room_id, {})
+        entry = users.setdefault(user_id, {"userId": user_id, "name": name, "connections": 0})
+        entry["connections"] += 1
+        self.dirty.add(room_id)
+        return entry["connections"] == 1
+
+    def leave(self, room_id: str, user_id: str) -> bool:
+        """Drop one of the user's sockets; True if that was their last one in the room here"""
+        users = self.rooms.get(room_id, {})
+        entry = users.get(user_id)
+        if not entry:
+            return False
+        entry["connections"] -= 1
+        if entry["connections"] > 0:
+            return False
+        del users[user_id]
+        if not users:
+            del self.rooms[room_id]
+        self.dirty.add(room_id)
+        return True
+
+    def local_users(self, room_id: str) -> List[Dict]:
+        return [{"userId": u["userId"], "name": u["name"]} for u in self.rooms.get(room_id, {}).values()]
+
+    def start(self, db):
+        self.db = db
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.db is not None:
+            # We're going away: our sockets are gone with us
+            try:
+                await self.db.room_presence.delete_many({"worker": WORKER_ID})
+            except Exception as e:
+                print(f"Presence cleanup failed: {e}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(PRESENCE_FLUSH_SECONDS)
+            try:
+                await self.flush()
+            except Exception as e:
+                self.metrics["flush_errors"] += 1
+                print(f"Presence flush failed: {e}")
+
+    async def flush(self):
+        """Write rooms whose presence changed, then push back the expiry of all of ours"""
+        expires_at = datetime.utcnow() + timedelta(seconds=PRESENCE_TTL_SECONDS)
+        dirty, self.dirty = self.dirty, set()
+        try:
+            for room_id in dirty:
+                if room_id not in self.rooms:
+                    await self.db.room_presence.delete_one({"_id": f"{room_id}:{WORKER_ID}"})
+                    continue
+                await self.db.room_presence.update_one(
+                    {"_id": f"{room_id}:{WORKER_ID}"},
+                    {"$set": {"roomId": room_id, "worker": WORKER_ID, "users": self.local_users(room_id),
+                              "expiresAt": expires_at}},
+                    upsert=True
+                )
+            await self.db.room_presence.update_many({"worker": WORKER_ID}, {"$set": {"expiresAt": expires_at}})
+        except Exception:
+            self.dirty |= dirty
+            raise
+        self.metrics["flushes"] += 1
+
+
+async def get_active_users(db, room_id: str) -> List[Dict]:
+    """Everyone connected to the room on any worker, as of the workers' last flush"""
+    users: Dict[str, Dict] = {}
+    # This worker's view is always current
+    for user in get_presence().local_users(room_id):
+        users[user["userId"]] = user
+    async for doc in db.room_presence.find({"roomId": room_id, "expiresAt": {"$gt": datetime.utcnow()}}):
+        if doc.get("worker") == WORKER_ID:
+            continue
+        for user in doc.get("users", []):
+            users.setdefault(user["userId"], user)
+    return list(users.values())
+
+
+_presence: Optional[PresenceRegistry] = None
+
+
+def get_presence() -> PresenceRegistry:
+    global _presence
+    if _presence is None:
+        _presence = PresenceRegistry()
+    return _presence
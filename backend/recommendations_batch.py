@@ -0,0 +1,194 @@
+import os
+import time
+import asyncio
+from datetime import datetime, timedelta
+from typing import List, Dict, Optional
+from dotenv import load_dotenv
+
+from ai_providers import ProviderRateLimiter, parse_provider_limits, estimate_cost
+from insights_service import InsightsService, find_active_users, USE_AI_INSIGHTS, RECOMMENDATIONS_RETENTION_DAYS
+from leases import acquire_lease, release_lease
+
+load_dotenv()
+
+# Overnight daily-recommendations batch, so nobody waits on an LLM round trip when they
+# first open Insights. Runs after the insights precompute pass, or standalone:
+# python recommendations_batch.py [--date YYYY-MM-DD]
+RECOMMENDATIONS_BATCH_ENABLED = os.environ.get('RECOMMENDATIONS_BATCH_ENABLED', 'true').lower() == 'true'
+RECOMMENDATIONS_BATCH_CONCURRENCY = int(os.environ.get('RECOMMENDATIONS_BATCH_CONCURRENCY', '8'))
+# Per provider; override per provider with e.g. "groq=4:30,openai=8:500" (concurrency:requests per minute)
+RECOMMENDATIONS_BATCH_PROVIDER_CONCURRENCY = int(os.environ.get('RECOMMENDATIONS_BATCH_PROVIDER_CONCURRENCY', '4'))
+RECOMMENDATIONS_BATCH_PROVIDER_RPM = float(os.environ.get('RECOMMENDATIONS_BATCH_PROVIDER_RPM', '30'))
+RECOMMENDATIONS_BATCH_PROVIDER_LIMITS = os.environ.get('RECOMMENDATIONS_BATCH_PROVIDER_LIMITS', '')
+RECOMMENDATIONS_BATCH_MAX_USERS = int(os.environ.get('RECOMMENDATIONS_BATCH_MAX_USERS', '2000'))
+RECOMMENDATIONS_BATCH_MAX_SECONDS = float(os.environ.get('RECOMMENDATIONS_BATCH_MAX_SECONDS', '1800'))
+RECOMMENDATIONS_BATCH_ACTIVE_DAYS = int(os.environ.get('RECOMMENDATIONS_BATCH_ACTIVE_DAYS', '7'))
+# Generate for the day that starts within this many hours: a run at 20:00 UTC targets
+# tomorrow, one at 03:00 UTC targets today
+RECOMMENDATIONS_BATCH_LEAD_HOURS = float(os.environ.get('RECOMMENDATIONS_BATCH_LEAD_HOURS', '6'))
+
+RUN_LEASE_KEY = "recommendations-batch"
+
+
+def target_date(now: Optional[datetime] = None) -> str:
+    now = now or datetime.utcnow()
+    return (now + timedelta(hours=RECOMMENDATIONS_BATCH_LEAD_HOURS)).date().isoformat()
+
+
+def _percentile(values: List[float], percentile: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(percentile * (len(ordered) - 1)))]
+
+
+class RecommendationsBatch:
+    """Precomputes daily recommendations for recently active users, within per-provider rate limits"""
+
+    def __init__(self, db):
+        self.db = db
+        self.metrics: Dict = {"runs": 0, "runs_skipped": 0, "running": False, "last_run": None}
+
+    def _summarize(self, run: Dict, traces: List[Dict]):
+        """Per-provider call counts, latency percentiles and estimated token cost"""
+        providers: Dict[str, Dict] = {}
+        for trace in traces:
+            if "provider" not in trace:
+                continue
+            name = f"{trace['provider']}/{trace['model']}"
+            stats = providers.setdefault(name, {"calls": 0, "latencies": [], "input_tokens": 0, "output_tokens": 0, "cost": 0.0, "priced": True})
+            # Provider-reported usage, or character-count estimates where it wasn't reported
+            input_tokens = trace.get("input_tokens", 0)
+            output_tokens = trace.get("output_tokens", 0)
+            cost = estimate_cost(trace["model"], input_tokens, output_tokens)
+            stats["calls"] += 1
+            stats["latencies"].append(trace["latency"])
+            stats["input_tokens"] += input_tokens
+            stats["output_tokens"] += output_tokens
+            if cost is None:
+                stats["priced"] = False
+            else:
+                stats["cost"] += cost
+
+        summary = {}
+        for name, stats in providers.items():
+            summary[name] = {
+                "calls": stats["calls"],
+                "p50_latency_ms": round(_percentile(stats["latencies"], 0.5) * 1000),
+                "p95_latency_ms": round(_percentile(stats["latencies"], 0.95) * 1000),
+                "input_tokens": stats["input_tokens"],
+                "output_tokens": stats["output_tokens"],
+                "estimated_cost_usd": round(stats["cost"], 6) if stats["priced"] else None,
+            }
+        run["providers"] = summary
+        run["estimated_cost_usd"] = round(sum(p["estimated_cost_usd"] or 0 for p in summary.values()), 6)
+        latencies = [t["latency"] for t in traces if "latency" in t]
+        run["p50_latency_ms"] = round(_percentile(latencies, 0.5) * 1000) if latencies else None
+        run["p95_latency_ms"] = round(_percentile(latencies, 0.95) * 1000) if latencies else None
+
+    async def run_once(self, date: Optional[str] = None) -> Optional[Dict]:
+        """Generate `date`'s recommendations for active users that don't have them yet.
+
+        Returns the run summary, or None if another worker is running the batch.
+        """
+        if not USE_AI_INSIGHTS:
+            return None
+        if not await acquire_lease(self.db, RUN_LEASE_KEY, RECOMMENDATIONS_BATCH_MAX_SECONDS + 60):
+            self.metrics["runs_skipped"] += 1
+            return None
+
+        date = date or target_date()
+        started = time.monotonic()
+        run = {
+            "date": date,
+            "started_at": datetime.utcnow().isoformat(),
+            "active_users": 0,
+            "already_generated": 0,
+            "generated": 0,
+            "failed": 0,
+            "budget_exhausted": False,
+        }
+        traces: List[Dict] = []
+        self.metrics["running"] = True
+        try:
+            users = await find_active_users(self.db, RECOMMENDATIONS_BATCH_ACTIVE_DAYS)
+            run["active_users"] = len(users)
+            done = set(await self.db.daily_recommendations.distinct("userId", {"date": date}))
+            pending = [uid for uid in users if uid not in done]
+            run["already_generated"] = len(users) - len(pending)
+            if len(pending) > RECOMMENDATIONS_BATCH_MAX_USERS:
+                run["budget_exhausted"] = True
+                pending = pending[:RECOMMENDATIONS_BATCH_MAX_USERS]
+
+            service = InsightsService(self.db)
+            limiter = ProviderRateLimiter(
+                RECOMMENDATIONS_BATCH_PROVIDER_CONCURRENCY,
+                RECOMMENDATIONS_BATCH_PROVIDER_RPM,
+                parse_provider_limits(RECOMMENDATIONS_BATCH_PROVIDER_LIMITS)
+            )
+            semaphore = asyncio.Semaphore(RECOMMENDATIONS_BATCH_CONCURRENCY)
+
+            async def worker(user_id: str):
+                async with semaphore:
+                    if time.monotonic() - started > RECOMMENDATIONS_BATCH_MAX_SECONDS:
+                        run["budget_exhausted"] = True
+                        return
+                    trace: Dict = {}
+                    try:
+                        if await service.generate_recommendations_for(user_id, date, limiter=limiter, trace=trace):
+                            run["generated"] += 1
+                        else:
+                            run["failed"] += 1  # the user gets rule-based ones, or a retry on first visit
+                    except Exception as e:
+                        run["failed"] += 1
+                        print(f"Recommendations batch failed for {user_id}: {e}")
+                    traces.append(trace)
+
+            await asyncio.gather(*(worker(uid) for uid in pending))
+
+            # Documents written before the TTL index existed have no expiresAt
+            cutoff = (datetime.fromisoformat(date) - timedelta(days=1 + RECOMMENDATIONS_RETENTION_DAYS)).date().isoformat()
+            await self.db.daily_recommendations.delete_many({"date": {"$lt": cutoff}, "expiresAt": {"$exists": False}})
+        finally:
+            run["duration_seconds"] = round(time.monotonic() - started, 2)
+            self._summarize(run, traces)
+            self.metrics["runs"] += 1
+            self.metrics["running"] = False
+            self.metrics["last_run"] = run
+            await release_lease(self.db, RUN_LEASE_KEY)
+
+        print(f"Recommendations batch for {date}: {run['generated']} generated, {run['failed']} failed, "
+              f"{run['already_generated']} already done in {run['duration_seconds']}s, "
+              f"p95 {run['p95_latency_ms']}ms, est. ${run['estimated_cost_usd']}")
+        for name, stats in run["providers"].items():
+            print(f"  {name}: {stats['calls']} calls, p50 {stats['p50_latency_ms']}ms, p95 {stats['p95_latency_ms']}ms, "
+                  f"{stats['input_tokens']}+{stats['output_tokens']} tokens, est. ${stats['estimated_cost_usd']}")
+        return run
+
+
+_batch: Optional[RecommendationsBatch] = None
+
+
+def get_recommendations_batch(db) -> RecommendationsBatch:
+    global _batch
+    if _batch is None:
+        _batch = RecommendationsBatch(db)
+    return _batch
+
+
+async def main(date: Optional[str]):
+    from database import connect_to_mongo, close_mongo_connection, get_database
+    from ai_providers import init_provider_registry
+
+    await connect_to_mongo()
+    init_provider_registry()
+    try:
+        await get_recommendations_batch(get_database()).run_once(date)
+    finally:
+        await close_mongo_connection()
+
+
+if __name__ == "__main__":
+    import sys
+    date_arg = sys.argv[sys.argv.index("--date") + 1] if "--date" in sys.argv else None
+    asyncio.run(main(date_arg))
@@ -0,0 +1,285 @@
+import os
+import asyncio
+from datetime import datetime, timedelta
+from typing import List, Dict, Optional
+from dotenv import load_dotenv
+from leases import acquire_lease, release_lease
+
+load_dotenv()
+
+# Backfill users whose sessions predate the rollups when the server starts (one worker
+# does it; each user is marked with rollupsBackfilled once done)
+ROLLUP_BACKFILL_ON_STARTUP = os.environ.get("ROLLUP_BACKFILL_ON_STARTUP", "true").lower() == "true"
+ROLLUP_BACKFILL_LEASE_SECONDS = 600
+
+# focus_rollups: one document per user per UTC day, so time-based insights and profile
+# stats read a handful of small docs instead of rescanning focus_sessions.
+#
+# {
+#   _id: "<userId>:<YYYY-MM-DD>", userId, date,
+#   minutes: [24],          completed minutes by start hour
+#   hourSessions: [24],     sessions started by start hour (completed or not)
+#   hourCompleted: [24],    completed sessions by start hour
+#   sessionCount, completedCount, totalMinutes,
+#   categoryMinutes: {task type: minutes}
+# }
+#
+# Solo sessions count when started and add minutes when completed; room credits count as
+# one completed session per member.
+#
+# Room credits only exist as these counters, so the backfill can't rebuild them from
+# focus_sessions. Solo sessions' share is kept on the side as well, in
+#   solo: {minutes: {hour: n}, hourSessions: {...}, hourCompleted: {...},
+#          sessionCount, completedCount, totalMinutes, categoryMinutes: {...}}
+# and the backfill moves the counters by (rebuilt solo - stored solo), leaving room credits
+# and concurrent updates alone. Docs without soloTracked predate this; for those the backfill
+# has to assume everything in them came from sessions.
+
+ROLLUP_FIELDS = {
+    "_id": 0, "date": 1, "minutes": 1, "hourSessions": 1, "hourCompleted": 1,
+    "sessionCount": 1, "completedCount": 1, "totalMinutes": 1
+}
+
+
+def _rollup_id(user_id: str, date: str) -> str:
+    return f"{user_id}:{date}"
+
+
+def _empty_rollup(user_id: str, date: str) -> Dict:
+    return {
+        "userId": user_id,
+        "date": date,
+        "minutes": [0] * 24,
+        "hourSessions": [0] * 24,
+        "hourCompleted": [0] * 24,
+        "sessionCount": 0,
+        "completedCount": 0,
+        "totalMinutes": 0,
+        "categoryMinutes": {},
+        "solo": {},
+        "soloTracked": True,
+    }
+
+
+HOURLY_FIELDS = ("minutes", "hourSessions", "hourCompleted")
+TOTAL_FIELDS = ("sessionCount", "completedCount", "totalMinutes")
+
+
+def _category_key(category: str) -> str:
+    # Task types are user-defined; dots and a leading $ would break the $inc path
+    return category.replace(".", "_").lstrip("$") or "Other"
+
+
+def _parse_start(start_time: str) -> datetime:
+    # Stored as naive UTC isoformat; tolerate offsets from older clients
+    parsed = datetime.fromisoformat(start_time.replace("Z", "+00:00"))
+    return parsed.replace(tzinfo=None) - (parsed.utcoffset() or timedelta(0))
+
+
+async def _ensure_rollup(db, user_id: str, date: str):
+    # Positional $inc on "minutes.13" needs the arrays to exist, so create them first.
+    # $setOnInsert can't share a path with the $inc, hence the separate upsert.
+    empty = _empty_rollup(user_id, date)
+    await db.focus_rollups.update_one(
+        {"_id": _rollup_id(user_id, date)},
+        {"$setOnInsert": empty},
+        upsert=True
+    )
+
+
+async def record_session_start(db, user_id: str, start_time: str):
+    start = _parse_start(start_time)
+    date = start.date().isoformat()
+    await _ensure_rollup(db, user_id, date)
+    await db.focus_rollups.update_one(
+        {"_id": _rollup_id(user_id, date)},
+        {"$inc": {f"hourSessions.{start.hour}": 1, "sessionCount": 1,
+                  f"solo.hourSessions.{start.hour}": 1, "solo.sessionCount": 1}}
+    )
+
+
+async def record_session_complete(db, user_id: str, start_time: str, minutes: int, category: str,
+                                  count_session: bool = False):
+    """Credit completed minutes to the hour the session started in.
+
+    count_session also counts it as started, for sessions that never went through
+    record_session_start (room credits).
+    """
+    start = _parse_start(start_time)
+    date = start.date().isoformat()
+    inc = {
+        f"minutes.{start.hour}": minutes,
+        f"hourCompleted.{start.hour}": 1,
+        "completedCount": 1,
+        "totalMinutes": minutes,
+        f"categoryMinutes.{_category_key(category)}": minutes,
+    }
+    if count_session:
+        inc[f"hourSessions.{start.hour}"] = 1
+        inc["sessionCount"] = 1
+    else:
+        # From focus_sessions, so the backfill can rebuild it (room credits it can't)
+        inc.update({f"solo.{path}": value for path, value in inc.items()})
+    await _ensure_rollup(db, user_id, date)
+    await db.focus_rollups.update_one({"_id": _rollup_id(user_id, date)}, {"$inc": inc})
+
+
+async def get_rollups(db, user_id: str, since: datetime, until: Optional[datetime] = None,
+                      limit: int = 31, fields: Optional[Dict] = None) -> List[Dict]:
+    """Rollups for [since, until] by UTC date, oldest first"""
+    date_filter = {"$gte": since.date().isoformat()}
+    if until:
+        date_filter["$lte"] = until.date().isoformat()
+    return await db.focus_rollups.find(
+        {"userId": user_id, "date": date_filter},
+        fields or ROLLUP_FIELDS
+    ).sort("date", 1).to_list(limit)
+
+
+def _solo_from_counters(doc: Dict) -> Dict:
+    """A pre-soloTracked rollup's counters in the solo shape"""
+    solo = {field: {str(h): v for h, v in enumerate(doc.get(field) or []) if v} for field in HOURLY_FIELDS}
+    solo.update({field: doc.get(field, 0) for field in TOTAL_FIELDS})
+    solo["categoryMinutes"] = dict(doc.get("categoryMinutes") or {})
+    return solo
+
+
+def _solo_diff(old: Dict, new: Dict) -> Dict:
+    """$inc that moves the counters from `old` solo values to `new` ones"""
+    inc = {}
+    for field in HOURLY_FIELDS:
+        for hour in range(24):
+            delta = (new.get(field) or {}).get(str(hour), 0) - (old.get(field) or {}).get(str(hour), 0)
+            if delta:
+                inc[f"{field}.{hour}"] = delta
+    for field in TOTAL_FIELDS:
+        delta = new.get(field, 0) - old.get(field, 0)
+        if delta:
+            inc[field] = delta
+    old_categories, new_categories = old.get("categoryMinutes") or {}, new.get("categoryMinutes") or {}
+    for category in set(old_categories) | set(new_categories):
+        delta = new_categories.get(category, 0) - old_categories.get(category, 0)
+        if delta:
+            inc[f"categoryMinutes.{category}"] = delta
+    return inc
+
+
+async def _apply_solo(db, user_id: str, date: str, solo: Dict) -> bool:
+    """Bring one day's solo share to `solo`; False if it kept changing under us"""
+    await _ensure_rollup(db, user_id, date)
+    for _ in range(5):
+        doc = await db.focus_rollups.find_one({"_id": _rollup_id(user_id, date)})
+        old = (doc.get("solo") or {}) if doc.get("soloTracked") else _solo_from_counters(doc)
+        update = {"$set": {"solo": solo, "soloTracked": True}}
+        inc = _solo_diff(old, solo)
+        if inc:
+            update["$inc"] = inc
+        # Only if no solo session landed since the read; room credits may, $inc doesn't mind
+        result = await db.focus_rollups.update_one(
+            {"_id": doc["_id"], "solo": doc.get("solo"), "soloTracked": doc.get("soloTracked")}, update
+        )
+        if result.matched_count:
+            return True
+    print(f"Rollup backfill gave up on {user_id} {date}: too many concurrent updates")
+    return False
+
+
+async def backfill_user(db, user_id: str) -> int:
+    """Rebuild the solo-session share of a user's rollups from focus_sessions, keeping room
+    credits. Idempotent and safe alongside live updates; returns the number of days written.
+
+    Room sessions before rollups existed only left heatmap totals, so they can't be placed
+    in an hour and are not backfilled.
+    """
+    tasks = await db.tasks.find({"userId": user_id}, {"type": 1}).to_list(None)
+    task_types = {str(t["_id"]): t.get("type", "Coding") for t in tasks}
+
+    days: Dict[str, Dict] = {}
+    cursor = db.focus_sessions.find(
+        {"userId": user_id},
+        {"_id": 0, "startTime": 1, "duration": 1, "completed": 1, "taskId": 1}
+    )
+    async for session in cursor:
+        if not session.get("startTime"):
+            continue
+        try:
+            start = _parse_start(session["startTime"])
+        except ValueError:
+            continue
+        date = start.date().isoformat()
+        day = days.setdefault(date, _solo_from_counters({}))
+        hour = str(start.hour)
+        day["hourSessions"][hour] = day["hourSessions"].get(hour, 0) + 1
+        day["sessionCount"] += 1
+        if session.get("completed"):
+            minutes = session.get("duration") or 0
+            category = _category_key(task_types.get(session.get("taskId"), "Coding"))
+            day["minutes"][hour] = day["minutes"].get(hour, 0) + minutes
+            day["hourCompleted"][hour] = day["hourCompleted"].get(hour, 0) + 1
+            day["completedCount"] += 1
+            day["totalMinutes"] += minutes
+            day["categoryMinutes"][category] = day["categoryMinutes"].get(category, 0) + minutes
+
+    # Days whose sessions are gone still need their solo share taken back out
+    async for doc in db.focus_rollups.find({"userId": user_id, "soloTracked": True}, {"date": 1}):
+        days.setdefault(doc["date"], _solo_from_counters({}))
+
+    written = 0
+    for date, solo in days.items():
+        written += await _apply_solo(db, user_id, date, solo)
+    return written
+
+
+async def ensure_backfilled(db, user: Dict):
+    """Backfill the user once (their sessions may predate the rollups) and mark them"""
+    if user.get("rollupsBackfilled"):
+        return
+    await backfill_user(db, str(user["_id"]))
+    await db.users.update_one({"_id": user["_id"]}, {"$set": {"rollupsBackfilled": True}})
+
+
+async def backfill_pending(db):
+    """Startup migration: backfill every user not marked yet. Holds a lease so only one
+    worker runs it; another worker (or a restart) picks up where it stopped."""
+    lease_key = "rollups:backfill"
+    if not await acquire_lease(db, lease_key, ROLLUP_BACKFILL_LEASE_SECONDS):
+        return
+    done = 0
+    try:
+        async for user in db.users.find({"rollupsBackfilled": {"$ne": True}}, {"_id": 1}):
+            try:
+                await ensure_backfilled(db, user)
+                done += 1
+            except Exception as e:
+                print(f"Rollup backfill failed for {user['_id']}: {e}")
+            # Renew so a long migration doesn't lose the lease halfway
+            await acquire_lease(db, lease_key, ROLLUP_BACKFILL_LEASE_SECONDS)
+        if done:
+            print(f"Backfilled rollups for {done} users")
+    finally:
+        await release_lease(db, lease_key)
+
+
+async def backfill(db, user_id: Optional[str] = None):
+    user_ids = [user_id] if user_id else await db.focus_sessions.distinct("userId")
+    total_days = 0
+    for uid in user_ids:
+        total_days += await backfill_user(db, uid)
+    print(f"Backfilled {total_days} rollup days for {len(user_ids)} users")
+
+
+async def main(user_id: Optional[str]):
+    # Backfill: python rollups.py [--user USER_ID]
+    from database import connect_to_mongo, close_mongo_connection, get_database
+
+    await connect_to_mongo()
+    try:
+        await backfill(get_database(), user_id)
+    finally:
+        await close_mongo_connection()
+
+
+if __name__ == "__main__":
+    import sys
+    user_arg = sys.argv[sys.argv.index("--user") + 1] if "--user" in sys.argv else None
+    asyncio.run(main(user_arg))
@@ -0,0 +1,88 @@
+import os
+import datetime
+from typing import Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+from bson import ObjectId
+
+load_dotenv()
+
+# Room membership. Standard rooms keep members and pendingRequests embedded in the room
+# document and are capped at ROOM_MAX_MEMBERS. Large rooms (mode "large", study halls)
+# keep one room_members document per person instead:
+# { roomId, userId, name, status: admin|member|pending, joinedAt, expiresAt }
+# with memberCount/pendingCount on the room, and member lists are read a page at a time.
+ROOM_MAX_MEMBERS = int(os.environ.get('ROOM_MAX_MEMBERS', '5'))
+LARGE_ROOM_MAX_MEMBERS = int(os.environ.get('LARGE_ROOM_MAX_MEMBERS', '500'))
+ROOM_MEMBERS_PAGE_SIZE = int(os.environ.get('ROOM_MEMBERS_PAGE_SIZE', '50'))
+
+ROOM_MODE_STANDARD = "standard"
+ROOM_MODE_LARGE = "large"
+
+
+def is_large(room: Dict) -> bool:
+    return room.get("mode") == ROOM_MODE_LARGE
+
+
+def member_limit(room: Dict) -> int:
+    return LARGE_ROOM_MAX_MEMBERS if is_large(room) else ROOM_MAX_MEMBERS
+
+
+def member_count(room: Dict) -> int:
+    return room.get("memberCount", 0) if is_large(room) else len(room.get("members", []))
+
+
+async def add_member_doc(db, room: Dict, member: Dict):
+    """Store a large room's member (or join request); same shape as the embedded entries"""
+    expires_at = room.get("expiresAt")
+    await db.room_members.update_one(
+        {"roomId": str(room["_id"]), "userId": member["userId"]},
+        {"$set": {**member, "expiresAt": datetime.datetime.fromisoformat(expires_at) if expires_at else None}},
+        upsert=True
+    )
+
+
+async def get_member(db, room: Dict, user_id: str) -> Optional[Dict]:
+    """The user's entry in the room (status admin, member or pending), if any"""
+    if is_large(room):
+        return await db.room_members.find_one({"roomId": str(room["_id"]), "userId": user_id}, {"_id": 0, "expiresAt": 0})
+    for entry in room.get("members", []):
+        if entry.get("userId") == user_id:
+            return entry
+    for entry in room.get("pendingRequests", []):
+        if entry.get("userId") == user_id:
+            return {**entry, "status": "pending"}
+    return None
+
+
+async def list_members(db, room: Dict, pending: bool = False, after: Optional[str] = None,
+                       limit: int = ROOM_MEMBERS_PAGE_SIZE) -> Tuple[List[Dict], Optional[str]]:
+    """One page of members (or join requests) and the cursor for the next, None at the end"""
+    if not is_large(room):
+        entries = room.get("pendingRequests" if pending else "members", [])
+        start = int(after) if after and after.isdigit() else 0
+        page = entries[start:start + limit]
+        return page, str(start + limit) if start + limit < len(entries) else None
+
+    query = {"roomId": str(room["_id"]), "status": "pending" if pending else {"$in": ["admin", "member"]}}
+    if after and ObjectId.is_valid(after):
+        query["_id"] = {"$gt": ObjectId(after)}
+    docs = await db.room_members.find(query, {"expiresAt": 0}).sort("_id", 1).limit(limit + 1).to_list(limit + 1)
+    next_cursor = str(docs[limit - 1]["_id"]) if len(docs) > limit else None
+    page = []
+    for doc in docs[:limit]:
+        doc.pop("_id")
+        page.append(doc)
+    return page, next_cursor
+
+
+async def filter_members(db, room: Dict, user_ids: List[str]) -> List[str]:
+    """The ones among `user_ids` who are full members (or the admin) of the room"""
+    if not is_large(room):
+        members = {m.get("userId") for m in room.get("members", [])}
+        return [uid for uid in user_ids if uid in members]
+    cursor = db.room_members.find(
+        {"roomId": str(room["_id"]), "userId": {"$in": user_ids}, "status": {"$in": ["admin", "member"]}},
+        {"userId": 1}
+    )
+    members = {doc["userId"] async for doc in cursor}
+    return [uid for uid in user_ids if uid in members]
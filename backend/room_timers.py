@@ -0,0 +1,216 @@
+import os
+import uuid
+import time
+import heapq
+import asyncio
+import datetime
+from datetime import timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+from dotenv import load_dotenv
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+from backplane import get_backplane
+from presence import get_active_users
+from room_members import filter_members
+from rollups import record_session_complete
+from insights_service import InsightsService
+
+load_dotenv()
+
+# Server-side room timers. Running timers sit in a heap of deadlines; when one is due
+# the worker that claims it in Mongo (the timerRunId must still match) stops the timer
+# and credits everyone present, so a session counts even if the owner's tab is asleep.
+#
+# Every worker also re-reads running timers from the DB every ROOM_TIMER_SYNC_SECONDS,
+# which picks up timers started through other workers and recovers them after a
+# restart, and sends its own sockets a timer_tick every ROOM_TIMER_TICK_SECONDS so
+# clients can correct their countdown.
+ROOM_TIMER_TICK_SECONDS = float(os.environ.get('ROOM_TIMER_TICK_SECONDS', '15'))
+ROOM_TIMER_SYNC_SECONDS = float(os.environ.get('ROOM_TIMER_SYNC_SECONDS', '30'))
+
+ROOM_SESSION_TASK_TYPE = "Study"
+
+
+def new_run_id() -> str:
+    return uuid.uuid4().hex
+
+
+def timer_ends_at(start_iso: str, duration_minutes: float) -> float:
+    """Epoch seconds a timer started at `start_iso` (naive UTC, as stored) runs out"""
+    started = datetime.datetime.fromisoformat(start_iso)
+    if started.tzinfo is None:
+        started = started.replace(tzinfo=timezone.utc)
+    return started.timestamp() + duration_minutes * 60
+
+
+def timer_credit(duration: float, elapsed_before: Optional[float] = 0) -> int:
+    """Minutes to credit when a run of `duration` finishes, counting what ran before a pause
+    (timerElapsedMinutes; timerDuration only holds what was left when it was resumed)"""
+    return int(round(duration + (elapsed_before or 0)))
+
+
+async def credit_room_session(db, user_ids: List[str], duration: int) -> int:
+    """Credit a finished room session to each user: stats, heatmap, rollups. Returns how many."""
+    today = datetime.datetime.utcnow().date().isoformat()
+    task_type = ROOM_SESSION_TASK_TYPE
+    count = 0
+
+    for uid in user_ids:
+        if not uid or not ObjectId.is_valid(uid):
+            continue
+
+        # Update User Stats
+        await db.users.update_one(
+             {"_id": ObjectId(uid)},
+             {
+                 "$inc": {"totalFocusMinutes": duration},
+                 "$set": {"lastFocusDate": datetime.datetime.utcnow().isoformat()}
+             }
+        )
+
+        # Update Heatmap (one upsert, so two credits landing together can't clobber each other)
+        await db.heatmap_entries.update_one(
+            {"userId": uid, "date": today},
+            {"$inc": {"totalMinutes": duration, f"categoryBreakdown.{task_type}": duration}},
+            upsert=True
+        )
+        # Credit the hour the room session started in
+        started = (datetime.datetime.utcnow() - timedelta(minutes=duration)).isoformat()
+        await record_session_complete(db, uid, started, duration, task_type, count_session=True)
+        await InsightsService(db).invalidate(uid, "heatmap", "sessions")
+        count += 1
+
+    return count
+
+
+class RoomTimerScheduler:
+    def __init__(self):
+        self.db = None
+        # (ends_at, room_id, run_id); entries whose run is no longer current are skipped
+        self.heap: List[Tuple[float, str, Optional[str]]] = []
+        # room_id -> (run_id, ends_at, minutes to credit)
+        self.running: Dict[str, Tuple[Optional[str], float, int]] = {}
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.metrics = {"scheduled": 0, "completed": 0, "lost_claims": 0, "credited": 0, "ticks": 0, "syncs": 0}
+
+    def schedule(self, room_id: str, run_id: Optional[str], ends_at: float, duration: int):
+        current = self.running.get(room_id)
+        if current and current[0] == run_id and current[1] == ends_at:
+            return
+        self.running[room_id] = (run_id, ends_at, duration)
+        heapq.heappush(self.heap, (ends_at, room_id, run_id))
+        self.metrics["scheduled"] += 1
+        self._wake.set()
+
+    def cancel(self, room_id: str):
+        self.running.pop(room_id, None)
+
+    def start(self, db):
+        self.db = db
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def sync(self):
+        """Match the local schedule to the running timers in the DB"""
+        running_ids = set()
+        cursor = self.db.focus_rooms.find(
+            {"timerStatus": "running"},
+            {"timerStartTime": 1, "timerDuration": 1, "timerRunId": 1, "timerElapsedMinutes": 1}
+        )
+        async for room in cursor:
+            if not room.get("timerStartTime"):
+                continue
+            room_id = str(room["_id"])
+            duration = int(room.get("timerDuration") or 25)
+            running_ids.add(room_id)
+            self.schedule(room_id, room.get("timerRunId"), timer_ends_at(room["timerStartTime"], duration),
+                          timer_credit(duration, room.get("timerElapsedMinutes")))
+        for room_id in set(self.running) - running_ids:
+            self.cancel(room_id)
+        self.metrics["syncs"] += 1
+
+    async def _run(self):
+        next_tick = next_sync = 0.0
+        while True:
+            try:
+                now = time.time()
+                # Rescheduled before running, so a failing sync or tick waits its turn too
+                if now >= next_sync:
+                    next_sync = now + ROOM_TIMER_SYNC_SECONDS
+                    await self.sync()
+                if now >= next_tick:
+                    next_tick = now + ROOM_TIMER_TICK_SECONDS
+                    await self._tick(now)
+                while self.heap and self.heap[0][0] <= time.time():
+                    ends_at, room_id, run_id = heapq.heappop(self.heap)
+                    current = self.running.get(room_id)
+                    if current and current[0] == run_id and current[1] == ends_at:
+                        del self.running[room_id]
+                        await self._complete(room_id, run_id, current[2])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Room timer loop failed: {e}")
+                await asyncio.sleep(1)  # don't spin if the DB is down
+
+            wake_at = min(next_tick, next_sync, self.heap[0][0] if self.heap else next_sync)
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=max(wake_at - time.time(), 0))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _tick(self, now: float):
+        # Local sockets only: every worker ticks for its own members
+        for room_id, (_, ends_at, _) in list(self.running.items()):
+            await get_backplane().deliver_local(f"room:{room_id}", {
+                "type": "timer_tick",
+                "remainingSeconds": max(0, round(ends_at - now)),
+            })
+            self.metrics["ticks"] += 1
+
+    async def _complete(self, room_id: str, run_id: Optional[str], duration: int):
+        # Exactly one worker wins this, and only if nobody stopped or restarted the timer
+        room = await self.db.focus_rooms.find_one_and_update(
+            {"_id": ObjectId(room_id), "timerStatus": "running", "timerRunId": run_id},
+            {"$set": {"timerStatus": "stopped", "timerStartTime": None, "timerElapsedMinutes": 0,
+                      "lastTimerCompletedAt": datetime.datetime.utcnow().isoformat()},
+             "$inc": {"version": 1}},
+            projection={"members": 1, "mode": 1, "version": 1}, return_document=ReturnDocument.AFTER
+        )
+        if not room:
+            self.metrics["lost_claims"] += 1
+            return
+        self.metrics["completed"] += 1
+
+        # Present members only
+        present = await filter_members(self.db, room, [u["userId"] for u in await get_active_users(self.db, room_id)])
+        credited = await credit_room_session(self.db, present, duration)
+        self.metrics["credited"] += credited
+
+        # Numbered like any room broadcast, so clients reconnecting later get them replayed
+        channel = f"room:{room_id}"
+        await get_backplane().publish_numbered(channel, {"type": "timer_complete", "duration": duration, "credited": present})
+        await get_backplane().publish_numbered(channel, {"type": "timer_update", "status": "stopped", "startTime": None,
+                                                        "version": room["version"]})
+
+
+_scheduler: Optional[RoomTimerScheduler] = None
+
+
+def get_room_timers() -> RoomTimerScheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = RoomTimerScheduler()
+    return _scheduler
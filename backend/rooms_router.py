@@ -3,52 +3,520 @@ from fastapi.security import OAuth2PasswordBearer
 from database import get_database
 from models import (
     FocusRoomCreate, FocusRoomResponse, TokenData, JoinRoomRequest, 
-    RoomMember, ChatMessage, RoomTask, TaskCreate, TaskUpdate, SharedTaskCreate, RoomSessionLog
+    RoomMember, ChatMessage, RoomTask, TaskCreate, TaskUpdate, SharedTaskCreate, RoomSessionLog,
+    WSFrame, WS_FRAME_MODELS, WS_CLIENT_FRAME_TYPES, RoomMode, RoomMembersPage
 )
-from auth import verify_password, get_current_user, get_password_hash
+from auth import verify_password, get_current_user, get_password_hash, decode_access_token
+from backplane import get_backplane
+from chat_writer import get_chat_writer, chat_page, ROOM_CHAT_PAGE_SIZE
+from presence import get_presence, get_active_users
+from room_timers import get_room_timers, credit_room_session, new_run_id, timer_ends_at, timer_credit
+from room_members import (ROOM_MEMBERS_PAGE_SIZE, is_large, member_limit, member_count, add_member_doc,
+                          get_member, list_members)
+from notifications import notify_user
+from ws_limits import (WS_CONNECTION_RATES, WS_ROOM_RATES, CATEGORIES, make_buckets, make_strikes,
+                       frame_category)
 from bson import ObjectId
-from typing import List, Optional
+from pydantic import ValidationError
+from pymongo import ReturnDocument
+from typing import Dict, List, Optional
+from collections import deque
+from dotenv import load_dotenv
+import os
 import datetime
 from datetime import timedelta
 import asyncio
-import json
+import time
+import orjson
+
+load_dotenv()
 
 router = APIRouter()
 
+# Outbound messages wait in a bounded queue per socket, drained by that socket's own writer
+# task, so one slow client never holds up the rest of the room (or the request that
+# broadcast). When a queue is full WS_OVERFLOW_POLICY decides: "drop_oldest", "coalesce"
+# (replace a queued message of the same kind, e.g. an older timer update, else drop oldest)
+# or "disconnect" the slow client.
+WS_SEND_QUEUE_SIZE = int(os.environ.get('WS_SEND_QUEUE_SIZE', '64'))
+WS_OVERFLOW_POLICY = os.environ.get('WS_OVERFLOW_POLICY', 'coalesce').lower()
+# Only the latest of these matters to a client (a coalesced versioned update just makes the
+# client see a version gap and refetch)
+COALESCE_TYPES = {"timer_update", "timer_tick", "rate_limited"}
+
+# Liveness: every socket gets a ping this often and must send something (a pong will do)
+# within the timeout, or it's closed and its user marked as gone
+WS_PING_INTERVAL_SECONDS = float(os.environ.get('WS_PING_INTERVAL_SECONDS', '20'))
+WS_PRESENCE_TIMEOUT_SECONDS = float(os.environ.get('WS_PRESENCE_TIMEOUT_SECONDS', '60'))
+
+# Every room broadcast carries a per-room seq (numbered through the backplane, so the same on
+# all workers) and each worker keeps the last WS_REPLAY_BUFFER_SIZE of them per room. A client
+# reconnecting with ?last_seq=&stream= gets just what it missed; if that's no longer
+# available anywhere it's told to resync (reload the room). With WS_BACKPLANE=mongo the
+# capped collection backs this up, so a resume still works after a worker restart.
+WS_REPLAY_BUFFER_SIZE = int(os.environ.get('WS_REPLAY_BUFFER_SIZE', '200'))
+# Buffers of rooms nobody here is connected to are dropped after this long without events
+WS_REPLAY_RETENTION_SECONDS = float(os.environ.get('WS_REPLAY_RETENTION_SECONDS', '600'))
+
+# Rooms with more local sockets than this are fanned out in shards, yielding to the event
+# loop in between (in order: one fan-out per room at a time)
+WS_FANOUT_SHARD_SIZE = int(os.environ.get('WS_FANOUT_SHARD_SIZE', '100'))
+# Large rooms get a presence_count this often (when it changed) instead of a
+# user_joined/user_left per person
+WS_PRESENCE_COUNT_SECONDS = float(os.environ.get('WS_PRESENCE_COUNT_SECONDS', '5'))
+
+# Close code for clients dropped for not keeping up ("try again later")
+WS_CLOSE_TOO_SLOW = 1013
+WS_CLOSE_GOING_AWAY = 1001
+# Application codes (4000+): clients shouldn't reconnect after these
+WS_CLOSE_UNAUTHORIZED = 4401  # missing or invalid token
+WS_CLOSE_FORBIDDEN = 4403  # not in the room, or removed from it
+WS_CLOSE_POLICY = 1008  # kept sending over its rate limits
+
+
+def encode_frame(message: dict) -> str:
+    # Once per broadcast, not once per recipient
+    return orjson.dumps(message, default=str).decode()
+
+
+def parse_frame(data: str) -> WSFrame:
+    """Decode and validate an inbound frame. Raises ValueError (or ValidationError) if it's bad."""
+    raw = orjson.loads(data)
+    if not isinstance(raw, dict):
+        raise ValueError("Frame must be a JSON object")
+    if raw.get("type") not in WS_CLIENT_FRAME_TYPES:
+        raise ValueError(f"Frame type {raw.get('type')!r} can't be sent by clients")
+    return WS_FRAME_MODELS.get(raw.get("type"), WSFrame).model_validate(raw)
+
+
+class RoomConnection:
+    """One room socket and its outbound queue"""
+
+    def __init__(self, websocket: WebSocket, metrics: dict, user_id: Optional[str] = None,
+                 user_name: Optional[str] = None, role: Optional[str] = None):
+        self.websocket = websocket
+        # Who's on the other end, checked once at connect; role ("owner" or "member") is
+        # kept current from the room's own member_removed deltas
+        self.user_id = user_id
+        self.user_name = user_name
+        self.role = role
+        # Inbound budgets (see ws_limits), and over-budget frames waiting to go out
+        self.limits = make_buckets(WS_CONNECTION_RATES)
+        self.strikes = make_strikes()
+        self.deferred: Dict[str, dict] = {}
+        self.last_seen = time.monotonic()
+        self.queue: deque = deque()
+        # Sent before the queue (session frame and replay on connect); not subject to its limit
+        self.backlog: deque = deque()
+        self.metrics = metrics
+        self.closed = False
+        self.closing: Optional[int] = None
+        self._ready = asyncio.Event()
+        self._writer = asyncio.create_task(self._drain())
+
+    def send(self, kind: str, text: str):
+        """Queue an encoded frame without waiting on the network"""
+        if self.closed or self.closing is not None:
+            return
+        if len(self.queue) >= WS_SEND_QUEUE_SIZE:
+            if not self._overflow(kind):
+                return
+        self.queue.append((kind, text))
+        self.metrics["max_queue_depth"] = max(self.metrics["max_queue_depth"], len(self.queue))
+        self._ready.set()
+
+    def preload(self, frames: List[tuple]):
+        """Frames to send ahead of anything queued"""
+        self.backlog.extend(frames)
+        self._ready.set()
+
+    def _overflow(self, kind: str) -> bool:
+        """Make room for a frame of type `kind`; False if it shouldn't be queued"""
+        if WS_OVERFLOW_POLICY == "disconnect":
+            self.metrics["slow_disconnects"] += 1
+            self.close(WS_CLOSE_TOO_SLOW)
+            return False
+        if WS_OVERFLOW_POLICY == "coalesce" and kind in COALESCE_TYPES:
+            for i, (queued_kind, _) in enumerate(self.queue):
+                if queued_kind == kind:
+                    del self.queue[i]
+                    self.metrics["coalesced"] += 1
+                    return True
+        self.queue.popleft()
+        self.metrics["dropped"] += 1
+        return True
+
+    async def _drain(self):
+        try:
+            while True:
+                await self._ready.wait()
+                while self.backlog or self.queue:
+                    await self.websocket.send_text((self.backlog or self.queue).popleft()[1])
+                    self.metrics["sent"] += 1
+                if self.closing is not None:
+                    self.close(self.closing)
+                    return
+                self._ready.clear()
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            # Broken pipe; the receive loop will see the disconnect and clean up
+            self.closed = True
+            self.metrics["send_errors"] += 1
+
+    def finish(self, code: int):
+        """Close once what's already queued has gone out"""
+        if self.closing is None:
+            self.closing = code
+            self._ready.set()
+
+    def close(self, code: int = 1000):
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.clear()
+        self.backlog.clear()
+        self._writer.cancel()
+        asyncio.create_task(self._close_socket(code))
+
+    async def _close_socket(self, code: int):
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass
+
+
 # --- Connection Manager for WebSockets ---
 class ConnectionManager:
     def __init__(self):
-        # stored as {room_id: [WebSocket, ...]}
-        self.active_connections: dict[str, List[WebSocket]] = {}
+        # stored as {room_id: [RoomConnection, ...]}
+        self.active_connections: dict[str, List[RoomConnection]] = {}
+        # {room_id: deque of (seq, type, encoded frame)}, and when each last got one
+        self.history: dict[str, deque] = {}
+        self.history_updated: dict[str, float] = {}
+        # {room_id: {category: TokenBucket}}, shared by this worker's sockets in the room
+        self.room_limits: dict[str, dict] = {}
+        # Large rooms with sockets here, and the online count they were last sent
+        self.large_rooms: dict[str, Optional[int]] = {}
+        self.fanout_locks: dict[str, asyncio.Lock] = {}
+        self._presence_counts: Optional[asyncio.Task] = None
+        self.metrics = {"sent": 0, "dropped": 0, "coalesced": 0, "slow_disconnects": 0, "send_errors": 0,
+                        "max_queue_depth": 0, "reaped": 0, "resumed": 0, "replayed": 0, "resyncs": 0,
+                        "rejected": 0, "removed": 0, "limited_frames": 0, "coalesced_inbound": 0,
+                        "rate_disconnects": 0, **{f"limited_{c}": 0 for c in CATEGORIES}}
+        self._heartbeat: Optional[asyncio.Task] = None
 
-    async def connect(self, websocket: WebSocket, room_id: str):
+    async def connect(self, websocket: WebSocket, room_id: str, user_id: Optional[str] = None,
+                      user_name: Optional[str] = None, role: Optional[str] = None,
+                      last_seq: Optional[int] = None, stream: Optional[str] = None,
+                      large: bool = False) -> RoomConnection:
         await websocket.accept()
-        if room_id not in self.active_connections:
-            self.active_connections[room_id] = []
-        self.active_connections[room_id].append(websocket)
+        backplane = get_backplane()
+        current = await backplane.current_seq(f"room:{room_id}")
+        missed = None
+        if last_seq is not None and stream == backplane.stream and last_seq <= current:
+            missed = await self._fetch_missed(room_id, last_seq)
+        # No awaits from here until the connection is registered: everything delivered before
+        # is in the replay, everything after comes live
+        replay = self._replay(room_id, last_seq, current, missed) if missed is not None else None
+        if last_seq is not None:
+            self.metrics["resumed" if replay is not None else "resyncs"] += 1
+        connection = RoomConnection(websocket, self.metrics, user_id, user_name, role)
+        connection.preload([("session", encode_frame({
+            "type": "session",
+            "stream": backplane.stream,
+            "seq": current,
+            "resumed": replay is not None,
+            # They had state and we can't bring it up to date: reload the room
+            "resync": last_seq is not None and replay is None,
+        }))] + (replay or []))
+        self.active_connections.setdefault(room_id, []).append(connection)
+        if large:
+            self.large_rooms.setdefault(room_id, None)
+        if user_id and get_presence().join(room_id, user_id, user_name) and not large:
+            await self.broadcast({"type": "user_joined", "userId": user_id, "name": user_name}, room_id)
+        return connection
 
-    def disconnect(self, websocket: WebSocket, room_id: str):
-        if room_id in self.active_connections:
-            if websocket in self.active_connections[room_id]:
-                self.active_connections[room_id].remove(websocket)
-            if not self.active_connections[room_id]:
-                del self.active_connections[room_id]
+    async def _fetch_missed(self, room_id: str, last_seq: int) -> Dict[int, tuple]:
+        """What the backplane still has after last_seq, if our own buffer doesn't go back that far"""
+        buffered = self.history.get(room_id)
+        if buffered and buffered[0][0] <= last_seq + 1:
+            return {}
+        return {m["seq"]: (m.get("type", ""), encode_frame(m))
+                for m in await get_backplane().history(f"room:{room_id}", last_seq)}
 
-    async def broadcast(self, message: dict, room_id: str):
-        if room_id in self.active_connections:
-            # Dispatch to all clients
-            # Handle broken pipes
-            to_remove = []
-            for connection in self.active_connections[room_id]:
+    def _replay(self, room_id: str, last_seq: int, current: int, missed: Dict[int, tuple]) -> Optional[List[tuple]]:
+        """Frames after last_seq, or None if any of them is gone"""
+        for seq, kind, text in self.history.get(room_id, ()):
+            if seq > last_seq:
+                missed[seq] = (kind, text)
+        seqs = sorted(missed)
+        if seqs != list(range(last_seq + 1, last_seq + 1 + len(seqs))) or last_seq + len(seqs) < current:
+            return None
+        self.metrics["replayed"] += len(seqs)
+        return [missed[seq] for seq in seqs]
+
+    def admit(self, connection: RoomConnection, room_id: str, category: str) -> Optional[str]:
+        """Take a token for an inbound frame; None if it may go, else which budget it's over"""
+        if not connection.limits[category].take():
+            return "connection"
+        room = self.room_limits.setdefault(room_id, make_buckets(WS_ROOM_RATES))
+        if not room[category].take():
+            return "room"
+        return None
+
+    def wait_time(self, connection: RoomConnection, room_id: str, frames: dict) -> float:
+        """How long until any of these frame types could be admitted"""
+        room = self.room_limits.get(room_id, {})
+        waits = [max(connection.limits[c].wait_time(), room[c].wait_time() if c in room else 0.0)
+                 for c in {frame_category(t) for t in frames}]
+        return min(waits, default=0.0)
+
+    def strike(self, connection: RoomConnection):
+        """Count a frame over the connection's own budget; too many and it's closed"""
+        if not connection.strikes.take():
+            self.metrics["rate_disconnects"] += 1
+            connection.close(WS_CLOSE_POLICY)
+
+    async def leave(self, connection: RoomConnection, room_id: str):
+        """Forget a socket (safe to call twice) and tell the room if its user is now gone"""
+        connection.close()
+        connections = self.active_connections.get(room_id, [])
+        if connection not in connections:
+            return
+        connections.remove(connection)
+        if not connections:
+            del self.active_connections[room_id]
+            self.room_limits.pop(room_id, None)
+            self.large_rooms.pop(room_id, None)
+            self.fanout_locks.pop(room_id, None)
+        if connection.user_id and get_presence().leave(room_id, connection.user_id) and room_id not in self.large_rooms:
+            await self.broadcast({"type": "user_left", "userId": connection.user_id, "name": connection.user_name}, room_id)
+
+    def start(self):
+        if self._heartbeat is None:
+            self._heartbeat = asyncio.create_task(self._run_heartbeat())
+            self._presence_counts = asyncio.create_task(self._run_presence_counts())
+
+    async def stop(self):
+        for task in (self._heartbeat, self._presence_counts):
+            if task:
+                task.cancel()
                 try:
-                    await connection.send_json(message)
-                except Exception:
-                    to_remove.append(connection)
-            
-            for conn in to_remove:
-                self.active_connections[room_id].remove(conn)
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._heartbeat = self._presence_counts = None
+
+    async def _run_presence_counts(self):
+        while True:
+            await asyncio.sleep(WS_PRESENCE_COUNT_SECONDS)
+            try:
+                await self.send_presence_counts()
+            except Exception as e:
+                print(f"Room presence counts failed: {e}")
+
+    async def send_presence_counts(self):
+        """Tell large rooms how many people are online, if that changed. Every worker does
+        this for its own sockets, so it isn't published."""
+        for room_id, last in list(self.large_rooms.items()):
+            online = len(await get_active_users(get_database(), room_id))
+            if online != last and room_id in self.large_rooms:
+                self.large_rooms[room_id] = online
+                await get_backplane().deliver_local(f"room:{room_id}", {"type": "presence_count", "online": online})
+
+    async def _run_heartbeat(self):
+        while True:
+            await asyncio.sleep(WS_PING_INTERVAL_SECONDS)
+            try:
+                await self.heartbeat()
+            except Exception as e:
+                print(f"Room heartbeat failed: {e}")
+
+    async def heartbeat(self):
+        """Ping every socket and reap the ones that have gone quiet"""
+        now = time.monotonic()
+        for room_id, updated in list(self.history_updated.items()):
+            if now - updated > WS_REPLAY_RETENTION_SECONDS and room_id not in self.active_connections:
+                del self.history[room_id], self.history_updated[room_id]
+        ping = encode_frame({"type": "ping"})
+        for room_id, connections in list(self.active_connections.items()):
+            for connection in list(connections):
+                if now - connection.last_seen > WS_PRESENCE_TIMEOUT_SECONDS:
+                    # A dead TCP connection may never deliver a disconnect to the receive loop
+                    self.metrics["reaped"] += 1
+                    connection.close(WS_CLOSE_GOING_AWAY)
+                    await self.leave(connection, room_id)
+                else:
+                    connection.send("ping", ping)
+
+    def snapshot(self) -> dict:
+        connections = [conn for conns in self.active_connections.values() for conn in conns]
+        return {
+            **self.metrics,
+            "rooms": len(self.active_connections),
+            "connections": len(connections),
+            "queued": sum(len(conn.queue) for conn in connections),
+            "replay_buffers": len(self.history),
+            "large_rooms": len(self.large_rooms),
+        }
+
+    async def broadcast(self, message: dict, room_id: str):
+        # Goes through the backplane so members connected to other workers get it too
+        await get_backplane().publish_numbered(f"room:{room_id}", message)
+
+    async def deliver(self, channel: str, message: dict):
+        """Queue a published message for this worker's sockets in the room (and its replay buffer)"""
+        room_id = channel.split(":", 1)[1]
+        kind, text = message.get("type", ""), encode_frame(message)
+        if message.get("seq") is not None:
+            # Every room, not just ours: a client may resume here after its worker went away
+            if room_id not in self.history:
+                self.history[room_id] = deque(maxlen=WS_REPLAY_BUFFER_SIZE)
+            self.history[room_id].append((message["seq"], kind, text))
+            self.history_updated[room_id] = time.monotonic()
+        connections = list(self.active_connections.get(room_id, ()))
+        lock = self.fanout_locks.get(room_id)
+        if lock is None and len(connections) > WS_FANOUT_SHARD_SIZE:
+            lock = self.fanout_locks[room_id] = asyncio.Lock()
+        if lock is None:
+            for connection in connections:
+                connection.send(kind, text)
+        else:
+            # Let other work in between shards; the lock keeps this room's messages in order
+            async with lock:
+                for start in range(0, len(connections), WS_FANOUT_SHARD_SIZE):
+                    for connection in connections[start:start + WS_FANOUT_SHARD_SIZE]:
+                        connection.send(kind, text)
+                    await asyncio.sleep(0)
+        if kind == "room_delta":
+            self._refresh_roles(room_id, message)
+
+    def _refresh_roles(self, room_id: str, delta: dict):
+        # Every worker sees every delta, so each one keeps its own sockets' roles current
+        if delta.get("op") != "member_removed":
+            return
+        for connection in self.active_connections.get(room_id, ()):
+            if connection.user_id != delta["userId"]:
+                continue
+            connection.role = None
+            # They get the delta saying why, then the socket goes
+            self.metrics["removed"] += 1
+            connection.finish(WS_CLOSE_FORBIDDEN)
 
 manager = ConnectionManager()
+get_backplane().subscribe("room", manager.deliver)
+
+
+class UserConnectionManager:
+    """Each user's notification sockets (/api/ws/user) on this worker"""
+
+    def __init__(self):
+        # {user_id: [RoomConnection, ...]}, one per open tab
+        self.connections: dict[str, List[RoomConnection]] = {}
+        self.metrics = {"sent": 0, "dropped": 0, "coalesced": 0, "slow_disconnects": 0, "send_errors": 0,
+                        "max_queue_depth": 0, "reaped": 0, "resumed": 0, "resyncs": 0, "rejected": 0,
+                        "rate_disconnects": 0}
+        self._heartbeat: Optional[asyncio.Task] = None
+
+    async def connect(self, websocket: WebSocket, user_id: str, user_name: Optional[str],
+                      last_seq: Optional[int] = None, stream: Optional[str] = None) -> RoomConnection:
+        await websocket.accept()
+        channel = f"user:{user_id}"
+        backplane = get_backplane()
+        current = await backplane.current_seq(channel)
+        replay = None
+        if last_seq is not None and stream == backplane.stream and last_seq <= current:
+            # No replay buffer of our own here; notifications are few, the backplane's history will do
+            missed = {m["seq"]: m for m in await backplane.history(channel, last_seq)}
+            seqs = sorted(missed)
+            if seqs == list(range(last_seq + 1, last_seq + 1 + len(seqs))) and last_seq + len(seqs) >= current:
+                replay = [(missed[seq].get("type", ""), encode_frame(missed[seq])) for seq in seqs]
+                current = max([current] + seqs)
+        if last_seq is not None:
+            self.metrics["resumed" if replay is not None else "resyncs"] += 1
+        connection = RoomConnection(websocket, self.metrics, user_id, user_name)
+        connection.preload([("session", encode_frame({
+            "type": "session",
+            "stream": backplane.stream,
+            "seq": current,
+            "resumed": replay is not None,
+            # They may have missed something: reload whatever they're showing
+            "resync": last_seq is not None and replay is None,
+        }))] + (replay or []))
+        self.connections.setdefault(user_id, []).append(connection)
+        return connection
+
+    def leave(self, connection: RoomConnection):
+        connection.close()
+        connections = self.connections.get(connection.user_id, [])
+        if connection in connections:
+            connections.remove(connection)
+            if not connections:
+                del self.connections[connection.user_id]
+
+    async def deliver(self, channel: str, message: dict):
+        kind, text = message.get("type", ""), encode_frame(message)
+        for connection in list(self.connections.get(channel.split(":", 1)[1], ())):
+            connection.send(kind, text)
+
+    def start(self):
+        if self._heartbeat is None:
+            self._heartbeat = asyncio.create_task(self._run_heartbeat())
+
+    async def stop(self):
+        if self._heartbeat:
+            self._heartbeat.cancel()
+            try:
+                await self._heartbeat
+            except asyncio.CancelledError:
+                pass
+            self._heartbeat = None
+
+    async def _run_heartbeat(self):
+        while True:
+            await asyncio.sleep(WS_PING_INTERVAL_SECONDS)
+            try:
+                self.heartbeat()
+            except Exception as e:
+                print(f"User socket heartbeat failed: {e}")
+
+    def heartbeat(self):
+        now = time.monotonic()
+        ping = encode_frame({"type": "ping"})
+        for connections in list(self.connections.values()):
+            for connection in list(connections):
+                if now - connection.last_seen > WS_PRESENCE_TIMEOUT_SECONDS:
+                    self.metrics["reaped"] += 1
+                    connection.close(WS_CLOSE_GOING_AWAY)
+                    self.leave(connection)
+                else:
+                    connection.send("ping", ping)
+
+    def snapshot(self) -> dict:
+        connections = [conn for conns in self.connections.values() for conn in conns]
+        return {**self.metrics, "users": len(self.connections), "connections": len(connections)}
+
+user_sockets = UserConnectionManager()
+get_backplane().subscribe("user", user_sockets.deliver)
+
+
+# Room state is versioned: every mutation bumps focus_rooms.version in the same update and
+# broadcasts what changed as {"type": "room_delta", "version", "op", ...}. Clients apply
+# deltas in order and refetch the room only if they see a version gap.
+# Chat isn't part of this; it's append-only and carries its own ids.
+async def update_room(db, room_id: str, update: dict, match: Optional[dict] = None) -> Optional[int]:
+    """Apply `update` to the room and bump its version; the new version, or None if nothing matched"""
+    update = {**update, "$inc": {**update.get("$inc", {}), "version": 1}}
+    room = await db.focus_rooms.find_one_and_update(
+        {"_id": ObjectId(room_id), **(match or {})}, update,
+        projection={"version": 1}, return_document=ReturnDocument.AFTER
+    )
+    return room["version"] if room else None
+
+
+async def broadcast_delta(room_id: str, version: int, op: str, **fields):
+    await manager.broadcast({"type": "room_delta", "version": version, "op": op, **fields}, room_id)
 
 # --- ROOM CRUD ---
 
@@ -63,8 +531,9 @@ async def get_rooms(search: Optional[str] = None, current_user: TokenData = Depe
     if search:
         query["name"] = {"$regex": search, "$options": "i"}
         
-    rooms_cursor = db.focus_rooms.find(query)
+    rooms_cursor = db.focus_rooms.find(query, {"chatHistory": 0})  # the lobby doesn't show chat
     rooms = []
+    user = await db.users.find_one({"email": current_user.email}, {"_id": 1})
     async for room in rooms_cursor:
         room["roomId"] = str(room["_id"])
         room["ownerId"] = str(room.get("ownerId"))
@@ -88,15 +557,29 @@ async def get_rooms(search: Optional[str] = None, current_user: TokenData = Depe
         # Ensure blockedUsers are strings
         raw_blocked = room.get("blockedUsers") or []
         room["blockedUsers"] = [str(uid) for uid in raw_blocked]
-            
+        room["memberCount"] = member_count(room)
+        room["memberLimit"] = member_limit(room)
         rooms.append(room)
+
+    # Large rooms don't carry their member lists, so say where this user stands in them,
+    # all in one query
+    large_ids = [room["roomId"] for room in rooms if is_large(room)]
+    if large_ids and user:
+        cursor = db.room_members.find({"roomId": {"$in": large_ids}, "userId": str(user["_id"])},
+                                      {"roomId": 1, "status": 1})
+        statuses = {doc["roomId"]: doc.get("status") async for doc in cursor}
+        for room in rooms:
+            if is_large(room):
+                room["myStatus"] = statuses.get(room["roomId"])
         
     return rooms
 
 @router.get("/api/rooms/{room_id}", response_model=FocusRoomResponse)
 async def get_room_details(room_id: str, current_user: TokenData = Depends(get_current_user)):
     db = get_database()
-    room = await db.focus_rooms.find_one({"_id": ObjectId(room_id)})
+    # Just the latest page of chat; older messages come from /chat?before=
+    room = await db.focus_rooms.find_one({"_id": ObjectId(room_id)},
+                                         {"chatHistory": {"$slice": -ROOM_CHAT_PAGE_SIZE}, "password": 0})
     if not room:
         raise HTTPException(status_code=404, detail="Room not found")
     
@@ -120,6 +603,25 @@ async def get_room_details(room_id: str, current_user: TokenData = Depends(get_c
     if room.get("timerDuration"):
         room["timerDuration"] = int(room["timerDuration"])
 
+    # Chat sent through this worker that hasn't been flushed yet
+    room["chatHistory"] = chat_page(room.get("chatHistory", []) + get_chat_writer().pending_for(room_id))
+    room["memberCount"] = member_count(room)
+    room["memberLimit"] = member_limit(room)
+    active_users = await get_active_users(db, room_id)
+
+    if is_large(room):
+        # First page of members (the rest via /members), requests only for the owner,
+        # and a count of who's online rather than the list
+        user = await db.users.find_one({"email": current_user.email}, {"_id": 1})
+        me = await get_member(db, room, str(user["_id"])) if user else None
+        room["myStatus"] = me["status"] if me else None
+        room["members"], room["membersCursor"] = await list_members(db, room)
+        is_owner = user and room["ownerId"] == str(user["_id"])
+        room["pendingRequests"] = (await list_members(db, room, pending=True))[0] if is_owner else []
+        room["activeCount"] = len(active_users)
+    else:
+        room["activeUsers"] = active_users
+
     return room
 
 @router.post("/api/rooms", response_model=FocusRoomResponse)
@@ -130,18 +632,24 @@ async def create_room(room: FocusRoomCreate, current_user: TokenData = Depends(g
     # 24 Hour Expiry
     expires_at = datetime.datetime.utcnow() + timedelta(hours=24)
     
+    owner = {
+        "userId": str(user["_id"]),
+        "name": user["name"],
+        "status": "admin", # Owner is admin
+        "joinedAt": datetime.datetime.utcnow().isoformat()
+    }
+    large = room.mode == RoomMode.LARGE
     new_room = {
         "name": room.name,
         "description": room.description,
         "ownerId": str(user["_id"]),
         "password": get_password_hash(room.password),
         "isPrivate": True,
-        "members": [{
-            "userId": str(user["_id"]),
-            "name": user["name"],
-            "status": "admin", # Owner is admin
-            "joinedAt": datetime.datetime.utcnow().isoformat()
-        }],
+        "mode": room.mode.value,
+        # Large rooms keep members in room_members and just count them here
+        "members": [] if large else [owner],
+        "memberCount": 1,
+        "pendingCount": 0,
         "pendingRequests": [],
         "tasks": [],
         "chatHistory": [],
@@ -150,15 +658,20 @@ async def create_room(room: FocusRoomCreate, current_user: TokenData = Depends(g
         # Initial Timer State
         "timerStatus": "stopped",
         "timerDuration": 25, 
-        "timerStartTime": None
+        "timerStartTime": None,
+        "version": 0
     }
     
     result = await db.focus_rooms.insert_one(new_room)
     created_room = await db.focus_rooms.find_one({"_id": result.inserted_id})
+    if large:
+        await add_member_doc(db, created_room, owner)
+        created_room["members"] = [owner]
     
     created_room["roomId"] = str(created_room["_id"])
     created_room["ownerId"] = str(created_room["ownerId"])
     created_room["ownerName"] = user.get("name")
+    created_room["memberLimit"] = member_limit(created_room)
     
     return created_room
 
@@ -176,19 +689,20 @@ async def join_room_request(room_id: str, request: JoinRoomRequest, current_user
         raise HTTPException(status_code=403, detail="You are blocked from joining this room")
 
     # CHECK CAPACITY
-    if len(room.get("members", [])) >= 5:
-        raise HTTPException(status_code=409, detail="Room is full (Max 5 members)") 
+    limit = member_limit(room)
+    if member_count(room) >= limit:
+        raise HTTPException(status_code=409, detail=f"Room is full (Max {limit} members)") 
 
-    # Check already member
-    if any(m["userId"] == str(user["_id"]) for m in room.get("members", [])):
+    # Check already member / pending
+    existing = await get_member(db, room, str(user["_id"]))
+    if existing and existing.get("status") != "pending":
         return {"message": "Already a member", "status": "member"}
         
     # Verify Password (if exists)
     if room.get("password") and not verify_password(request.password, room["password"]):
          raise HTTPException(status_code=403, detail="Invalid password")
     
-    # Check pending
-    if any(p["userId"] == str(user["_id"]) for p in room.get("pendingRequests", [])):
+    if existing:
         return {"message": "Request already pending", "status": "pending"}
 
     # Add to pending
@@ -199,16 +713,15 @@ async def join_room_request(room_id: str, request: JoinRoomRequest, current_user
         "joinedAt": datetime.datetime.utcnow().isoformat()
     }
     
-    await db.focus_rooms.update_one(
-        {"_id": ObjectId(room_id)},
-        {"$push": {"pendingRequests": new_member}}
-    )
+    if is_large(room):
+        await add_member_doc(db, room, new_member)
+        version = await update_room(db, room_id, {"$inc": {"pendingCount": 1}})
+    else:
+        version = await update_room(db, room_id, {"$push": {"pendingRequests": new_member}})
     
-    # Notify Owner via WS? (Optimization)
-    await manager.broadcast({
-        "type": "room_update", 
-        "trigger": "new_join_request"
-    }, room_id)
+    # Notify Owner via WS (the room, and the owner wherever they are)
+    await broadcast_delta(room_id, version, "pending_added", member=new_member)
+    await notify_user(room["ownerId"], "join_request", roomId=room_id, roomName=room["name"], member=new_member)
     
     return {"message": "Join request sent", "status": "pending"}
 
@@ -225,8 +738,8 @@ async def approve_member(room_id: str, member_id: str, current_user: TokenData =
          raise HTTPException(status_code=403, detail="Only owner can approve")
          
     # Find pending request
-    pending = next((p for p in room.get("pendingRequests", []) if p["userId"] == member_id), None)
-    if not pending:
+    pending = await get_member(db, room, member_id)
+    if not pending or pending.get("status") != "pending":
         raise HTTPException(status_code=404, detail="Request not found")
         
     # Move to Member
@@ -237,13 +750,18 @@ async def approve_member(room_id: str, member_id: str, current_user: TokenData =
         "joinedAt": datetime.datetime.utcnow().isoformat()
     }
     
-    await db.focus_rooms.update_one(
-        {"_id": ObjectId(room_id)},
-        {
+    if is_large(room):
+        # Claim a seat first so concurrent approvals can't overfill the room
+        version = await update_room(db, room_id, {"$inc": {"memberCount": 1, "pendingCount": -1}},
+                                    {"memberCount": {"$lt": member_limit(room)}})
+        if version is None:
+            raise HTTPException(status_code=409, detail="Room is full")
+        await add_member_doc(db, room, member_data)
+    else:
+        version = await update_room(db, room_id, {
             "$pull": {"pendingRequests": {"userId": member_id}},
             "$push": {"members": member_data}
-        }
-    )
+        })
     
     # Broadcast Update - IMPORTANT for Lobby Auto-Join
     await manager.broadcast({
@@ -252,21 +770,39 @@ async def approve_member(room_id: str, member_id: str, current_user: TokenData =
         "roomName": room["name"]
     }, room_id)
     
-    await manager.broadcast({
-        "type": "room_update",
-        "trigger": "member_approved"
-    }, room_id)
+    await broadcast_delta(room_id, version, "member_added", member=member_data)
+    await notify_user(member_id, "member_approved", roomId=room_id, roomName=room["name"])
     
     return {"message": "Approved"}
 
+@router.get("/api/rooms/{room_id}/members", response_model=RoomMembersPage)
+async def get_room_members(room_id: str, pending: bool = False, after: Optional[str] = None,
+                           limit: int = ROOM_MEMBERS_PAGE_SIZE, current_user: TokenData = Depends(get_current_user)):
+    """Members (or, for the owner, join requests) a page at a time"""
+    db = get_database()
+    room = await db.focus_rooms.find_one({"_id": ObjectId(room_id)})
+    if not room:
+        raise HTTPException(status_code=404, detail="Room not found")
+    if pending:
+        user = await db.users.find_one({"email": current_user.email}, {"_id": 1})
+        if room["ownerId"] != str(user["_id"]):
+            raise HTTPException(status_code=403, detail="Only owner can see join requests")
+    members, next_cursor = await list_members(db, room, pending, after, max(1, min(limit, 200)))
+    total = (room.get("pendingCount", 0) if is_large(room) else len(room.get("pendingRequests", []))) \
+        if pending else member_count(room)
+    return {"members": members, "next": next_cursor, "total": total}
+
 # --- IN-ROOM FEATURES ---
 
 @router.get("/api/rooms/{room_id}/chat", response_model=List[ChatMessage])
-async def get_room_chat(room_id: str, current_user: TokenData = Depends(get_current_user)):
+async def get_room_chat(room_id: str, before: Optional[str] = None, limit: int = ROOM_CHAT_PAGE_SIZE,
+                        current_user: TokenData = Depends(get_current_user)):
+    """A page of chat, oldest first: the latest messages, or those before message id `before`"""
     db = get_database()
-    room = await db.focus_rooms.find_one({"_id": ObjectId(room_id)})
+    room = await db.focus_rooms.find_one({"_id": ObjectId(room_id)}, {"chatHistory": 1})
     if not room: return []
-    return room.get("chatHistory", [])
+    return chat_page(room.get("chatHistory", []) + get_chat_writer().pending_for(room_id), before,
+                     max(1, min(limit, 200)))
 
 @router.get("/api/rooms/{room_id}/tasks", response_model=List[RoomTask])
 async def get_room_tasks(room_id: str, current_user: TokenData = Depends(get_current_user)):
@@ -288,15 +824,11 @@ async def create_room_task(room_id: str, task: SharedTaskCreate, current_user: T
         "createdAt": datetime.datetime.utcnow().isoformat()
     }
     
-    await db.focus_rooms.update_one(
-        {"_id": ObjectId(room_id)},
-        {"$push": {"tasks": new_task}}
-    )
+    version = await update_room(db, room_id, {"$push": {"tasks": new_task}})
+    if version is None:
+        raise HTTPException(status_code=404, detail="Room not found")
     
-    await manager.broadcast({
-        "type": "new_task",
-        "task": new_task
-    }, room_id)
+    await broadcast_delta(room_id, version, "task_added", task=new_task)
     
     return new_task
 
@@ -311,17 +843,13 @@ async def update_room_task(room_id: str, task_id: str, update: TaskUpdate, curre
     if not update_fields:
         return {"message": "No updates"}
         
-    await db.focus_rooms.update_one(
-        {"_id": ObjectId(room_id), "tasks.id": task_id},
-        {"$set": update_fields}
-    )
+    version = await update_room(db, room_id, {"$set": update_fields}, {"tasks.id": task_id})
+    if version is None:
+        raise HTTPException(status_code=404, detail="Task not found")
     
     # Broadcast update
-    await manager.broadcast({
-        "type": "task_updated",
-        "taskId": task_id,
-        "updates": update.dict(exclude_unset=True)
-    }, room_id)
+    await broadcast_delta(room_id, version, "task_updated", taskId=task_id,
+                          updates=update.dict(exclude_unset=True))
     
     return {"message": "Updated"}
 
@@ -348,7 +876,10 @@ async def update_timer_state(room_id: str, action: str, duration: Optional[int]
     if action == "start":
         updates["timerStatus"] = "running"
         updates["timerDuration"] = duration or room.get("timerDuration", 25)
+        # Resuming: what already ran before the pause still counts towards the credit
+        updates["timerElapsedMinutes"] = room.get("timerElapsedMinutes", 0) if room.get("timerStatus") == "paused" else 0
         updates["timerStartTime"] = datetime.datetime.utcnow().isoformat()
+        updates["timerRunId"] = new_run_id()
         broadcast_msg.update({
              "status": "running", 
              "startTime": updates["timerStartTime"], 
@@ -358,6 +889,7 @@ async def update_timer_state(room_id: str, action: str, duration: Optional[int]
     elif action == "stop" or action == "reset":
         updates["timerStatus"] = "stopped"
         updates["timerStartTime"] = None
+        updates["timerElapsedMinutes"] = 0
         # Maybe don't reset duration
         broadcast_msg.update({"status": "stopped", "startTime": None})
         
@@ -375,11 +907,19 @@ async def update_timer_state(room_id: str, action: str, duration: Optional[int]
              elapsed = (datetime.datetime.utcnow() - start_time).total_seconds() / 60
              remaining = max(0, int(room.get("timerDuration", 25) - elapsed))
              updates["timerDuration"] = remaining # Update duration to remaining
+             updates["timerElapsedMinutes"] = room.get("timerElapsedMinutes", 0) + min(elapsed, room.get("timerDuration", 25))
              updates["timerStartTime"] = None
          broadcast_msg.update({"status": "paused", "duration": updates.get("timerDuration")})
 
     if updates:
-        await db.focus_rooms.update_one({"_id": ObjectId(room_id)}, {"$set": updates})
+        broadcast_msg["version"] = await update_room(db, room_id, {"$set": updates})
+        # The server ends the timer and credits the room; other workers pick it up on their next sync
+        if updates["timerStatus"] == "running":
+            get_room_timers().schedule(room_id, updates["timerRunId"],
+                                       timer_ends_at(updates["timerStartTime"], updates["timerDuration"]),
+                                       timer_credit(updates["timerDuration"], updates["timerElapsedMinutes"]))
+        else:
+            get_room_timers().cancel(room_id)
         await manager.broadcast(broadcast_msg, room_id)
         
     return {"status": "updated"}
@@ -387,55 +927,182 @@ async def update_timer_state(room_id: str, action: str, duration: Optional[int]
 
 # --- WEBSOCKET HANDLER ---
 
+async def authenticate_socket(db, token: Optional[str], room_id: str):
+    """(user id, name, role, close code, large room) for a room socket; role is None when it isn't allowed in"""
+    token_data = decode_access_token(token)
+    user = await db.users.find_one({"email": token_data.email}, {"name": 1}) if token_data else None
+    if not user:
+        return None, None, None, WS_CLOSE_UNAUTHORIZED, False
+    user_id, name = str(user["_id"]), user.get("name")
+    room = await db.focus_rooms.find_one(
+        {"_id": ObjectId(room_id)} if ObjectId.is_valid(room_id) else {"_id": None},
+        {"ownerId": 1, "mode": 1, "members.userId": 1, "members.status": 1, "pendingRequests.userId": 1,
+         "blockedUsers": 1}
+    )
+    if not room:
+        return user_id, name, None, WS_CLOSE_FORBIDDEN, False
+    role = None
+    if user_id not in [str(uid) for uid in room.get("blockedUsers") or []]:
+        entry = await get_member(db, room, user_id)
+        if str(room.get("ownerId")) == user_id:
+            role = "owner"
+        elif entry and entry.get("status") != "pending":
+            # Pending users hear about approval on /api/ws/user, not from the room
+            role = "member"
+    return user_id, name, role, WS_CLOSE_FORBIDDEN, is_large(room)
+
+
+async def handle_frame(db, room_id: str, message: dict):
+    """Act on one admitted frame from a room member"""
+    # Enrich with Server Time
+    message["timestamp"] = datetime.datetime.utcnow().isoformat()
+    
+    # PERSISTENCE HANDLERS based on type
+    if message["type"] == "chat_message":
+         new_msg = {
+            "id": message.get("id"),
+            "userId": message.get("userId"),
+            "userName": message.get("userName"),
+            "content": message.get("content"),
+            "timestamp": message["timestamp"]
+         }
+         # Broadcast back to room first; persistence is write-behind
+         await manager.broadcast(message, room_id)
+         await get_chat_writer().add(db, room_id, new_msg)
+    
+    elif message["type"] == "timer_start":
+        # Handle client-initiated timer (legacy/fallback)
+        # It's better to use the HTTP endpoint for source of truth, but if frontend sends this:
+        run_id = new_run_id()
+        message["version"] = await update_room(db, room_id, {"$set": {
+            "timerStatus": "running",
+            "timerDuration": message.get("duration", 25),
+            "timerStartTime": message["timestamp"],
+            "timerRunId": run_id,
+            "timerElapsedMinutes": 0
+        }})
+        get_room_timers().schedule(room_id, run_id, timer_ends_at(message["timestamp"], message.get("duration", 25)),
+                                   message.get("duration", 25))
+        await manager.broadcast(message, room_id)
+        
+    else:
+         # Generic broadcast for other events
+         await manager.broadcast(message, room_id)
+
+
+async def flush_deferred(db, room_id: str, connection: RoomConnection):
+    """Send a connection's coalesced frames as its (and the room's) budget allows"""
+    while connection.deferred and not connection.closed:
+        await asyncio.sleep(max(manager.wait_time(connection, room_id, connection.deferred), 0.05))
+        for frame_type, message in list(connection.deferred.items()):
+            if manager.admit(connection, room_id, frame_category(frame_type)) is None:
+                del connection.deferred[frame_type]
+                await handle_frame(db, room_id, message)
+
+
 @router.websocket("/api/ws/room/{room_id}")
 async def websocket_endpoint(websocket: WebSocket, room_id: str):
-    await manager.connect(websocket, room_id)
+    # Authenticated once here; after that every frame is checked against what's cached on
+    # the connection, with no DB lookups
     db = get_database()
+    params = websocket.query_params
+    user_id, user_name, role, refusal, large = await authenticate_socket(db, params.get("token"), room_id)
+    if role is None:
+        manager.metrics["rejected"] += 1
+        await websocket.accept()
+        await websocket.close(code=refusal)
+        return
+    last_seq = params.get("last_seq")
+    connection = await manager.connect(websocket, room_id, user_id, user_name, role,
+                                       int(last_seq) if last_seq and last_seq.isdigit() else None,
+                                       params.get("stream"), large)
+    flusher: Optional[asyncio.Task] = None
     
     try:
-        while True:
+        while not connection.closed:
             data = await websocket.receive_text()
-            message = json.loads(data)
-            
-            # Enrich with Server Time
-            message["timestamp"] = datetime.datetime.utcnow().isoformat()
-            
-            # PERSISTENCE HANDLERS based on type
-            if message["type"] == "chat_message":
-                 new_msg = {
-                    "id": message.get("id"),
-                    "userId": message.get("userId"),
-                    "userName": message.get("userName"),
-                    "content": message.get("content"),
-                    "timestamp": message["timestamp"]
-                 }
-                 await db.focus_rooms.update_one(
-                     {"_id": ObjectId(room_id)},
-                     {"$push": {"chatHistory": new_msg}}
-                 )
-                 # Broadcast back to room
-                 await manager.broadcast(message, room_id)
+            connection.last_seen = time.monotonic()
+            # Before parsing, so a flood costs as little as possible
+            if not connection.limits["frames"].take():
+                manager.metrics["limited_frames"] += 1
+                manager.strike(connection)
+                continue
+            try:
+                message = parse_frame(data).model_dump()
+            except (ValueError, ValidationError) as e:
+                # Tell the sender only; a bad frame isn't worth dropping the socket for
+                detail = e.errors(include_url=False, include_input=False) if isinstance(e, ValidationError) else str(e)
+                connection.send("error", encode_frame({"type": "error", "detail": detail}))
+                continue
             
-            elif message["type"] == "timer_start":
-                # Handle client-initiated timer (legacy/fallback)
-                # It's better to use the HTTP endpoint for source of truth, but if frontend sends this:
-                await db.focus_rooms.update_one(
-                     {"_id": ObjectId(room_id)},
-                     {"$set": {
-                         "timerStatus": "running",
-                         "timerDuration": message.get("duration", 25),
-                         "timerStartTime": datetime.datetime.utcnow().isoformat()
-                     }}
-                 )
-                await manager.broadcast(message, room_id)
-                
-            else:
-                 # Generic broadcast for other events
-                 await manager.broadcast(message, room_id)
+            if message["type"] == "pong":
+                continue  # liveness only, already noted above
+            if connection.role not in ("owner", "member"):
+                continue  # removed from the room; the socket is closing
+            message.pop("version", None)  # only the server versions room state
+            # Whatever the client claims, it's this user speaking
+            message["userId"], message["userName"] = connection.user_id, connection.user_name
+
+            category = frame_category(message["type"])
+            limited_by = manager.admit(connection, room_id, category)
+            if limited_by:
+                manager.metrics[f"limited_{category}"] += 1
+                if limited_by == "connection":
+                    manager.strike(connection)
+                if category == "chat":
+                    # Chat can't be merged; the sender is told it didn't go out
+                    connection.send("rate_limited", encode_frame({
+                        "type": "rate_limited", "category": category, "id": message.get("id"),
+                        "retryAfter": round(manager.wait_time(connection, room_id, {message["type"]: message}), 1),
+                    }))
+                else:
+                    # Only the latest of each type is kept and sent when there's budget again
+                    if message["type"] in connection.deferred:
+                        manager.metrics["coalesced_inbound"] += 1
+                    connection.deferred[message["type"]] = message
+                    if flusher is None or flusher.done():
+                        flusher = asyncio.create_task(flush_deferred(db, room_id, connection))
+                continue
+
+            await handle_frame(db, room_id, message)
                  
     except WebSocketDisconnect:
-        manager.disconnect(websocket, room_id)
-        await manager.broadcast({"type": "user_left", "userId": "unknown"}, room_id)
+        pass
+    finally:
+        if flusher:
+            flusher.cancel()
+        # Also reached when we closed the socket ourselves (e.g. a client too slow to keep up)
+        await manager.leave(connection, room_id)
+
+
+@router.websocket("/api/ws/user")
+async def user_websocket_endpoint(websocket: WebSocket):
+    """Notifications for the signed-in user wherever they are in the app; server to client only"""
+    db = get_database()
+    params = websocket.query_params
+    token_data = decode_access_token(params.get("token"))
+    user = await db.users.find_one({"email": token_data.email}, {"name": 1}) if token_data else None
+    if not user:
+        user_sockets.metrics["rejected"] += 1
+        await websocket.accept()
+        await websocket.close(code=WS_CLOSE_UNAUTHORIZED)
+        return
+    last_seq = params.get("last_seq")
+    connection = await user_sockets.connect(websocket, str(user["_id"]), user.get("name"),
+                                            int(last_seq) if last_seq and last_seq.isdigit() else None,
+                                            params.get("stream"))
+    try:
+        while not connection.closed:
+            await websocket.receive_text()
+            connection.last_seen = time.monotonic()
+            # Nothing to act on (pongs, mostly), but a flood still costs us
+            if not connection.limits["frames"].take() and not connection.strikes.take():
+                user_sockets.metrics["rate_disconnects"] += 1
+                connection.close(WS_CLOSE_POLICY)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        user_sockets.leave(connection)
 
 
 # --- HEATMAP & SESSION LOGGING ---
@@ -458,52 +1125,9 @@ async def log_room_session(room_id: str, log_data: RoomSessionLog, current_user:
     if duration <= 0:
         return {"message": "Duration too short to log"}
 
-    # Credit ALL active users
-    # activeUsers is a list of dicts: [{userId: "...", ...}]
-    active_users = room.get("activeUsers", [])
-    
-    today = datetime.datetime.utcnow().date().isoformat()
-    count = 0
-    
-    for active_u in active_users:
-        uid = active_u.get("userId")
-        if not uid:
-            continue
-            
-        # Update User Stats
-        await db.users.update_one(
-             {"_id": ObjectId(uid)},
-             {
-                 "$inc": {"totalFocusMinutes": duration},
-                 "$set": {"lastFocusDate": datetime.datetime.utcnow().isoformat()}
-             }
-        )
-        
-        # Update Heatmap
-        # Default category for Room sessions: "Study"
-        task_type = "Study" 
-        
-        existing_heatmap = await db.heatmap_entries.find_one({"userId": uid, "date": today})
-        
-        if existing_heatmap:
-            category_breakdown = existing_heatmap.get("categoryBreakdown", {})
-            category_breakdown[task_type] = category_breakdown.get(task_type, 0) + duration
-            
-            await db.heatmap_entries.update_one(
-                {"userId": uid, "date": today},
-                {
-                    "$inc": {"totalMinutes": duration},
-                    "$set": {"categoryBreakdown": category_breakdown}
-                }
-            )
-        else:
-            await db.heatmap_entries.insert_one({
-                "userId": uid,
-                "date": today,
-                "totalMinutes": duration,
-                "categoryBreakdown": {task_type: duration}
-            })
-        count += 1
+    # Credit everyone connected to the room right now (on any worker)
+    active_users = await get_active_users(db, room_id)
+    count = await credit_room_session(db, [u.get("userId") for u in active_users], duration)
             
     return {"message": f"Logged {duration} minutes for {count} users"}
 
@@ -515,16 +1139,16 @@ async def kick_member(room_id: str, member_id: str, current_user: TokenData = De
     if not room or room["ownerId"] != str(user["_id"]):
         raise HTTPException(status_code=403, detail="Not authorized")
 
-    await db.focus_rooms.update_one(
-        {"_id": ObjectId(room_id)},
-        {"$pull": {"members": {"userId": member_id}}}
-    )
+    if is_large(room):
+        removed = await db.room_members.delete_one({"roomId": room_id, "userId": member_id, "status": "member"})
+        if not removed.deleted_count:
+            raise HTTPException(status_code=404, detail="Member not found")
+        version = await update_room(db, room_id, {"$inc": {"memberCount": -1}})
+    else:
+        version = await update_room(db, room_id, {"$pull": {"members": {"userId": member_id}}})
     
-    await manager.broadcast({
-        "type": "room_update",
-        "trigger": "kick",
-        "kickedUserId": member_id
-    }, room_id)
+    await broadcast_delta(room_id, version, "member_removed", userId=member_id, reason="kick", status="member")
+    await notify_user(member_id, "removed_from_room", roomId=room_id, roomName=room["name"], reason="kick")
     return {"message": "Member kicked"}
 
 @router.post("/api/rooms/{room_id}/block")
@@ -536,19 +1160,24 @@ async def block_member(room_id: str, member_id: str, current_user: TokenData = D
         raise HTTPException(status_code=403, detail="Not authorized")
 
     # Kick member AND Add to blockedUsers
-    await db.focus_rooms.update_one(
-        {"_id": ObjectId(room_id)},
-        {
+    if is_large(room):
+        removed = await db.room_members.find_one_and_delete({"roomId": room_id, "userId": member_id,
+                                                             "status": {"$in": ["member", "pending"]}})
+        status = removed["status"] if removed else None
+        counts = {"pendingCount" if status == "pending" else "memberCount": -1} if status else {}
+        version = await update_room(db, room_id, {"$addToSet": {"blockedUsers": member_id},
+                                                  **({"$inc": counts} if counts else {})})
+    else:
+        entry = await get_member(db, room, member_id)
+        status = entry.get("status") if entry else None
+        version = await update_room(db, room_id, {
             "$pull": {"members": {"userId": member_id}, "pendingRequests": {"userId": member_id}},
             "$addToSet": {"blockedUsers": member_id}
-        }
-    )
+        })
 
-    await manager.broadcast({
-        "type": "room_update",
-        "trigger": "block",
-        "blockedUserId": member_id
-    }, room_id)
+    # status: what they were (member/pending), so clients can keep counts right
+    await broadcast_delta(room_id, version, "member_removed", userId=member_id, reason="block", status=status)
+    await notify_user(member_id, "removed_from_room", roomId=room_id, roomName=room["name"], reason="block")
     return {"message": "Member blocked"}
 
 @router.post("/api/rooms/{room_id}/unblock")
@@ -559,8 +1188,6 @@ async def unblock_member(room_id: str, member_id: str, current_user: TokenData =
     if not room or room["ownerId"] != str(user["_id"]):
         raise HTTPException(status_code=403, detail="Not authorized")
 
-    await db.focus_rooms.update_one(
-        {"_id": ObjectId(room_id)},
-        {"$pull": {"blockedUsers": member_id}}
-    )
+    version = await update_room(db, room_id, {"$pull": {"blockedUsers": member_id}})
+    await broadcast_delta(room_id, version, "member_unblocked", userId=member_id)
     return {"message": "Member unblocked"}
@@ -1,9 +1,11 @@
 from fastapi import FastAPI, HTTPException, Depends, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from contextlib import asynccontextmanager
 from datetime import datetime, timedelta, timezone
 from typing import List, Dict, Optional
 import json
+import asyncio
 import bcrypt
 # Monkey patch bcrypt for passlib compatibility
 if not hasattr(bcrypt, '__about__'):
@@ -16,15 +18,49 @@ if not hasattr(bcrypt, '__about__'):
 
 from database import connect_to_mongo, close_mongo_connection, get_database
 from models import *
-from auth import get_password_hash, verify_password, create_access_token, get_current_user, get_optional_current_user
+from auth import get_password_hash, verify_password, create_access_token, get_current_user, get_optional_current_user, require_metrics_token
 from insights_service import InsightsService
+from ai_providers import init_provider_registry, get_provider_registry
+from insights_scheduler import get_scheduler, INSIGHTS_PRECOMPUTE_ENABLED
+from recommendations_batch import get_recommendations_batch
+from compute_pool import shutdown_pool, metrics as compute_pool_metrics
+from rollups import (
+    get_rollups, record_session_start, record_session_complete, ensure_backfilled, backfill_pending,
+    ROLLUP_BACKFILL_ON_STARTUP
+)
+import llm_usage
+from backplane import get_backplane
+from chat_writer import get_chat_writer
+from presence import get_presence
+from room_timers import get_room_timers
+from notifications import notify_user
 
 active_connections: Dict[str, List[WebSocket]] = {}
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await connect_to_mongo()
+    init_provider_registry()
+    await get_backplane().start(get_database())
+    get_chat_writer().start(get_database())
+    get_presence().start(get_database())
+    rooms_manager.start()
+    user_sockets.start()
+    get_room_timers().start(get_database())
+    if INSIGHTS_PRECOMPUTE_ENABLED:
+        get_scheduler(get_database()).start()
+    rollup_backfill = asyncio.create_task(backfill_pending(get_database())) if ROLLUP_BACKFILL_ON_STARTUP else None
     yield
+    if rollup_backfill:
+        rollup_backfill.cancel()
+    await get_scheduler(get_database()).stop()
+    await get_room_timers().stop()
+    await get_backplane().stop()
+    await get_chat_writer().stop()
+    await rooms_manager.stop()
+    await user_sockets.stop()
+    await get_presence().stop()
+    shutdown_pool()
     await close_mongo_connection()
 
 app = FastAPI(lifespan=lifespan)
@@ -42,6 +78,23 @@ app.add_middleware(
 async def health():
     return {"status": "healthy"}
 
+@app.get("/api/metrics", dependencies=[Depends(require_metrics_token)])
+async def metrics():
+    """Operational counters for this worker (Authorization: Bearer $METRICS_TOKEN)"""
+    return {
+        "ai_providers": get_provider_registry().snapshot(),
+        "insights_precompute": get_scheduler(get_database()).metrics,
+        "compute_pool": compute_pool_metrics,
+        "recommendations_batch": get_recommendations_batch(get_database()).metrics,
+        "llm_usage": llm_usage.metrics,
+        "ws_backplane": get_backplane().metrics,
+        "room_sockets": rooms_manager.snapshot(),
+        "user_sockets": user_sockets.snapshot(),
+        "room_chat_writer": get_chat_writer().metrics,
+        "room_presence": get_presence().metrics,
+        "room_timers": get_room_timers().metrics
+    }
+
 @app.post("/api/auth/register", response_model=Token)
 async def register(user_data: UserCreate):
     db = get_database()
@@ -64,6 +117,7 @@ async def register(user_data: UserCreate):
         "streakCount": 0,
         "totalFocusMinutes": 0,
         "lastFocusDate": None,
+        "rollupsBackfilled": True, # no sessions before rollups to backfill
         "createdAt": datetime.now(timezone.utc).isoformat()
     }
     
@@ -127,6 +181,8 @@ async def create_task(task_data: TaskCreate, current_user: TokenData = Depends(g
     result = await db.tasks.insert_one(task_dict)
     task_dict["id"] = str(result.inserted_id)
     
+    await InsightsService(db).invalidate(str(user["_id"]), "tasks", "task_status")
+    
     return TaskResponse(**task_dict)
 
 @app.get("/api/tasks", response_model=List[TaskResponse])
@@ -207,6 +263,8 @@ async def follow_user(username: str, current_user: TokenData = Depends(get_curre
         # Follow
         await db.users.update_one({"_id": currentUserDoc["_id"]}, {"$addToSet": {"following": target_user_id}})
         await db.users.update_one({"_id": target_user["_id"]}, {"$addToSet": {"followers": current_user_id}})
+        await notify_user(target_user_id, "new_follower", userId=current_user_id,
+                          name=currentUserDoc.get("name"), username=currentUserDoc.get("username"))
         return {"message": "Followed"}
 
 @app.get("/api/users/{username}/followers", response_model=List[Dict])
@@ -273,61 +331,23 @@ async def get_public_profile(username: str, current_user: Optional[TokenData] =
         if currentUserDoc:
             is_following = user_id in currentUserDoc.get("following", [])
 
-    # 1. Fetch all session logs for stats
-    # Assuming logs are stored in 'focus_sessions' or aggregated in user. 
-    # Actually, previous implementation might store logs in 'tasks' or separate collection.
-    # Checking models... 'FocusSessionResponse'.
-    
-    # Let's aggregate from 'focus_sessions' if it exists, or just use User totals for MVP if granular data isn't easily queryable.
-    # However, user requested "Today's Focus", "This Week". User model only has 'totalFocusMinutes'.
-    # I need to fetch sessions.
-    
-    sessions = await db.focus_sessions.find({"userId": user_id}).to_list(10000)
-    
-    # Calculate Stats
+    # Today / this week / heatmap from the daily focus rollups (one small doc per active day)
     now = datetime.now(timezone.utc)
     today = now.date()
     start_of_week = today - timedelta(days=today.weekday()) # Monday
     
-    today_minutes = 0
-    week_minutes = 0
     total_minutes = user.get("totalFocusMinutes", 0)
     tag_counts = {}
-    heatmap_data = [] # Format: { date: "2024-01-01", count: 5 }
-    
-    # Helper to parse date
-    # Sessions might store 'startTime' as ISO string
-    
-    date_map = {}
     
-    for session in sessions:
-        try:
-            # Parse start time
-            s_time = datetime.fromisoformat(session["startTime"].replace("Z", "+00:00"))
-            s_date = s_time.date()
-            duration = session.get("duration", 0) # minutes
-            
-            # 1. Time Stats
-            if s_date == today:
-                today_minutes += duration
-            if s_date >= start_of_week:
-                week_minutes += duration
-            
-            # 2. Heatmap Data (Count = minutes or sessions? Usually intensity. Let's use minutes)
-            d_str = s_date.isoformat()
-            if d_str not in date_map: date_map[d_str] = 0
-            date_map[d_str] += duration
-
-            # 3. Tags (Need to fetch task to get tags? Session has taskId)
-            # Optimization: If session doesn't have tags, we might skip or do a $lookup.
-            # For MVP, if we don't have tags in session, we skip Top Tech for now or do a second query.
-            # Let's defer Top Tech to avoid N+1 query if session doesn't embed it.
-        except Exception: 
-            pass
-
-    # Convert map to list
-    for d, mins in date_map.items():
-        heatmap_data.append({"date": d, "count": mins})
+    # Users from before the rollups get theirs built here if the startup backfill hasn't yet
+    await ensure_backfilled(db, user)
+    rollups = await get_rollups(
+        db, user_id, now - timedelta(days=365), limit=366,
+        fields={"_id": 0, "date": 1, "totalMinutes": 1}
+    )
+    today_minutes = sum(r["totalMinutes"] for r in rollups if r["date"] == today.isoformat())
+    week_minutes = sum(r["totalMinutes"] for r in rollups if r["date"] >= start_of_week.isoformat())
+    heatmap_data = [{"date": r["date"], "count": r["totalMinutes"]} for r in rollups if r["totalMinutes"]]
 
     # Top Tech (Mock or fetch if feasible)
     # If we want real Top Tech, we need to aggregate tasks.
@@ -462,6 +482,9 @@ async def update_task(task_id: str, task_data: TaskUpdate, current_user: TokenDa
     if update_data:
         update_data["updatedAt"] = datetime.utcnow().isoformat()
         await db.tasks.update_one({"_id": ObjectId(task_id)}, {"$set": update_data})
+        
+        sources = ["tasks", "task_status"] if "status" in update_data else ["tasks"]
+        await InsightsService(db).invalidate(str(user["_id"]), *sources)
     
     updated_task = await db.tasks.find_one({"_id": ObjectId(task_id)})
     
@@ -490,6 +513,8 @@ async def delete_task(task_id: str, current_user: TokenData = Depends(get_curren
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Task not found")
     
+    await InsightsService(db).invalidate(str(user["_id"]), "tasks", "task_status")
+    
     return {"message": "Task deleted successfully"}
 
 @app.post("/api/focus-sessions", response_model=FocusSessionResponse)
@@ -514,6 +539,9 @@ async def start_focus_session(session_data: FocusSessionCreate, current_user: To
     result = await db.focus_sessions.insert_one(session_dict)
     session_dict["id"] = str(result.inserted_id)
     
+    await record_session_start(db, session_dict["userId"], session_dict["startTime"])
+    await InsightsService(db).invalidate(session_dict["userId"], "sessions")
+    
     return FocusSessionResponse(**session_dict)
 
 @app.patch("/api/focus-sessions/{session_id}/complete")
@@ -563,6 +591,8 @@ async def complete_focus_session(session_id: str, current_user: TokenData = Depe
             "categoryBreakdown": {task_type: session["duration"]}
         })
     
+    await record_session_complete(db, str(user["_id"]), session["startTime"], session["duration"], task_type)
+    
     last_focus_date = user.get("lastFocusDate")
     yesterday = (datetime.utcnow().date() - timedelta(days=1)).isoformat()
     
@@ -588,6 +618,9 @@ async def complete_focus_session(session_id: str, current_user: TokenData = Depe
             {"$inc": {"totalFocusMinutes": session["duration"]}}
         )
     
+    # New session, heatmap minutes and task focused time
+    await InsightsService(db).invalidate(str(user["_id"]), "sessions", "heatmap", "tasks")
+    
     return {"message": "Session completed successfully"}
 
 @app.get("/api/heatmap", response_model=List[HeatmapEntryResponse])
@@ -607,7 +640,7 @@ async def get_heatmap(current_user: TokenData = Depends(get_current_user)):
     ]
 
 # --- ROUTES ---
-from rooms_router import router as rooms_router
+from rooms_router import router as rooms_router, manager as rooms_manager, user_sockets
 app.include_router(rooms_router)
 
 @app.get("/api/insights")
@@ -624,26 +657,33 @@ async def get_insights(current_user: TokenData = Depends(get_current_user)):
         "monthly_insights": insights_data.get("monthly_insights", []),
         "burnout_detection": insights_data.get("burnout_detection"),
         "smart_plan": insights_data.get("smart_plan"),
-        "generated_at": insights_data.get("generated_at")
+        "generated_at": insights_data.get("generated_at"),
+        "refresh_job": insights_data.get("refresh_job")
     }
 
 @app.post("/api/insights/refresh")
 async def refresh_insights(current_user: TokenData = Depends(get_current_user)):
-    """Force refresh insights cache"""
+    """Start a background insights refresh and return its job handle"""
     db = get_database()
     user = await db.users.find_one({"email": current_user.email})
     
     insights_service = InsightsService(db)
-    insights_data = await insights_service.cache_insights(str(user["_id"]))
+    job = await insights_service.start_refresh(str(user["_id"]), full=True)
     
-    return {
-        "message": "Insights refreshed successfully",
-        "weekly_insights": insights_data.get("weekly_insights", []),
-        "monthly_insights": insights_data.get("monthly_insights", []),
-        "burnout_detection": insights_data.get("burnout_detection"),
-        "smart_plan": insights_data.get("smart_plan"),
-        "generated_at": insights_data.get("generated_at")
-    }
+    return {"message": "Insights refresh started", "job": job}
+
+@app.get("/api/insights/refresh/{job_id}")
+async def get_refresh_status(job_id: str, current_user: TokenData = Depends(get_current_user)):
+    """Poll a background insights refresh"""
+    db = get_database()
+    user = await db.users.find_one({"email": current_user.email})
+    
+    insights_service = InsightsService(db)
+    job = await insights_service.get_refresh_job(str(user["_id"]), job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Refresh job not found")
+    
+    return job
 
 @app.get("/api/insights/weekly")
 async def get_weekly_insights(current_user: TokenData = Depends(get_current_user)):
@@ -707,6 +747,32 @@ async def chat_with_ai(
     
     return {"response": response}
 
+@app.post("/api/insights/chat/stream")
+async def chat_with_ai_stream(
+    request: dict,
+    current_user: TokenData = Depends(get_current_user)
+):
+    """Streaming variant of /api/insights/chat (Server-Sent Events)"""
+    db = get_database()
+    user = await db.users.find_one({"email": current_user.email})
+    
+    message = request.get("message", "")
+    if not message:
+        raise HTTPException(status_code=400, detail="Message is required")
+    
+    insights_service = InsightsService(db)
+    
+    async def events():
+        async for text in insights_service.stream_chat_with_context(str(user["_id"]), message):
+            yield f"data: {json.dumps({'delta': text})}\n\n"
+        yield f"data: {json.dumps({'done': True})}\n\n"
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @app.get("/api/insights/daily-recommendations")
 async def get_daily_recommendations(current_user: TokenData = Depends(get_current_user)):
     """Get 5 daily AI-generated recommendations"""
@@ -718,6 +784,14 @@ async def get_daily_recommendations(current_user: TokenData = Depends(get_curren
     
     return {"recommendations": recommendations}
 
+@app.get("/api/insights/usage")
+async def get_ai_usage(current_user: TokenData = Depends(get_current_user)):
+    """Today's AI token usage and the daily budget"""
+    db = get_database()
+    user = await db.users.find_one({"email": current_user.email})
+    
+    return await llm_usage.get_user_usage(db, str(user["_id"]))
+
 
 @app.get("/api/history/tasks")
 async def get_task_history(current_user: TokenData = Depends(get_current_user)):
@@ -0,0 +1,84 @@
+import os
+import time
+from typing import Dict, Tuple
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Inbound rate limits for room sockets: token buckets per connection and per room (per
+# worker), with separate budgets for chat, timer and generic frames. "frames" on a
+# connection covers every frame, before it's even parsed.
+# Format: "category=rate per second:burst,..."; categories left out keep their defaults
+DEFAULT_CONNECTION_RATES = 'frames=20:40,chat=2:10,timer=0.5:3,generic=5:20'
+DEFAULT_ROOM_RATES = 'chat=20:60,timer=1:5,generic=30:90'
+# A connection may go over its own budget this many times a minute; past that it's closed
+WS_RATE_STRIKES_PER_MINUTE = float(os.environ.get('WS_RATE_STRIKES_PER_MINUTE', '30'))
+
+CATEGORIES = ("chat", "timer", "generic")
+
+
+def parse_rates(spec: str, defaults: str = "") -> Dict[str, Tuple[float, float]]:
+    """"chat=2:10,timer=0.5:3" -> {category: (tokens per second, burst)}, over `defaults`.
+
+    With defaults, a category they don't have is a ValueError (most likely a typo).
+    """
+    rates = parse_rates(defaults) if defaults else {}
+    for part in (spec or "").split(","):
+        if not part.strip():
+            continue
+        if "=" not in part:
+            raise ValueError(f"Bad rate {part.strip()!r}, expected category=rate:burst")
+        category, values = part.split("=", 1)
+        category = category.strip().lower()
+        if defaults and category not in rates:
+            raise ValueError(f"Unknown rate category {category!r} (expected one of {', '.join(rates)})")
+        rate, _, burst = values.partition(":")
+        rates[category] = (float(rate), float(burst or rate))
+    return rates
+
+
+WS_CONNECTION_RATES = parse_rates(os.environ.get('WS_CONNECTION_RATES', ''), DEFAULT_CONNECTION_RATES)
+WS_ROOM_RATES = parse_rates(os.environ.get('WS_ROOM_RATES', ''), DEFAULT_ROOM_RATES)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self) -> bool:
+        self._refill()
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def wait_time(self) -> float:
+        """Seconds until the next token"""
+        self._refill()
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate if self.rate > 0 else float("inf")
+
+
+def make_buckets(rates: Dict[str, Tuple[float, float]]) -> Dict[str, TokenBucket]:
+    return {category: TokenBucket(rate, burst) for category, (rate, burst) in rates.items()}
+
+
+def make_strikes() -> TokenBucket:
+    return TokenBucket(WS_RATE_STRIKES_PER_MINUTE / 60, WS_RATE_STRIKES_PER_MINUTE)
+
+
+def frame_category(frame_type: str) -> str:
+    if frame_type == "chat_message":
+        return "chat"
+    if frame_type.startswith("timer_"):
+        return "timer"
+    return "generic"
@@ -0,0 +1,58 @@
+import React, { createContext, useContext, useEffect, useRef, useCallback, useMemo } from 'react';
+import { toast } from 'sonner';
+import { useAuth } from './AuthContext';
+import { useUserNotifications } from '../hooks/useCustomHooks';
+
+const NotificationsContext = createContext(null);
+
+// Pages subscribe to the user's notification socket instead of polling for changes.
+// The handler sees every frame, including `session` (refetch on `resync`).
+export const useNotificationEvents = (handler) => {
+  const context = useContext(NotificationsContext);
+  if (!context) {
+    throw new Error('useNotificationEvents must be used within NotificationsProvider');
+  }
+  const handlerRef = useRef(handler);
+  handlerRef.current = handler;
+
+  useEffect(() => context.subscribe((msg) => handlerRef.current(msg)), [context]);
+  return { isConnected: context.isConnected };
+};
+
+export const NotificationsProvider = ({ children }) => {
+  const { user, token } = useAuth();
+  const { messages, isConnected } = useUserNotifications(user ? token : null);
+  const subscribers = useRef(new Set());
+  const processed = useRef(0);
+
+  const subscribe = useCallback((handler) => {
+    subscribers.current.add(handler);
+    return () => subscribers.current.delete(handler);
+  }, []);
+
+  useEffect(() => {
+    if (messages.length < processed.current) processed.current = 0;
+    messages.slice(processed.current).forEach((msg) => {
+      // Toast ids match the room page's, so the same event never shows twice
+      if (msg.type === 'join_request') {
+        toast(`${msg.member?.name || 'Someone'} wants to join ${msg.roomName}`);
+      } else if (msg.type === 'member_approved') {
+        toast.success(`You've been approved to join ${msg.roomName}!`, { id: `room-approved-${msg.roomId}` });
+      } else if (msg.type === 'removed_from_room') {
+        toast.error(`You have been removed from ${msg.roomName}.`, { id: `room-removed-${msg.roomId}` });
+      } else if (msg.type === 'new_follower') {
+        toast(`${msg.name || msg.username} started following you`);
+      }
+      subscribers.current.forEach((handler) => handler(msg));
+    });
+    processed.current = messages.length;
+  }, [messages]);
+
+  const value = useMemo(() => ({ subscribe, isConnected }), [subscribe, isConnected]);
+
+  return (
+    <NotificationsContext.Provider value={value}>
+      {children}
+    </NotificationsContext.Provider>
+  );
+};
@@ -1,44 +1,92 @@
 import { useState, useEffect, useRef } from 'react';
 
-export const useWebSocket = (roomId, token) => {
+// A resumable, authenticated socket to `path` (null to stay disconnected)
+const useSocket = (path, token) => {
   const [isConnected, setIsConnected] = useState(false);
   const [messages, setMessages] = useState([]);
   const wsRef = useRef(null);
+  // Where we are in the channel's event stream, so a reconnect only gets what we missed
+  const sessionRef = useRef({ stream: null, seq: null, seen: new Set() });
 
   const API_URL = process.env.REACT_APP_BACKEND_URL || 'http://localhost:8001';
   const WS_URL = API_URL.replace('http', 'ws');
 
   useEffect(() => {
-    if (!roomId || !token) return;
-
-    const ws = new WebSocket(`${WS_URL}/api/ws/room/${roomId}`);
-    wsRef.current = ws;
-
-    ws.onopen = () => {
-      setIsConnected(true);
-      console.log('WebSocket connected');
-    };
-
-    ws.onmessage = (event) => {
-      const message = JSON.parse(event.data);
-      setMessages((prev) => [...prev, message]);
-    };
-
-    ws.onerror = (error) => {
-      console.error('WebSocket error:', error);
+    if (!path || !token) return;
+
+    sessionRef.current = { stream: null, seq: null, seen: new Set() };
+    let retryTimer = null;
+    let attempts = 0;
+    let stopped = false;
+
+    const connect = () => {
+      const session = sessionRef.current;
+      // Browsers can't set headers on a WebSocket, so the token goes in the query
+      const params = new URLSearchParams({ token });
+      if (session.stream && session.seq !== null) {
+        params.set('stream', session.stream);
+        params.set('last_seq', session.seq);
+      }
+      const ws = new WebSocket(`${WS_URL}${path}?${params}`);
+      wsRef.current = ws;
+
+      ws.onopen = () => {
+        attempts = 0;
+        setIsConnected(true);
+        console.log('WebSocket connected');
+      };
+
+      ws.onmessage = (event) => {
+        const message = JSON.parse(event.data);
+        if (message.type === 'ping') {
+          // Server heartbeat; silence gets the socket closed
+          ws.send(JSON.stringify({ type: 'pong' }));
+          return;
+        }
+        if (message.type === 'session') {
+          session.stream = message.stream;
+          if (!message.resumed) {
+            session.seq = message.seq;
+            session.seen.clear();
+          }
+        } else if (message.seq !== undefined) {
+          // The session frame's seq is where the server is, not an event we've had; only
+          // replayed and live frames count. A replay can overlap what we already got live
+          if (session.seen.has(message.seq)) return;
+          session.seen.add(message.seq);
+          if (session.seen.size > 1000) session.seen.delete(session.seen.values().next().value);
+          session.seq = Math.max(session.seq ?? 0, message.seq);
+        }
+        setMessages((prev) => [...prev, message]);
+      };
+
+      ws.onerror = (error) => {
+        console.error('WebSocket error:', error);
+      };
+
+      ws.onclose = (event) => {
+        setIsConnected(false);
+        console.log('WebSocket disconnected');
+        // 4401/4403: bad token, or not (or no longer) allowed in
+        if (stopped || event.code === 4401 || event.code === 4403) return;
+        // Back off with jitter so a deploy doesn't bring every client back at once
+        const delay = Math.min(30000, 1000 * 2 ** attempts) * (0.5 + Math.random() / 2);
+        attempts += 1;
+        retryTimer = setTimeout(connect, delay);
+      };
     };
 
-    ws.onclose = () => {
-      setIsConnected(false);
-      console.log('WebSocket disconnected');
-    };
+    connect();
 
     return () => {
-      if (ws.readyState === WebSocket.OPEN) {
+      stopped = true;
+      clearTimeout(retryTimer);
+      const ws = wsRef.current;
+      if (ws && (ws.readyState === WebSocket.OPEN || ws.readyState === WebSocket.CONNECTING)) {
         ws.close();
       }
     };
-  }, [roomId, token]);
+  }, [path, token]);
 
   const sendMessage = (message) => {
     if (wsRef.current && wsRef.current.readyState === WebSocket.OPEN) {
@@ -49,6 +97,11 @@ export const useWebSocket = (roomId, token) => {
   return { isConnected, messages, sendMessage };
 };
 
+export const useWebSocket = (roomId, token) => useSocket(roomId ? `/api/ws/room/${roomId}` : null, token);
+
+// Join requests, approvals, kicks, follows and finished insights refreshes, wherever the user is
+export const useUserNotifications = (token) => useSocket('/api/ws/user', token);
+
 export const useNotification = () => {
   const [permission, setPermission] = useState(Notification.permission);
 
@@ -12,6 +12,50 @@ import { User, Lock, Plus, MessageSquare, CheckSquare, Clock, Users, Send, Play,
 import { motion, AnimatePresence } from 'framer-motion';
 import { DropdownMenu, DropdownMenuContent, DropdownMenuItem, DropdownMenuTrigger } from "@/components/ui/dropdown-menu";
 import { useWebSocket } from '../hooks/useCustomHooks';
+import { useNotificationEvents } from '../contexts/NotificationsContext';
+
+// Apply a room_delta from the server to our copy of the room
+const applyRoomDelta = (room, delta) => {
+  const withoutUser = (list) => (list || []).filter(m => m.userId !== delta.userId);
+  switch (delta.op) {
+    case 'pending_added':
+      return {
+        ...room,
+        pendingRequests: [...(room.pendingRequests || []), delta.member],
+        pendingCount: (room.pendingCount || 0) + 1,
+      };
+    case 'member_added':
+      return {
+        ...room,
+        members: [...(room.members || []), delta.member],
+        pendingRequests: (room.pendingRequests || []).filter(p => p.userId !== delta.member.userId),
+        memberCount: (room.memberCount || 0) + 1,
+        pendingCount: Math.max(0, (room.pendingCount || 0) - 1),
+      };
+    case 'member_removed':
+      return {
+        ...room,
+        members: withoutUser(room.members),
+        memberCount: Math.max(0, (room.memberCount || 0) - (delta.status === 'pending' ? 0 : 1)),
+        pendingCount: Math.max(0, (room.pendingCount || 0) - (delta.status === 'pending' ? 1 : 0)),
+        pendingRequests: delta.reason === 'block' ? withoutUser(room.pendingRequests) : room.pendingRequests,
+        blockedUsers: delta.reason === 'block'
+          ? [...(room.blockedUsers || []).filter(id => id !== delta.userId), delta.userId]
+          : room.blockedUsers,
+      };
+    case 'member_unblocked':
+      return { ...room, blockedUsers: (room.blockedUsers || []).filter(id => id !== delta.userId) };
+    case 'task_added':
+      return { ...room, tasks: [...(room.tasks || []), delta.task] };
+    case 'task_updated':
+      return {
+        ...room,
+        tasks: (room.tasks || []).map(t => (t.id === delta.taskId ? { ...t, ...delta.updates } : t)),
+      };
+    default:
+      return room;
+  }
+};
 
 export const FocusRooms = () => {
   const [rooms, setRooms] = useState([]);
@@ -29,6 +73,7 @@ export const FocusRooms = () => {
   // Form Inputs
   const [roomName, setRoomName] = useState('');
   const [roomDescription, setRoomDescription] = useState('');
+  const [largeRoom, setLargeRoom] = useState(false);
   const [roomPassword, setRoomPassword] = useState('');
   const [joinPassword, setJoinPassword] = useState('');
   const [searchQuery, setSearchQuery] = useState('');
@@ -36,6 +81,8 @@ export const FocusRooms = () => {
   // In-Room State
   const [timeLeft, setTimeLeft] = useState(0);
   const [timerStatus, setTimerStatus] = useState("stopped"); // stored locally for quick UI, synced via effect
+  const serverEndTime = useRef(null); // from the server's timer_tick, if we have one
+  const roomVersion = useRef({ roomId: null, version: 0 }); // version of the room state we hold
   const [chatMessage, setChatMessage] = useState('');
   const [newTaskTitle, setNewTaskTitle] = useState('');
   const chatScrollRef = useRef(null);
@@ -47,9 +94,10 @@ export const FocusRooms = () => {
   const token = localStorage.getItem('token');
   const API_URL = process.env.REACT_APP_BACKEND_URL || 'http://localhost:8000';
 
-  // Custom Hook for WS
+  // Custom Hook for WS (only once we're in the room; while pending, the approval comes
+  // through the user notification socket)
   const { messages, sendMessage, isConnected } = useWebSocket(
-    currentRoom?.roomId,
+    currentRoom?.status && currentRoom.status !== 'pending' ? currentRoom.roomId : null,
     token
   );
 
@@ -93,9 +141,30 @@ export const FocusRooms = () => {
     if (member) return 'member';
     const pending = room.pendingRequests?.find(p => String(p.userId) === uid);
     if (pending) return 'pending';
-    return null;
+    // Large rooms only send a page of members; the server tells us where we stand
+    return room.mode === 'large' ? (room.myStatus ?? null) : null;
   }, [user]);
 
+  // Put the countdown in line with the room's timer fields
+  const syncTimer = useCallback((room) => {
+    // UTC SAFE
+    if (room.timerStatus === 'running' && room.timerStartTime) {
+      // Add Z if missing to force UTC parsing in new Date()
+      const timeStr = room.timerStartTime.endsWith('Z') ? room.timerStartTime : room.timerStartTime + 'Z';
+      const start = new Date(timeStr).getTime();
+      // Force UTC now
+      const now = new Date().getTime();
+      const elapsedSecs = (now - start) / 1000;
+      const durationSecs = (room.timerDuration || 25) * 60;
+      const remaining = Math.max(0, durationSecs - elapsedSecs);
+      setTimeLeft(remaining);
+      setTimerStatus('running');
+    } else {
+      setTimeLeft((room.timerDuration || 25) * 60);
+      setTimerStatus(room.timerStatus || 'stopped');
+    }
+  }, []);
+
   const fetchRoomDetails = useCallback(async (roomId) => {
     try {
       // Use specific GET endpoint for fresh details
@@ -106,6 +175,9 @@ export const FocusRooms = () => {
       if (!res.ok) throw new Error("Failed to fetch room");
 
       const found = await res.json();
+      // A delta newer than this response may have landed while it was in flight
+      if (roomVersion.current.roomId === found.roomId && (found.version || 0) < roomVersion.current.version) return;
+      roomVersion.current = { roomId: found.roomId, version: found.version || 0 };
       const myStatus = getMyStatus(found);
 
       // Log for debugging
@@ -113,24 +185,49 @@ export const FocusRooms = () => {
 
       setCurrentRoom({ ...found, status: myStatus });
 
-      // Initial Timer Sync - UTC SAFE
-      if (found.timerStatus === 'running' && found.timerStartTime) {
-        // Add Z if missing to force UTC parsing in new Date()
-        const timeStr = found.timerStartTime.endsWith('Z') ? found.timerStartTime : found.timerStartTime + 'Z';
-        const start = new Date(timeStr).getTime();
-        // Force UTC now
-        const now = new Date().getTime();
-        const elapsedSecs = (now - start) / 1000;
-        const durationSecs = (found.timerDuration || 25) * 60;
-        const remaining = Math.max(0, durationSecs - elapsedSecs);
-        setTimeLeft(remaining);
-        setTimerStatus('running');
-      } else {
-        setTimeLeft((found.timerDuration || 25) * 60);
-        setTimerStatus(found.timerStatus || 'stopped');
-      }
+      // Initial Timer Sync
+      syncTimer(found);
     } catch (e) { console.error("Fetch Room Error", e); }
-  }, [API_URL, token, getMyStatus]);
+  }, [API_URL, token, getMyStatus, syncTimer]);
+
+  // Large rooms send the member list a page at a time
+  const loadMoreMembers = async () => {
+    if (!currentRoom?.membersCursor) return;
+    try {
+      const res = await fetch(`${API_URL}/api/rooms/${currentRoom.roomId}/members?after=${currentRoom.membersCursor}`, {
+        headers: { Authorization: `Bearer ${token}` }
+      });
+      if (!res.ok) throw new Error("Failed to fetch members");
+      const page = await res.json();
+      setCurrentRoom(prev => {
+        if (!prev || prev.roomId !== currentRoom.roomId) return prev;
+        const known = new Set((prev.members || []).map(m => m.userId));
+        return {
+          ...prev,
+          members: [...(prev.members || []), ...page.members.filter(m => !known.has(m.userId))],
+          membersCursor: page.next,
+        };
+      });
+    } catch (e) { console.error("Load Members Error", e); }
+  };
+
+  // Room details only carry the latest page of chat; older messages are fetched on demand
+  const CHAT_PAGE_SIZE = 50;
+  const loadEarlierChat = async () => {
+    const oldest = currentRoom?.chatHistory?.[0];
+    if (!oldest) return;
+    try {
+      const res = await fetch(`${API_URL}/api/rooms/${currentRoom.roomId}/chat?before=${encodeURIComponent(oldest.id)}`, {
+        headers: { Authorization: `Bearer ${token}` }
+      });
+      if (!res.ok) throw new Error("Failed to fetch chat");
+      const page = await res.json();
+      setCurrentRoom(prev => {
+        if (!prev || prev.roomId !== currentRoom.roomId) return prev;
+        return { ...prev, chatHistory: [...page, ...(prev.chatHistory || [])], chatComplete: page.length < CHAT_PAGE_SIZE };
+      });
+    } catch (e) { console.error("Load Chat Error", e); }
+  };
 
   // Fetch User & Rooms on Mount
   // Fetch User & Rooms on Mount
@@ -169,6 +266,21 @@ export const FocusRooms = () => {
 
   // --- ROOM SYNC & TIMER LOGIC ---
 
+  // Lobby: keep room cards (counts, my status) current from the user's notifications
+  // instead of refetching on a timer
+  useNotificationEvents((msg) => {
+    if (msg.type === 'session' && msg.resync) {
+      fetchRooms();
+    } else if (['join_request', 'member_approved', 'removed_from_room'].includes(msg.type)) {
+      fetchRooms();
+      // In case the room's own socket missed it (e.g. mid-reconnect)
+      if (currentRoom?.roomId === msg.roomId) {
+        if (msg.type === 'member_approved') fetchRoomDetails(msg.roomId);
+        if (msg.type === 'removed_from_room') setCurrentRoom(null);
+      }
+    }
+  });
+
   // Keep track of processed messages to avoid duplicates/loops
   const processedMessagesLen = useRef(0);
 
@@ -182,46 +294,107 @@ export const FocusRooms = () => {
       const newMessages = messages.slice(processedMessagesLen.current);
 
       newMessages.forEach(msg => {
+        // The server always versions its deltas; anything else isn't from the server
+        if (msg.type === 'room_delta' && (msg.version === undefined || msg.version === null)) return;
+
+        // Versioned room changes: apply the next one in line, skip ones we already have,
+        // refetch if we missed any
+        if (msg.version !== undefined && msg.version !== null) {
+          if (msg.version <= roomVersion.current.version) return;
+          if (msg.version > roomVersion.current.version + 1) {
+            if (currentRoom?.roomId) fetchRoomDetails(currentRoom.roomId);
+            return;
+          }
+          roomVersion.current = { ...roomVersion.current, version: msg.version };
+        }
+
+        // Reconnected but the server no longer has everything we missed
+        if (msg.type === 'session' && msg.resync) {
+          if (currentRoom?.roomId) fetchRoomDetails(currentRoom.roomId);
+          return;
+        }
+
+        // Our chat message was over the rate limit and wasn't sent
+        if (msg.type === 'rate_limited') {
+          toast.error(`You're sending messages too fast. Try again in ${Math.ceil(msg.retryAfter || 1)}s.`);
+          return;
+        }
+
         // 1. Handle Member Approval (Lobby -> Member)
         if (msg.type === 'member_approved') {
-          // If I am the one approved
+          // If I am the one approved; the member_added delta moves me in
           if (msg.userId === (user.id || user._id)) {
-            toast.success("You have been approved! Entering room...");
-            // We must re-fetch. Since status is dynamic based on list, fetching list is safe.
-            if (currentRoom?.roomId) fetchRoomDetails(currentRoom.roomId);
+            toast.success("You have been approved! Entering room...", { id: `room-approved-${currentRoom?.roomId}` });
           }
         }
 
-        // 2. Handle Room Updates (Join Requests for Admins, etc)
-        if (msg.type === 'room_update') {
+        // 2. Handle Room Changes (Join Requests for Admins, members, tasks)
+        if (msg.type === 'room_delta') {
           // Check for Kick/Block affecting ME
-          if ((msg.trigger === 'kick' && msg.kickedUserId === (user.id || user._id)) ||
-            (msg.trigger === 'block' && msg.blockedUserId === (user.id || user._id))) {
+          if (msg.op === 'member_removed' && msg.userId === (user.id || user._id)) {
             setCurrentRoom(null);
-            toast.error("You have been removed from the room.");
+            toast.error("You have been removed from the room.", { id: `room-removed-${currentRoom?.roomId}` });
             return;
           }
 
-          // Triggers when someone joins, leaves, or is approved.
-          // We need to re-fetch to update pendingRequests list or member list.
-          if (currentRoom?.roomId) fetchRoomDetails(currentRoom.roomId);
+          setCurrentRoom(prev => {
+            if (!prev) return prev;
+            const next = applyRoomDelta(prev, msg);
+            return { ...next, status: getMyStatus(next) };
+          });
         }
 
-        // 3. Handle Timer Updates
-        if (msg.type === 'timer_update') {
-          // Re-fetch to sync time logic (server is truth)
-          if (currentRoom?.roomId) fetchRoomDetails(currentRoom.roomId);
+        // Large rooms: just how many are online
+        if (msg.type === 'presence_count') {
+          setCurrentRoom(prev => (prev ? { ...prev, activeCount: msg.online } : prev));
         }
 
-        // 4. Handle Tasks
-        if (msg.type === 'task_updated' || msg.type === 'new_task') {
-          if (currentRoom?.roomId) fetchRoomDetails(currentRoom.roomId);
+        // Presence: who has the room open right now
+        if (msg.type === 'user_joined' || msg.type === 'user_left') {
+          setCurrentRoom(prev => {
+            if (!prev) return prev;
+            const others = (prev.activeUsers || []).filter(u => u.userId !== msg.userId);
+            return {
+              ...prev,
+              activeUsers: msg.type === 'user_joined' ? [...others, { userId: msg.userId, name: msg.name }] : others,
+            };
+          });
+        }
+
+        // 3. Handle Timer Updates
+        if (msg.type === 'timer_update' || msg.type === 'timer_start') {
+          const timer = {
+            ...currentRoom,
+            timerStatus: msg.status || 'running',
+            timerStartTime: msg.status === 'running' || msg.type === 'timer_start' ? (msg.startTime || msg.timestamp) : null,
+            timerDuration: msg.duration ?? currentRoom?.timerDuration,
+          };
+          setCurrentRoom(prev => (prev ? {
+            ...prev,
+            timerStatus: timer.timerStatus,
+            timerStartTime: timer.timerStartTime,
+            timerDuration: timer.timerDuration,
+          } : prev));
+          syncTimer(timer);
         }
+        if (msg.type === 'timer_tick') {
+          serverEndTime.current = Date.now() + msg.remainingSeconds * 1000;
+        }
+        if (msg.type === 'timer_complete') {
+          setTimerStatus('stopped');
+          setTimeLeft(0);
+          if ((msg.credited || []).includes(user.id || user._id)) {
+            toast.success(`Focus session complete! ${msg.duration} minutes added to your heatmap.`);
+          } else {
+            toast.success("Focus session complete!");
+          }
+        }
+
       });
 
       processedMessagesLen.current = newCount;
     }
-  }, [messages, currentRoom?.roomId, fetchRoomDetails, user.id, user._id]);
+  }, [messages, currentRoom, fetchRoomDetails, getMyStatus, syncTimer, user.id, user._id]);
 
 
   // Task Type Toggle State
@@ -304,19 +477,6 @@ export const FocusRooms = () => {
     }
   };
 
-  // Helper to log session
-  const logSession = useCallback(async (duration) => {
-    try {
-      if (!currentRoom?.roomId) return;
-      await fetch(`${API_URL}/api/rooms/${currentRoom.roomId}/log_session`, {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json', Authorization: `Bearer ${token}` },
-        body: JSON.stringify({ duration: Math.floor(duration) })
-      });
-      toast.success("Focus Session Logged & Heatmap Updated!");
-    } catch (e) { console.error("Logging failed", e); }
-  }, [API_URL, token, currentRoom?.roomId]);
-
   // Timer Actions (Admin)
   const controlTimer = useCallback(async (action, duration = 25) => {
     try {
@@ -329,8 +489,11 @@ export const FocusRooms = () => {
   }, [API_URL, token, currentRoom?.roomId]);
 
   // Timer Tick - Delta Logic
+  // The server ends the timer and credits the room; we only count down. Its timer_tick
+  // messages correct the end time for clock drift or a throttled background tab.
   useEffect(() => {
     let interval;
+    serverEndTime.current = null;
     if (timerStatus === 'running' && currentRoom?.timerStartTime) {
       // Calculate specific end time based on server start time + duration
       // Handle Z for UTC safety
@@ -344,20 +507,10 @@ export const FocusRooms = () => {
 
       const updateTimer = () => {
         const now = Date.now();
-        const diff = endTime - now;
+        const diff = (serverEndTime.current ?? endTime) - now;
         const remainingSeconds = Math.max(0, Math.ceil(diff / 1000));
 
         setTimeLeft(remainingSeconds);
-
-        if (remainingSeconds <= 0) {
-          // Timer Finished
-          if (currentRoom.status === 'admin') {
-            const duration = currentRoom.timerDuration || 25;
-            logSession(duration);
-            controlTimer('reset');
-          }
-          setTimerStatus('stopped');
-        }
       };
 
       // Run immediately then interval
@@ -365,7 +518,7 @@ export const FocusRooms = () => {
       interval = setInterval(updateTimer, 1000);
     }
     return () => clearInterval(interval);
-  }, [timerStatus, currentRoom?.timerStartTime, currentRoom?.timerDuration, currentRoom?.status, logSession, controlTimer]);
+  }, [timerStatus, currentRoom?.timerStartTime, currentRoom?.timerDuration]);
 
 
 
@@ -382,7 +535,8 @@ export const FocusRooms = () => {
         body: JSON.stringify({
           name: roomName,
           password: roomPassword,
-          description: roomDescription
+          description: roomDescription,
+          mode: largeRoom ? 'large' : 'standard'
         }),
       });
 
@@ -744,17 +898,19 @@ export const FocusRooms = () => {
               <div className="flex-1 flex flex-col min-h-0 min-w-[20rem]">
                 {/* Top Half: Participants */}
                 <div className="h-1/3 border-b flex flex-col">
-                  <div className="px-3 py-2 text-xs font-semibold text-muted-foreground bg-muted/30">Active Members ({currentRoom.members?.length})</div>
+                  <div className="px-3 py-2 text-xs font-semibold text-muted-foreground bg-muted/30">Active Members ({currentRoom.memberCount ?? currentRoom.members?.length}){currentRoom.mode === 'large' && ` · ${currentRoom.activeCount ?? 0} online`}</div>
                   <ScrollArea className="flex-1">
                     <div className="p-2 space-y-1">
                       {currentRoom.members?.map(m => {
                         const isMe = m.userId === (user.id || user._id);
                         const isRoomOwner = currentRoom.ownerId === m.userId;
+                        // Large rooms only know how many are online, not who
+                        const isOnline = isMe || currentRoom.activeUsers?.some(u => u.userId === m.userId);
                         return (
                           <div key={m.userId} className="flex items-center gap-2 p-2 rounded-md hover:bg-secondary/50 text-sm group">
                             <div className="w-7 h-7 rounded-sm bg-primary/10 flex items-center justify-center text-primary font-bold text-xs relative shrink-0">
                               {m.name.charAt(0)}
-                              <div className="absolute -bottom-0.5 -right-0.5 w-2.5 h-2.5 border-2 border-background bg-green-500 rounded-full"></div>
+                              <div className={`absolute -bottom-0.5 -right-0.5 w-2.5 h-2.5 border-2 border-background rounded-full ${isOnline ? 'bg-green-500' : 'bg-muted-foreground/40'}`}></div>
                             </div>
                             <div className="flex-1 overflow-hidden min-w-0">
                               <div className="flex items-center justify-between">
@@ -777,6 +933,9 @@ export const FocusRooms = () => {
                           </div>
                         )
                       })}
+                      {currentRoom.membersCursor && (
+                        <Button variant="ghost" size="sm" className="w-full text-xs" onClick={loadMoreMembers}>Load more</Button>
+                      )}
                     </div>
                   </ScrollArea>
                 </div>
@@ -786,6 +945,9 @@ export const FocusRooms = () => {
                   <div className="px-3 py-2 text-xs font-semibold text-muted-foreground bg-muted/30 flex items-center gap-2"><MessageSquare className="w-3 h-3" /> Room Chat</div>
 
                   <div ref={chatScrollRef} className="flex-1 overflow-y-auto p-3 space-y-3">
+                    {!currentRoom.chatComplete && (currentRoom.chatHistory?.length || 0) >= CHAT_PAGE_SIZE && (
+                      <Button variant="ghost" size="sm" className="w-full text-xs" onClick={loadEarlierChat}>Load earlier messages</Button>
+                    )}
                     {[...(currentRoom.chatHistory || []), ...messages.filter(m => m.type === 'chat_message').filter(m => !currentRoom.chatHistory?.find(c => c.id === m.id))].map(msg => {
                       const isMe = msg.userId === (user.id || user._id);
                       return (
@@ -835,6 +997,7 @@ export const FocusRooms = () => {
       <div className="grid grid-cols-1 md:grid-cols-2 lg:grid-cols-3 gap-6">
         {rooms.map(room => {
           const myStatus = getMyStatus(room);
+          const isFull = (room.memberCount ?? room.members?.length ?? 0) >= (room.memberLimit || 5);
           const expiry = new Date(room.expiresAt);
           const isExpired = new Date() > expiry;
           if (isExpired) return null; // Don't show expired rooms
@@ -853,10 +1016,10 @@ export const FocusRooms = () => {
                   <div className="flex items-center gap-2">
                     <div className="flex -space-x-2">
                       <div className="w-8 h-8 rounded-full bg-primary/20 flex items-center justify-center text-xs border-2 border-background">
-                        {room.members?.length || 0}
+                        {room.memberCount ?? room.members?.length ?? 0}
                       </div>
                     </div>
-                    <span className="text-xs text-muted-foreground font-medium">/ 5</span>
+                    <span className="text-xs text-muted-foreground font-medium">/ {room.memberLimit || 5}</span>
                   </div>
                   {myStatus === 'admin' || myStatus === 'member' ? (
                     <Button onClick={() => {
@@ -869,14 +1032,14 @@ export const FocusRooms = () => {
                     }}>View Lobby</Button>
                   ) : (
                     <Button
-                      variant={(room.members?.length || 0) >= 5 ? "secondary" : "outline"}
-                      disabled={(room.members?.length || 0) >= 5}
+                      variant={isFull ? "secondary" : "outline"}
+                      disabled={isFull}
                       onClick={() => {
                         setSelectedRoomToJoin(room);
                         setJoinDialogOpen(true);
                       }}
                     >
-                      {(room.members?.length || 0) >= 5 ? "Full" : "Join"}
+                      {isFull ? "Full" : "Join"}
                     </Button>
                   )}
                 </div>
@@ -894,6 +1057,10 @@ export const FocusRooms = () => {
             <div className="space-y-2"><Label>Name</Label><Input value={roomName} onChange={e => setRoomName(e.target.value)} required /></div>
             <div className="space-y-2"><Label>Description</Label><Input value={roomDescription} onChange={e => setRoomDescription(e.target.value)} /></div>
             <div className="space-y-2"><Label>Password</Label><Input type="password" value={roomPassword} onChange={e => setRoomPassword(e.target.value)} required /></div>
+            <label className="flex items-center gap-2 text-sm">
+              <input type="checkbox" checked={largeRoom} onChange={e => setLargeRoom(e.target.checked)} />
+              Study hall (large room, hundreds of members)
+            </label>
             <Button type="submit" className="w-full">Create (24h Limit)</Button>
           </form>
         </DialogContent>
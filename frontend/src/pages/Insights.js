@@ -1,5 +1,6 @@
 import React, { useState, useEffect, useRef, useCallback } from 'react';
 import { useAuth } from '../contexts/AuthContext';
+import { useNotificationEvents } from '../contexts/NotificationsContext';
 import { Button } from '../components/ui/button';
 import { Card, CardContent, CardHeader, CardTitle } from '../components/ui/card';
 import { Badge } from '../components/ui/badge';
@@ -80,6 +81,62 @@ export const Insights = ({ onNavigate, onStartFocus }) => {
     }
   }, [API_URL, token]);
 
+  const getRefreshJob = useCallback(async (jobId) => {
+    const response = await fetch(`${API_URL}/api/insights/refresh/${jobId}`, {
+      headers: { Authorization: `Bearer ${token}` },
+    });
+    return response.ok ? response.json() : null;
+  }, [API_URL, token]);
+
+  const waitForRefreshJob = useCallback(async (jobId) => {
+    // Fallback for when the notification socket is down: poll until it finishes (gives up after ~60s)
+    for (let attempt = 0; attempt < 40; attempt++) {
+      await new Promise((resolve) => setTimeout(resolve, 1500));
+      const job = await getRefreshJob(jobId);
+      if (!job) return false;
+      if (job.status === 'done') return true;
+      if (job.status === 'failed') return false;
+    }
+    return false;
+  }, [getRefreshJob]);
+
+  // The refresh we're waiting on, and jobs already reported finished (the notification
+  // can beat the POST's response)
+  const pendingJob = useRef(null);
+  const finishedJobs = useRef({});
+
+  const finishRefresh = useCallback(async (status) => {
+    pendingJob.current = null;
+    try {
+      if (status === 'done') {
+        await fetchInsights();
+        toast.success('Insights refreshed!');
+      } else {
+        toast.error('Failed to refresh insights');
+      }
+    } finally {
+      setRefreshing(false);
+    }
+  }, [fetchInsights]);
+
+  const { isConnected } = useNotificationEvents((msg) => {
+    if (msg.type === 'insights_ready') {
+      finishedJobs.current[msg.jobId] = msg.status;
+      if (msg.jobId === pendingJob.current) {
+        finishRefresh(msg.status);
+      } else if (!pendingJob.current && msg.status === 'done') {
+        fetchInsights(); // a background refresh (stale cache, precompute) finished
+      }
+    }
+    // Reconnected and may have missed it: ask once
+    if (msg.type === 'session' && msg.resync && pendingJob.current) {
+      const jobId = pendingJob.current;
+      getRefreshJob(jobId).then((job) => {
+        if (pendingJob.current === jobId && (job?.status === 'done' || job?.status === 'failed')) finishRefresh(job.status);
+      });
+    }
+  });
+
   const refreshInsights = async () => {
     setRefreshing(true);
     try {
@@ -88,18 +145,22 @@ export const Insights = ({ onNavigate, onStartFocus }) => {
         headers: { Authorization: `Bearer ${token}` },
       });
 
-      if (response.ok) {
-        const data = await response.json();
-        setWeeklyInsights(data.weekly_insights || []);
-        setMonthlyInsights(data.monthly_insights || []);
-        setBurnoutData(data.burnout_detection);
-        setSmartPlan(data.smart_plan);
-        setGeneratedAt(data.generated_at);
-        toast.success('Insights refreshed!');
+      if (!response.ok) {
+        setRefreshing(false);
+        return;
+      }
+      const jobId = (await response.json()).job?.jobId;
+      if (!jobId) {
+        finishRefresh('failed');
+      } else if (finishedJobs.current[jobId]) {
+        finishRefresh(finishedJobs.current[jobId]);
+      } else if (isConnected) {
+        pendingJob.current = jobId; // insights_ready finishes it
+      } else {
+        finishRefresh((await waitForRefreshJob(jobId)) ? 'done' : 'failed');
       }
     } catch (error) {
       toast.error('Failed to refresh insights');
-    } finally {
       setRefreshing(false);
     }
   };
@@ -160,7 +221,7 @@ export const Insights = ({ onNavigate, onStartFocus }) => {
     setChatLoading(true);
 
     try {
-      const response = await fetch(`${API_URL}/api/insights/chat`, {
+      const response = await fetch(`${API_URL}/api/insights/chat/stream`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -169,10 +230,35 @@ export const Insights = ({ onNavigate, onStartFocus }) => {
         body: JSON.stringify({ message: userMessage }),
       });
 
-      if (response.ok) {
-        const data = await response.json();
-        setChatMessages(prev => [...prev, { role: 'ai', content: data.response }]);
-        setTimeout(() => chatEndRef.current?.scrollIntoView({ behavior: 'smooth' }), 100);
+      if (response.ok && response.body) {
+        // Append streamed deltas to a single AI message as they arrive
+        setChatMessages(prev => [...prev, { role: 'ai', content: '' }]);
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+
+        while (true) {
+          const { value, done } = await reader.read();
+          if (done) break;
+          buffer += decoder.decode(value, { stream: true });
+
+          const events = buffer.split('\n\n');
+          buffer = events.pop();
+          for (const event of events) {
+            if (!event.startsWith('data:')) continue;
+            const payload = JSON.parse(event.slice(5));
+            if (payload.delta) {
+              setChatLoading(false);
+              setChatMessages(prev => {
+                const next = [...prev];
+                const last = next[next.length - 1];
+                next[next.length - 1] = { ...last, content: last.content + payload.delta };
+                return next;
+              });
+            }
+          }
+          chatEndRef.current?.scrollIntoView({ behavior: 'smooth' });
+        }
       } else {
         toast.error('Failed to get AI response');
       }
@@ -247,7 +333,7 @@ export const Insights = ({ onNavigate, onStartFocus }) => {
                   Start a conversation! Ask me about your productivity, focus habits, or tips for improvement.
                 </p>
               ) : (
-                chatMessages.map((msg, idx) => (
+                chatMessages.filter(msg => msg.content).map((msg, idx) => (
                   <div key={idx} className={`flex ${msg.role === 'user' ? 'justify-end' : 'justify-start'}`}>
                     <div
                       className={`max-w-[80%] rounded-lg px-4 py-2 ${msg.role === 'user'
@@ -440,7 +526,7 @@ export const Insights = ({ onNavigate, onStartFocus }) => {
                           {task.type}
                         </Badge>
                         <span className="text-xs text-muted-foreground">
-                          {task.estimatedTime}m
+                          {task.predictedTime || task.estimatedTime}m
                         </span>
                       </div>
                     </div>
@@ -458,6 +544,24 @@ export const Insights = ({ onNavigate, onStartFocus }) => {
               </div>
             )}
 
+            {/* Tasks the planner weighed but left out */}
+            {smartPlan.alternatives && smartPlan.alternatives.length > 0 && (
+              <div className="space-y-1">
+                <h4 className="text-sm font-semibold text-muted-foreground">
+                  Also considered ({smartPlan.tasks_considered} open tasks):
+                </h4>
+                {smartPlan.alternatives.slice(0, 3).map((task) => (
+                  <div key={task.id} className="flex items-center justify-between text-sm text-muted-foreground">
+                    <span className="truncate">{task.title}</span>
+                    <span className="text-xs">
+                      {task.excluded === 'scheduled_later' ? `scheduled ${task.scheduledDate}` :
+                        task.excluded === 'over_capacity' ? 'too long for today' : `${task.predictedTime}m`}
+                    </span>
+                  </div>
+                ))}
+              </div>
+            )}
+
             {/* New Task Suggestion */}
             {smartPlan.new_task_suggestion && (
               <div className="border-t border-border pt-4">
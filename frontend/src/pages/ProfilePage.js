@@ -8,6 +8,7 @@ import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogTrigger } from
 import { Flame, Calendar, TrendingUp, Clock, User, Award, Search, Pencil, Check, X, Users, UserPlus, UserMinus, UserCheck } from 'lucide-react';
 import { toast } from 'sonner';
 import { useAuth } from '../contexts/AuthContext';
+import { useNotificationEvents } from '../contexts/NotificationsContext';
 
 export const ProfilePage = ({ username, onNavigate }) => {
     const { user: currentUser, token, refreshUser } = useAuth();
@@ -82,6 +83,13 @@ export const ProfilePage = ({ username, onNavigate }) => {
         if (username) fetchProfile(username);
     }, [username, fetchProfile]);
 
+    // Someone followed us while we're looking at our own profile
+    useNotificationEvents((msg) => {
+        if (msg.type === 'new_follower' && currentUser && profile?.username === currentUser.username) {
+            setProfile(prev => ({ ...prev, followers_count: (prev.followers_count || 0) + 1 }));
+        }
+    });
+
     const handleFollow = async () => {
         if (!currentUser) return toast.error("Please login to follow");
 
@@ -0,0 +1,102 @@
+from datetime import date, timedelta
+from itertools import combinations
+
+import numpy as np
+import pytest
+
+from planner import _knapsack, _prune, build_plan
+from bench_planner import TYPE_TOTALS, brute_force_plan, make_tasks
+
+TODAY = date(2026, 10, 19)
+
+
+def best_by_search(values, costs, capacity, max_items):
+    best = 0.0
+    for k in range(1, max_items + 1):
+        for combo in combinations(range(len(values)), k):
+            if sum(costs[i] for i in combo) <= capacity:
+                best = max(best, sum(values[i] for i in combo))
+    return best
+
+
+def task(i, estimate=30, **fields):
+    return {"id": str(i), "title": f"Task {i}", "type": "Coding", "estimatedTime": estimate,
+            "totalFocusedTime": 0, "status": "todo", "createdAt": TODAY.isoformat(), **fields}
+
+
+def test_knapsack_beats_greedy():
+    # Greedy by value takes the 6 and then nothing fits; two 5s are worth more
+    values, costs = np.array([6.0, 5.0, 5.0]), np.array([3, 2, 2])
+    assert _knapsack(values, costs, 4, 3) == [1, 2]
+
+
+def test_knapsack_respects_item_limit():
+    values, costs = np.array([1.0, 2.0, 3.0, 4.0]), np.array([1, 1, 1, 1])
+    assert _knapsack(values, costs, 10, 2) == [2, 3]
+
+
+def test_knapsack_skips_items_over_capacity():
+    values, costs = np.array([100.0, 1.0]), np.array([11, 2])
+    assert _knapsack(values, costs, 10, 3) == [1]
+
+
+@pytest.mark.parametrize("capacity", [0, 1])
+def test_knapsack_nothing_fits(capacity):
+    assert _knapsack(np.array([5.0, 3.0]), np.array([2, 3]), capacity, 3) == []
+
+
+def test_knapsack_empty():
+    assert _knapsack(np.array([]), np.array([], dtype=np.int64), 10, 3) == []
+
+
+def test_knapsack_exact_fit_uses_whole_capacity():
+    values, costs = np.array([3.0, 4.0, 5.0]), np.array([3, 4, 5])
+    chosen = _knapsack(values, costs, 12, 3)
+    assert sorted(chosen) == [0, 1, 2]
+
+
+@pytest.mark.parametrize("seed", range(30))
+def test_knapsack_backtrack_matches_exhaustive_search(seed):
+    rng = np.random.default_rng(seed)
+    n = int(rng.integers(1, 9))
+    values = np.round(rng.uniform(0, 5, n), 4)
+    costs = rng.integers(1, 8, n)
+    capacity, max_items = int(rng.integers(0, 20)), int(rng.integers(1, 4))
+
+    chosen = _knapsack(values, costs, capacity, max_items)
+
+    # The backtracked indices are a valid plan worth what the DP found
+    assert len(set(chosen)) == len(chosen) <= max_items
+    assert costs[chosen].sum() <= capacity
+    assert values[chosen].sum() == pytest.approx(best_by_search(values, costs, capacity, max_items))
+
+
+def test_prune_keeps_best_per_cost():
+    values, costs = np.array([1.0, 5.0, 3.0, 4.0, 2.0]), np.array([2, 2, 2, 3, 3])
+    assert _prune([0, 1, 2, 3, 4], costs, values, 2) == [1, 2, 3, 4]
+
+
+@pytest.mark.parametrize("seed", range(25))
+def test_build_plan_is_optimal_on_small_backlogs(seed):
+    tasks = make_tasks(10, seed)
+    plan = build_plan(tasks, 180, TODAY.isoformat(), TYPE_TOTALS)
+    expected, _ = brute_force_plan(tasks, 180, TODAY.isoformat(), TYPE_TOTALS)
+    assert sum(t["score"] for t in plan["tasks"]) == pytest.approx(expected)
+
+
+def test_build_plan_explains_what_it_left_out():
+    tasks = [
+        task(0, estimate=30),
+        task(1, estimate=600),  # can't fit in a 2 hour day
+        task(2, estimate=30, scheduledDate=(TODAY + timedelta(days=3)).isoformat()),
+    ]
+    plan = build_plan(tasks, 120, TODAY.isoformat())
+    assert [t["id"] for t in plan["tasks"]] == ["0"]
+    excluded = {t["id"]: t["excluded"] for t in plan["alternatives"]}
+    assert excluded == {"1": "over_capacity", "2": "scheduled_later"}
+    assert plan["eligible"] == 2
+
+
+def test_build_plan_empty_backlog():
+    plan = build_plan([], 120, TODAY.isoformat())
+    assert plan["tasks"] == [] and plan["alternatives"] == [] and plan["total_predicted_time"] == 0
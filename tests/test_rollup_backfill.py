@@ -0,0 +1,123 @@
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from rollups import backfill_user, ensure_backfilled, record_session_complete, record_session_start
+
+USER = "u1"
+DAY = "2026-10-18"
+
+
+def at(hour, minute=0):
+    return f"{DAY}T{hour:02d}:{minute:02d}:00"
+
+
+@pytest.fixture
+def db():
+    return AsyncMongoMockClient()["rollup_tests"]
+
+
+async def rollup(db, date=DAY):
+    return await db.focus_rollups.find_one({"_id": f"{USER}:{date}"})
+
+
+async def solo_session(db, start, minutes, completed=True, live=True):
+    """A focus_sessions doc, and (live) the rollup updates the API makes for it"""
+    await db.focus_sessions.insert_one({"userId": USER, "startTime": start, "duration": minutes, "completed": completed})
+    if live:
+        await record_session_start(db, USER, start)
+        if completed:
+            await record_session_complete(db, USER, start, minutes, "Coding")
+
+
+async def room_credit(db, start, minutes):
+    await record_session_complete(db, USER, start, minutes, "Study", count_session=True)
+
+
+def totals(doc):
+    return doc["sessionCount"], doc["completedCount"], doc["totalMinutes"], doc["categoryMinutes"]
+
+
+@pytest.mark.asyncio
+async def test_backfill_keeps_room_credits_and_is_idempotent(db):
+    await room_credit(db, at(9), 25)
+    await solo_session(db, at(14), 30, live=False)  # from before rollups existed
+
+    await backfill_user(db, USER)
+    doc = await rollup(db)
+    assert totals(doc) == (2, 2, 55, {"Study": 25, "Coding": 30})
+    assert doc["minutes"][9] == 25 and doc["minutes"][14] == 30
+
+    await backfill_user(db, USER)
+    assert totals(await rollup(db)) == (2, 2, 55, {"Study": 25, "Coding": 30})
+
+
+@pytest.mark.asyncio
+async def test_backfill_doesnt_double_count_live_sessions(db):
+    await solo_session(db, at(10), 45)
+    await solo_session(db, at(11), 25, completed=False)
+    before = totals(await rollup(db))
+
+    await backfill_user(db, USER)
+    doc = await rollup(db)
+    assert totals(doc) == before == (2, 1, 45, {"Coding": 45})
+    assert doc["hourSessions"][11] == 1 and doc["hourCompleted"][11] == 0
+
+
+@pytest.mark.asyncio
+async def test_backfill_removes_solo_share_of_deleted_sessions(db):
+    await room_credit(db, at(8), 50)
+    await solo_session(db, at(16), 30)
+    await db.focus_sessions.delete_many({"userId": USER})
+
+    await backfill_user(db, USER)
+    doc = await rollup(db)
+    assert totals(doc) == (1, 1, 50, {"Study": 50, "Coding": 0})
+    assert doc["minutes"][16] == 0
+
+
+@pytest.mark.asyncio
+async def test_backfill_replaces_legacy_counters(db):
+    # A rollup from before solo shares were tracked: everything in it came from sessions,
+    # and it's out of date
+    minutes = [0] * 24
+    minutes[9] = 20
+    await db.focus_rollups.insert_one({
+        "_id": f"{USER}:{DAY}", "userId": USER, "date": DAY, "minutes": minutes,
+        "hourSessions": [1 if h == 9 else 0 for h in range(24)],
+        "hourCompleted": [1 if h == 9 else 0 for h in range(24)],
+        "sessionCount": 1, "completedCount": 1, "totalMinutes": 20, "categoryMinutes": {"Coding": 20},
+    })
+    await solo_session(db, at(9), 20, live=False)
+    await solo_session(db, at(13), 40, live=False)
+
+    await backfill_user(db, USER)
+    doc = await rollup(db)
+    assert doc["soloTracked"] is True
+    assert totals(doc) == (2, 2, 60, {"Coding": 60})
+    assert doc["minutes"][9] == 20 and doc["minutes"][13] == 40
+
+
+@pytest.mark.asyncio
+async def test_backfill_skips_sessions_without_a_usable_start(db):
+    await db.focus_sessions.insert_many([
+        {"userId": USER, "startTime": None, "duration": 30, "completed": True},
+        {"userId": USER, "startTime": "not a date", "duration": 30, "completed": True},
+    ])
+    assert await backfill_user(db, USER) == 0
+    assert await db.focus_rollups.count_documents({}) == 0
+
+
+@pytest.mark.asyncio
+async def test_ensure_backfilled_runs_once(db):
+    user_id = (await db.users.insert_one({"name": "Old"})).inserted_id
+    await db.focus_sessions.insert_one({"userId": str(user_id), "startTime": at(12), "duration": 25, "completed": True})
+    user = await db.users.find_one({"_id": user_id})
+
+    await ensure_backfilled(db, user)
+    user = await db.users.find_one({"_id": user_id})
+    assert user["rollupsBackfilled"] is True
+
+    # Marked, so a later call leaves the rollups alone even if sessions change
+    await db.focus_sessions.delete_many({})
+    await ensure_backfilled(db, user)
+    assert (await db.focus_rollups.find_one({"userId": str(user_id)}))["totalMinutes"] == 25
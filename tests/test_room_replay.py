@@ -0,0 +1,152 @@
+import asyncio
+
+import orjson
+import pytest
+
+import rooms_router
+from backplane import Backplane
+from rooms_router import ConnectionManager
+
+ROOM = "room1"
+
+
+class FakeSocket:
+    def __init__(self):
+        self.frames = []
+        self.closed = None
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        self.frames.append(orjson.loads(text))
+
+    async def close(self, code: int = 1000):
+        self.closed = code
+
+
+class KeepingBackplane(Backplane):
+    """Keeps what it publishes, like the mongo backplane's capped collection"""
+
+    def __init__(self):
+        super().__init__()
+        self.kept = []
+
+    async def publish(self, channel, message):
+        self.kept.append((channel, message))
+        await super().publish(channel, message)
+
+    async def history(self, channel, after_seq):
+        return [m for c, m in self.kept if c == channel and m["seq"] > after_seq]
+
+
+def use_backplane(monkeypatch, backplane):
+    manager = ConnectionManager()
+    backplane.subscribe("room", manager.deliver)
+    monkeypatch.setattr(rooms_router, "get_backplane", lambda: backplane)
+    return manager
+
+
+@pytest.fixture
+def backplane(monkeypatch):
+    backplane = Backplane()
+    backplane.manager = use_backplane(monkeypatch, backplane)
+    return backplane
+
+
+async def send_chat(manager, count, start=1):
+    for i in range(start, start + count):
+        await manager.broadcast({"type": "chat_message", "content": f"m{i}"}, ROOM)
+
+
+async def reconnect(manager, last_seq=None, stream=None):
+    socket = FakeSocket()
+    connection = await manager.connect(socket, ROOM, last_seq=last_seq, stream=stream)
+    for _ in range(10):
+        await asyncio.sleep(0)
+    await manager.leave(connection, ROOM)
+    session, *rest = socket.frames
+    assert session["type"] == "session"
+    return session, rest
+
+
+@pytest.mark.asyncio
+async def test_resume_replays_missed_frames_in_order(backplane):
+    manager = backplane.manager
+    await send_chat(manager, 5)
+    session, frames = await reconnect(manager, last_seq=2, stream=backplane.stream)
+    assert session["resumed"] is True and session["resync"] is False
+    assert session["seq"] == 5
+    assert [f["seq"] for f in frames] == [3, 4, 5]
+    assert [f["content"] for f in frames] == ["m3", "m4", "m5"]
+    assert manager.metrics["resumed"] == 1 and manager.metrics["replayed"] == 3
+
+
+@pytest.mark.asyncio
+async def test_resume_when_up_to_date(backplane):
+    manager = backplane.manager
+    await send_chat(manager, 3)
+    session, frames = await reconnect(manager, last_seq=3, stream=backplane.stream)
+    assert session["resumed"] is True and session["resync"] is False
+    assert frames == []
+
+
+@pytest.mark.asyncio
+async def test_fresh_connect_is_neither(backplane):
+    manager = backplane.manager
+    await send_chat(manager, 3)
+    session, frames = await reconnect(manager)
+    assert session["resumed"] is False and session["resync"] is False
+    assert session["stream"] == backplane.stream and session["seq"] == 3
+    assert frames == []
+
+
+@pytest.mark.asyncio
+async def test_gap_past_the_buffer_asks_for_resync(backplane, monkeypatch):
+    monkeypatch.setattr(rooms_router, "WS_REPLAY_BUFFER_SIZE", 3)
+    manager = backplane.manager
+    await send_chat(manager, 6)  # buffer keeps 4..6
+    session, frames = await reconnect(manager, last_seq=2, stream=backplane.stream)
+    assert session["resumed"] is False and session["resync"] is True
+    assert frames == []
+    assert manager.metrics["resyncs"] == 1
+
+    # The oldest frame still buffered is the first one missed: fine
+    session, frames = await reconnect(manager, last_seq=3, stream=backplane.stream)
+    assert session["resumed"] is True
+    assert [f["seq"] for f in frames] == [4, 5, 6]
+
+
+@pytest.mark.asyncio
+async def test_other_stream_or_future_seq_asks_for_resync(backplane):
+    manager = backplane.manager
+    await send_chat(manager, 3)
+    for last_seq, stream in ((1, "some-old-process"), (1, None), (9, backplane.stream)):
+        session, frames = await reconnect(manager, last_seq=last_seq, stream=stream)
+        assert session["resync"] is True, (last_seq, stream)
+        assert frames == []
+
+
+@pytest.mark.asyncio
+async def test_backplane_history_fills_in_past_the_buffer(monkeypatch):
+    monkeypatch.setattr(rooms_router, "WS_REPLAY_BUFFER_SIZE", 2)
+    backplane = KeepingBackplane()
+    manager = use_backplane(monkeypatch, backplane)
+    await send_chat(manager, 6)
+    session, frames = await reconnect(manager, last_seq=1, stream=backplane.stream)
+    assert session["resumed"] is True
+    assert [f["seq"] for f in frames] == [2, 3, 4, 5, 6]
+
+
+@pytest.mark.asyncio
+async def test_live_frames_follow_the_replay(backplane):
+    manager = backplane.manager
+    await send_chat(manager, 2)
+    socket = FakeSocket()
+    connection = await manager.connect(socket, ROOM, last_seq=1, stream=backplane.stream)
+    await send_chat(manager, 2, start=3)
+    for _ in range(10):
+        await asyncio.sleep(0)
+    await manager.leave(connection, ROOM)
+    assert [f.get("seq") for f in socket.frames] == [2, 2, 3, 4]  # session frame carries seq 2
+    assert socket.frames[0]["type"] == "session"
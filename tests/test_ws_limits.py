@@ -0,0 +1,108 @@
+import pytest
+
+import ws_limits
+from ws_limits import (
+    CATEGORIES, DEFAULT_CONNECTION_RATES, DEFAULT_ROOM_RATES, TokenBucket, frame_category, make_buckets,
+    parse_rates
+)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ws_limits.time, "monotonic", clock)
+    return clock
+
+
+def drain(bucket):
+    taken = 0
+    while bucket.take():
+        taken += 1
+    return taken
+
+
+def test_bucket_starts_full_and_drains(clock):
+    bucket = TokenBucket(2, 5)
+    assert drain(bucket) == 5
+    assert not bucket.take()
+
+
+def test_bucket_refills_at_rate(clock):
+    bucket = TokenBucket(2, 5)
+    drain(bucket)
+    clock.now += 0.4
+    assert not bucket.take()  # 0.8 tokens
+    clock.now += 0.1
+    assert bucket.take()
+    assert not bucket.take()
+    clock.now += 1.5
+    assert drain(bucket) == 3
+
+
+def test_bucket_refill_caps_at_burst(clock):
+    bucket = TokenBucket(2, 5)
+    drain(bucket)
+    clock.now += 3600
+    assert drain(bucket) == 5
+
+
+def test_wait_time(clock):
+    bucket = TokenBucket(4, 2)
+    assert bucket.wait_time() == 0
+    drain(bucket)
+    assert bucket.wait_time() == pytest.approx(0.25)
+    clock.now += 0.125
+    assert bucket.wait_time() == pytest.approx(0.125)
+    clock.now += 0.125
+    assert bucket.wait_time() == 0
+
+
+def test_zero_rate_never_refills(clock):
+    bucket = TokenBucket(0, 1)
+    assert bucket.take()
+    clock.now += 3600
+    assert not bucket.take()
+    assert bucket.wait_time() == float("inf")
+
+
+def test_parse_rates():
+    assert parse_rates("chat=2:10, timer=0.5") == {"chat": (2.0, 10.0), "timer": (0.5, 0.5)}
+    assert parse_rates("") == {}
+
+
+def test_parse_rates_merges_over_defaults():
+    rates = parse_rates("Chat=1:4", DEFAULT_CONNECTION_RATES)
+    assert rates["chat"] == (1.0, 4.0)
+    assert rates == {**parse_rates(DEFAULT_CONNECTION_RATES), "chat": (1.0, 4.0)}
+    assert parse_rates("", DEFAULT_ROOM_RATES) == parse_rates(DEFAULT_ROOM_RATES)
+
+
+@pytest.mark.parametrize("spec", ["chta=1:2", "chat", "chat=fast:2", "chat=1:lots"])
+def test_parse_rates_rejects_bad_specs(spec):
+    with pytest.raises(ValueError):
+        parse_rates(spec, DEFAULT_ROOM_RATES)
+
+
+def test_make_buckets_covers_every_category():
+    for spec, defaults in (("chat=1:1", DEFAULT_CONNECTION_RATES), ("timer=1:1", DEFAULT_ROOM_RATES)):
+        buckets = make_buckets(parse_rates(spec, defaults))
+        assert set(CATEGORIES) <= set(buckets)
+    assert "frames" in make_buckets(parse_rates("", DEFAULT_CONNECTION_RATES))
+
+
+def test_frame_category():
+    assert frame_category("chat_message") == "chat"
+    assert frame_category("timer_start") == "timer"
+    assert frame_category("timer_pause") == "timer"
+    assert frame_category("typing") == "generic"
+    assert frame_category("") == "generic"
+    for frame_type in ("chat_message", "timer_reset", "ping"):
+        assert frame_category(frame_type) in CATEGORIES